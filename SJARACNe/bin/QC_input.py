@@ -1,51 +1,231 @@
 #!/usr/bin/env python3
 
 import argparse
+import collections
+import multiprocessing
+import os
+import re
 import sys
 import logging
 
+# Bytes read at a time from the expression matrix; each chunk is extended to the end of its last line
+CHUNK_SIZE = 16 << 20
+# Chunks being validated per worker process at any time, which bounds the memory held by the reader
+CHUNKS_PER_WORKER = 2
+# Messages of ch_line_ending.py for the line ending of a first line
+LINE_ENDINGS = {b'\r\n': 'Windows line ending', b'\r': 'Mac line ending',
+                b'\n': 'Unix line ending. No need to convert'}
+
 
 def main():
     head_description = 'Validating input files\n'
     parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=head_description)
     parser.add_argument('-e', '--exp-file', metavar='STR', required=True, help='exp file')
     parser.add_argument('-g', '--probe-file', metavar='STR', required=True, help='probe file')
+    parser.add_argument('-n', '--normalize', action='store_true',
+                        help='also convert the line endings of both files to Unix ones, in place')
+    parser.add_argument('-w', '--workers', metavar='INT', type=int, default=1,
+                        help='number of processes validating the exp file (default: 1)')
     args = parser.parse_args()
     logging.basicConfig(level=logging.INFO)
 
-    check_exp(args.exp_file)
-    check_probe(args.probe_file)
+    if args.normalize:
+        prepare_exp(args.exp_file, workers=args.workers)
+        prepare_probe(args.probe_file)
+    else:
+        check_exp(args.exp_file, args.workers)
+        check_probe(args.probe_file)
+
+
+def check_exp(input_file, workers=1):
+    """ Validate an expression matrix: the header, the number of entries of every line and its values
+    Args:
+        input_file (str): expression matrix file
+        workers (int): number of processes validating the lines
+    """
+    scan_exp(input_file, None, workers)
+
 
+def prepare_exp(input_file, output_file=None, workers=1):
+    """ Validate an expression matrix, as check_exp(), and convert its line endings, as ch_line_ending(), in a single
+    pass over the file: it is read in large binary chunks, which are validated by worker processes while the reader
+    writes them out with Unix line endings. The error messages are those of the two separate steps.
+    Args:
+        input_file (str): expression matrix file
+        output_file (str or None): file with Unix line endings; input_file is replaced if it is None
+        workers (int): number of processes validating the lines
+    Returns:
+        output_file (str): file with Unix line endings, input_file itself if its first line ends with '\n'
+    """
+    if output_file is None or output_file == input_file:
+        tmp_file = '{}.tmp'.format(input_file)
+        if scan_exp(input_file, tmp_file, workers):
+            os.replace(tmp_file, input_file)
+        return input_file
+    return output_file if scan_exp(input_file, output_file, workers) else input_file
 
-def check_exp(input_file):
+
+def scan_exp(input_file, output_file, workers=1):
+    """ Validate an expression matrix, and write it with Unix line endings to output_file unless its first line
+    already ends with '\n' (or output_file is None). Exits with the message of check_exp() or ch_line_ending() on
+    the first invalid line.
+    Args:
+        input_file (str): expression matrix file
+        output_file (str or None): file with Unix line endings
+        workers (int): number of processes validating the lines
+    Returns:
+        bool: True if output_file was written
+    """
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    pending = collections.deque()
+    fout = None
     total_genes = 0
-    with open(input_file, 'r') as fin:
-        # process header
-        header = fin.readline()
-        words = header.split('\t')
-        if words[0] != 'isoformId' or words[1] != 'geneSymbol':
-            sys.exit('Error - Improper header in input file: first two column names must be isoformId and '
-                     'geneSymbol respectively.')
-        entries_per_line = len(words)
-        # process rest of the file, making sure tabs are splitting entries
-        for line in fin:
-            words = line.split('\t')
-            total_genes += 1  # add one gene to the total count per line of the exp file
-            if len(words) != entries_per_line:
-                logging.info("Line {} does not have an appropriate number of entries".format(total_genes+1))
-                sys.exit('Error - number of entries per line is not consistent across file. See line {}'.format(
-                    total_genes+1))
-            for word in words[2:]:
-                if ' ' in word:
-                    logging.info("Word with spaces is: {}".format(word))
-                    sys.exit('Error - spaces are not allowed, only tabs can delimit input file. Space '
-                             'found in line {}'.format(total_genes+1))
-                if word.count('.') > 1 and word.isnumeric():
-                    logging.info("Numeric entry missing spacing is: {}".format(word))
-                    sys.exit('Error - There are some numeric entries missing tab-spacing in line '
-                             '{}'.format(total_genes+1))
+    try:
+        with open(input_file, 'rb') as fin:
+            chunks = read_chunks(fin)
+            chunk = next(chunks, b'')
+            header, ending, chunk = split_first_line(chunk)
+            chunk = chunk or next(chunks, b'')
+            words = (header + b'\n' if ending else header).decode().split('\t')
+            if len(words) < 2 or words[0] != 'isoformId' or words[1] != 'geneSymbol':
+                sys.exit('Error - Improper header in input file: first two column names must be isoformId and '
+                         'geneSymbol respectively.')
+            entries_per_line = len(words)
+            if output_file is not None and ending in (b'\r\n', b'\r'):
+                fout = open(output_file, 'wb')
+                fout.write(header + b'\n')
+
+            while chunk or pending:
+                if chunk:
+                    task = (chunk, entries_per_line)
+                    pending.append(pool.apply_async(check_exp_lines, (task,)) if pool else check_exp_lines(task))
+                    if fout is not None:
+                        fout.write(unix_line_endings(chunk))
+                    chunk = next(chunks, b'')
+                # results are taken in file order, so that the first invalid line is reported
+                while pending and (not chunk or len(pending) >= CHUNKS_PER_WORKER * workers):
+                    result = pending.popleft()
+                    num_lines, error = result.get() if pool else result
+                    if error is not None:
+                        report_exp_error(total_genes + error[0] + 2, error[1], error[2])
+                    total_genes += num_lines
+    except SystemExit:
+        if fout is not None:
+            fout.close()
+            os.remove(output_file)
+        raise
+    finally:
+        if pool is not None:
+            pool.terminate()
     logging.info("Number of genes in expression matrix: {}".format(total_genes))
 
+    if output_file is not None:
+        if ending is None:
+            with open(input_file, 'rb') as fin:
+                sys.exit('Error - invalid line ending in the first line: {}'.format(fin.readline()))
+        print(LINE_ENDINGS[ending], file=sys.stderr)
+    if fout is not None:
+        fout.close()
+        print('Done', file=sys.stderr)
+    return fout is not None
+
+
+def read_chunks(fin, chunk_size=CHUNK_SIZE):
+    """ Read a binary file in chunks of whole lines; a '\r\n' line break is never split between two chunks
+    Args:
+        fin (file): file opened in binary mode
+        chunk_size (int): bytes read at a time
+    Yields:
+        bytes: the next lines, with their line breaks
+    """
+    rest = b''
+    while True:
+        block = fin.read(chunk_size)
+        if not block:
+            if rest:
+                yield rest
+            return
+        data = rest + block
+        cut = max(data.rfind(b'\n'), data.rfind(b'\r')) + 1
+        if cut == len(data) and data.endswith(b'\r'):
+            # the '\n' of a '\r\n' line break may be the next byte
+            data += fin.read(1)
+            if data.endswith(b'\n'):
+                cut += 1
+        if cut == 0:
+            rest = data
+        else:
+            rest = data[cut:]
+            yield data[:cut]
+
+
+def split_first_line(chunk):
+    """ Args:
+        chunk (bytes): the first chunk of a file, see read_chunks()
+    Returns:
+        line (bytes): the first line, without its line break
+        ending (bytes or None): its line break, b'\r\n', b'\r' or b'\n', None if the file has no line break
+        rest (bytes): the other lines of the chunk
+    """
+    match = re.search(rb'\r\n|\r|\n', chunk)
+    if match is None:
+        return chunk, None, b''
+    return chunk[:match.start()], match.group(), chunk[match.end():]
+
+
+def unix_line_endings(chunk):
+    """ Replace the Windows ('\r\n') and Mac ('\r') line breaks of a chunk with '\n' """
+    return chunk.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+
+
+def check_exp_lines(task):
+    """ Validate the lines of a chunk of an expression matrix, as check_exp() does
+    Args:
+        task (tuple): the chunk (bytes, see read_chunks()) and the number of entries of the header
+    Returns:
+        num_lines (int): number of lines of the chunk
+        error (tuple or None): index of the first invalid line in the chunk, the kind of error ('entries', 'space' or
+        'numeric') and the offending entry
+    """
+    chunk, entries_per_line = task
+    lines = unix_line_endings(chunk).split(b'\n')
+    if lines[-1] == b'':
+        lines.pop()
+    for i, line in enumerate(lines):
+        if line.count(b'\t') + 1 != entries_per_line:
+            return len(lines), (i, 'entries', None)
+        values = line.split(b'\t', 2)[2] if entries_per_line > 2 else b''
+        # the numeric test of check_exp() requires str.isnumeric(), which no entry holding a '.' passes, so only a
+        # line with a space can be invalid; its entries are checked one by one to find the first error
+        if b' ' in values:
+            for word in values.split(b'\t'):
+                if b' ' in word:
+                    return len(lines), (i, 'space', word.decode(errors='replace'))
+                word = word.decode(errors='replace')
+                if word.count('.') > 1 and word.isnumeric():
+                    return len(lines), (i, 'numeric', word)
+    return len(lines), None
+
+
+def report_exp_error(line_number, kind, word):
+    """ Exit with the message of check_exp() for an invalid line
+    Args:
+        line_number (int): line number in the file, 1 being the header
+        kind (str): kind of error, see check_exp_lines()
+        word (str): offending entry
+    """
+    if kind == 'entries':
+        logging.info("Line {} does not have an appropriate number of entries".format(line_number))
+        sys.exit('Error - number of entries per line is not consistent across file. See line {}'.format(
+            line_number))
+    if kind == 'space':
+        logging.info("Word with spaces is: {}".format(word))
+        sys.exit('Error - spaces are not allowed, only tabs can delimit input file. Space '
+                 'found in line {}'.format(line_number))
+    logging.info("Numeric entry missing spacing is: {}".format(word))
+    sys.exit('Error - There are some numeric entries missing tab-spacing in line '
+             '{}'.format(line_number))
+
 
 def check_probe(input_file):
     probe_size = 0
@@ -59,6 +239,39 @@ def check_probe(input_file):
     logging.info("Number of hub genes in probe file: {}".format(probe_size))
 
 
+def prepare_probe(input_file, output_file=None):
+    """ Validate a probe file, as check_probe(), and convert its line endings, as ch_line_ending(); the file is small
+    and read once
+    Args:
+        input_file (str): probe file
+        output_file (str or None): file with Unix line endings; input_file is replaced if it is None
+    Returns:
+        output_file (str): file with Unix line endings, input_file itself if its first line ends with '\n'
+    """
+    with open(input_file, 'rb') as fin:
+        data = fin.read()
+    lines = unix_line_endings(data).split(b'\n')
+    if lines[-1] == b'':
+        lines.pop()
+    if any(b' ' in line for line in lines):
+        sys.exit('Error - There are more than one word per line in this probe file')
+    logging.info("Number of hub genes in probe file: {}".format(len(lines)))
+
+    ending = split_first_line(data)[1]
+    if ending is None:
+        sys.exit('Error - invalid line ending in the first line: {}'.format(data.split(b'\n', 1)[0]))
+    print(LINE_ENDINGS[ending], file=sys.stderr)
+    if ending == b'\n':
+        return input_file
+    if output_file is None or output_file == input_file:
+        output_file = input_file
+    tmp_file = '{}.tmp'.format(output_file)
+    with open(tmp_file, 'wb') as fout:
+        fout.write(unix_line_endings(data))
+    os.replace(tmp_file, output_file)
+    print('Done', file=sys.stderr)
+    return output_file
+
+
 if __name__ == '__main__':
     main()
-
@@ -5,109 +5,251 @@ import os
 import argparse
 import math
 import logging
+import multiprocessing
 import numpy as np
 import pathlib
 import re
-from scipy import stats
+import struct
+import time
+import zlib
+from scipy import special, stats
 import pandas as pd
 
+# Magic bytes at the start of a network written by sjaracne.exe -F binary/zbinary
+BINARY_ADJ_MAGIC = b'SJARADJ1'
+
 
 def main():
     """ Handles arguments and invokes the driver function. """
     head_description = '''Create a consensus network based on SJARACNe bootstrap networks.'''
     parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
                                      description=head_description)
-    parser.add_argument('-a', '--adjmat-dir', metavar='STR', required=True, help='directory with adjacent matrix')
-    parser.add_argument('-p', '--p-value', metavar='STR', required=True, help='P value threshold')
+    parser.add_argument('-a', '--adjmat-dir', metavar='STR', help='directory with adjacent matrix')
+    parser.add_argument('-p', '--p-value', metavar='STR', required=True,
+                        help='P value threshold, or several separated by commas: the bootstrap networks are then '
+                             'aggregated once and the consensus network of each P value is written to the '
+                             'subdirectory pc_<P value> of the output directory')
     parser.add_argument('-e', '--exp-mat', metavar='STR', required=True, help='expression matrix file')
     parser.add_argument('-o', '--out-dir', metavar='STR', required=True, help='output directory')
     parser.add_argument('-s', '--subnet', metavar='STR', help='file with gene symbols of interest to build a subnet')
+    parser.add_argument('-w', '--workers', metavar='INT', type=int, default=1,
+                        help='number of processes parsing the bootstrap networks (default: 1)')
+    parser.add_argument('-c', '--accumulator', metavar='STR',
+                        help='file keeping the aggregated bootstrap networks between runs; networks already '
+                             'in it are not read again')
+    parser.add_argument('-n', '--expect', metavar='INT', type=int,
+                        help='wait for this many bootstrap networks, folding them in as they appear in the '
+                             'adjacent matrix directory')
+    parser.add_argument('--poll', metavar='SECONDS', type=float, default=10,
+                        help='interval between two scans of the adjacent matrix directory (default: 10)')
     args = parser.parse_args()
     if len(sys.argv) == 1:
         parser.print_help()
         sys.exit(0)
+    if args.adjmat_dir is None and args.accumulator is None:
+        parser.error('either -a/--adjmat-dir or -c/--accumulator is required')
 
     logging.basicConfig(level=logging.INFO)
+    p_values = args.p_value.split(',')
+    out_dirs = [args.out_dir] if len(p_values) == 1 else \
+        [os.path.join(args.out_dir, 'pc_{}'.format(p_value)) for p_value in p_values]
+    if len(p_values) > 1 and not os.path.isdir(args.out_dir):
+        os.mkdir(args.out_dir)
     logging.info('Create an initial consensus network ...')
-    network = create_consensus_network(args.adjmat_dir, args.p_value, args.out_dir)
+    networks = create_consensus_networks(args.adjmat_dir, p_values, out_dirs, args.workers, args.accumulator,
+                                         args.expect, args.poll)
     logging.info('Done')
     logging.info('Create an enhanced consensus network ...')
-    create_enhanced_consensus_network(args.exp_mat, network, args.out_dir, args.subnet)
+    create_enhanced_consensus_networks(args.exp_mat, networks, out_dirs, args.subnet)
     logging.info('All done')
 
 
-def create_consensus_network(adjmat_dir, p_value, out_dir):
+def create_consensus_network(adjmat_dir, p_value, out_dir, workers=1, accumulator=None, expect=None, poll=10):
     """ Create a consensus network based on SJARACNe bootstrap networks
     Args:
-        adjmat_dir: directory with adjacent matrix
+        adjmat_dir: directory with adjacent matrix, or None to use the accumulator alone
         p_value: P value threshold
         out_dir: output directory
+        workers: number of processes parsing the bootstrap networks
+        accumulator: file keeping the aggregated networks between runs, see ConsensusAccumulator
+        expect: number of networks to wait for, see ConsensusAccumulator.add_directory()
+        poll: seconds between two scans of adjmat_dir while waiting
     Returns:
-        none
+        path to the consensus network
     """
-    if not os.path.isdir(out_dir):
-        os.mkdir(out_dir)
+    return create_consensus_networks(adjmat_dir, [p_value], [out_dir], workers, accumulator, expect, poll)[0]
+
 
-    total_edge_in_runs = []
-    bootstrap_run_num = 0
-    parameters = ''
-    total_edge_number = {}
-    total_mi = {}
-
-    # Processing all bootstrap networks, summarizing them into corresponding variables
-    for adj_file in os.listdir(adjmat_dir):
-        total_edge_in_runs.append(0)
-        # Opening each bootstrap file
-        with open(pathlib.PurePath(adjmat_dir).joinpath(adj_file), "r") as fadj:
-            for line in fadj:
-                # Processing header lines
-                if line[0] == '>' and bootstrap_run_num == 0:
-                    parameters += line
-                # Processing non header lines representing the network
-                if line[0] != '>':
-                    tokens = line.split('\t')
-                    # Tokenizing each non header line with tab delimiter
-                    hub_id = tokens[0]  # First token is the hub id
-                    # Iterating on all adjacent genes: Odd indexes are the connected genes and even indexes are
-                    # the corresponding value to the edge between the hub gene and the gene with an odd index
-                    # appearing before the value in the tokens list
-                    for index in range(1, len(tokens), 2):
-                        key = hub_id + "----" + tokens[index]  # Creating a key for the edge
-                        if key in total_edge_number:
-                            # Updating the total number of edges observed for the particular key (edge)
-                            total_edge_number[key] += 1
-                            # Updating total MI between the genes involving in the particular key (edge)
-                            total_mi[key] += float(tokens[index + 1])
-                        else:
-                            # Initializing the total number of edges observed for the particular key (edge)
-                            # if the key (edge) is newly generated
-                            total_edge_number[key] = 1
-                            # Initializing total MI between the genes involving in the particular key (edge)
-                            # if the key (edge) is newly generated
-                            total_mi[key] = float(tokens[index + 1])
-                        # Increment the total number of edges processed so far for a bootstrap run
-                        total_edge_in_runs[bootstrap_run_num] += 1
-        # Increment the bootstrap file index
-        bootstrap_run_num += 1
+def create_consensus_networks(adjmat_dir, p_values, out_dirs, workers=1, accumulator=None, expect=None, poll=10):
+    """ Create the consensus networks of several P value thresholds from a single aggregation of the SJARACNe
+    bootstrap networks; each is the network create_consensus_network() writes for its P value
+    Args:
+        adjmat_dir: directory with adjacent matrix, or None to use the accumulator alone
+        p_values: P value thresholds
+        out_dirs: output directory of each P value
+        workers: number of processes parsing the bootstrap networks
+        accumulator: file keeping the aggregated networks between runs, see ConsensusAccumulator
+        expect: number of networks to wait for, see ConsensusAccumulator.add_directory()
+        poll: seconds between two scans of adjmat_dir while waiting
+    Returns:
+        list: path to the consensus network of each P value
+    """
+    for out_dir in out_dirs:
+        if not os.path.isdir(out_dir):
+            os.mkdir(out_dir)
+
+    consensus = ConsensusAccumulator(accumulator)
+    if adjmat_dir is not None:
+        consensus.add_directory(adjmat_dir, workers, expect, poll)
+    # the edges are sorted once for all the networks
+    order = sorted_edge_order(gene_names(consensus.gene_ids), consensus.edge_keys)
+    return [consensus.write(out_dir, p_value, order) for p_value, out_dir in zip(p_values, out_dirs)]
+
+
+class ConsensusAccumulator(object):
+    """ Per-edge aggregates of bootstrap networks: edge counts and MI sums, the number of edges
+    of each network and the names of the networks folded in. When given a path, the aggregates
+    are loaded from it and saved back, so that networks are read once however many times the
+    consensus is built, and memory is bounded by the aggregates rather than by the networks.
+    """
+
+    version = 1
+    checkpoint_runs = 10  # networks folded in between two saves
+
+    def __init__(self, path=None):
+        self.path = path
+        self.parameters = ''  # header lines of the first network
+        self.runs = []  # names of the networks, in the order they were folded in
+        self.total_edge_in_runs = []  # number of edges of each network
+        self.gene_ids = {}  # gene name -> integer id shared by all networks
+        self.edge_keys = np.empty(0, dtype=np.int64)  # sorted (hub id << 32 | target id) keys
+        self.edge_counts = np.empty(0, dtype=np.int64)  # number of networks with each edge
+        self.edge_mi = np.empty(0, dtype=np.float64)  # total MI of each edge
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def load(self):
+        with np.load(self.path) as data:
+            if int(data['version']) != self.version:
+                raise ValueError('{}: unsupported accumulator version {}'.format(self.path, int(data['version'])))
+            self.parameters = str(data['parameters'])
+            self.runs = data['runs'].tolist()
+            self.total_edge_in_runs = data['total_edge_in_runs'].tolist()
+            self.gene_ids = {gene: i for i, gene in enumerate(data['genes'].tolist())}
+            self.edge_keys = data['edge_keys']
+            self.edge_counts = data['edge_counts']
+            self.edge_mi = data['edge_mi']
+
+    def save(self):
+        """ Save the aggregates, replacing the file only once the new one is complete. """
+        if self.path is None:
+            return
+        temp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            np.savez(f, version=self.version, parameters=np.array(self.parameters),
+                     runs=np.array(self.runs, dtype=str), total_edge_in_runs=np.array(self.total_edge_in_runs, dtype=np.int64),
+                     genes=np.array(gene_names(self.gene_ids).tolist(), dtype=str), edge_keys=self.edge_keys,
+                     edge_counts=self.edge_counts, edge_mi=self.edge_mi)
+        os.replace(temp_path, self.path)
+
+    def add(self, name, network):
+        """ Fold in one network.
+        Args:
+            name (str): name of the network, usually its file name
+            network (tuple): the network, as returned by read_adjacency()
+        """
+        header, genes, hubs, targets, mis = network
+        # The header lines of the first run describe the parameters of all runs
+        if not self.runs:
+            self.parameters = header
+        run_keys = edge_key_array(intern_genes(self.gene_ids, genes), hubs, targets)
+        self.edge_keys, self.edge_counts, self.edge_mi = fold_run(self.edge_keys, self.edge_counts, self.edge_mi,
+                                                                  run_keys, mis)
+        self.total_edge_in_runs.append(len(run_keys))
+        self.runs.append(name)
+
+    def add_directory(self, adjmat_dir, workers=1, expect=None, poll=10):
+        """ Fold in the networks of a directory that are not in the aggregates yet, in sorted file
+        name order. If expect is given, keep scanning the directory every poll seconds until that
+        many networks have been folded in; a file is taken once its size and modification time
+        have not changed between two scans, so that networks still being written are left alone.
+        Args:
+            adjmat_dir (str): directory with adjacent matrix
+            workers (int): number of processes parsing the networks
+            expect (int): number of networks to wait for, or None
+            poll (float): seconds between two scans
+        """
+        done = set(self.runs)
+        last_seen = {}
+        while True:
+            ready = []
+            for adj_file in sorted(os.listdir(adjmat_dir)):
+                if adj_file in done:
+                    continue
+                status = os.stat(pathlib.PurePath(adjmat_dir).joinpath(adj_file))
+                seen = (status.st_size, status.st_mtime_ns)
+                if expect is None or last_seen.get(adj_file) == seen:
+                    ready.append(adj_file)
+                last_seen[adj_file] = seen
+
+            paths = [str(pathlib.PurePath(adjmat_dir).joinpath(adj_file)) for adj_file in ready]
+            for i, network in enumerate(parse_adjacency_files(paths, workers)):
+                self.add(ready[i], network)
+                done.add(ready[i])
+                if len(self.runs) % self.checkpoint_runs == 0:
+                    self.save()
+            if ready:
+                self.save()
+                logging.info('%d bootstrap networks folded in', len(self.runs))
+
+            if expect is None or len(self.runs) >= expect:
+                return
+            time.sleep(poll)
+
+    def write(self, out_dir, p_value, order=None):
+        """ Write the consensus network and its summary files, see write_consensus_network(). """
+        return write_consensus_network(out_dir, p_value, self.parameters, len(self.runs), self.total_edge_in_runs,
+                                       gene_names(self.gene_ids), self.edge_keys, self.edge_counts, self.edge_mi,
+                                       order)
+
+
+def write_consensus_network(out_dir, p_value, parameters, bootstrap_run_num, total_edge_in_runs,
+                            genes, edge_keys, edge_counts, edge_mi, order=None):
+    """ Write the consensus network and its summary files from the per-edge aggregates.
+    Args:
+        out_dir (str): output directory
+        p_value (str): P value threshold, Bonferroni corrected 0.05 if None
+        parameters (str): header lines of the first bootstrap network
+        bootstrap_run_num (int): number of bootstrap networks
+        total_edge_in_runs (list): number of edges of each bootstrap network
+        genes (numpy.ndarray): gene names, indexed by gene id
+        edge_keys (numpy.ndarray): edge keys, see edge_key_array()
+        edge_counts (numpy.ndarray): number of networks with each edge
+        edge_mi (numpy.ndarray): total MI of each edge
+        order (numpy.ndarray): sorted_edge_order() of the edges, computed if None
+    Returns:
+        none
+    """
+    num_edges = len(edge_keys)
 
     mu = 0
     sigma = 0
     # Computing mu and sigma across all bootstrap files
     for i in range(0, bootstrap_run_num):
-        prob = float(total_edge_in_runs[i]) / float(len(total_edge_number))
+        prob = float(total_edge_in_runs[i]) / float(num_edges)
         mu += prob
         sigma += prob * (1 - prob)
     sigma = np.sqrt(sigma)
 
     # Writing out the summary of all bootstrap files into bootstrap_info.txt file
     with open(pathlib.PurePath(out_dir).joinpath('bootstrap_info_.txt'), 'w') as f_info:
-        f_info.write('Total edge tested: {}\n'.format(str(len(total_edge_number))))
-        f_info.write('Bonferroni corrected (0.05) alpha: {}\n'.format(str(0.05 / len(total_edge_number))))
+        f_info.write('Total edge tested: {}\n'.format(str(num_edges)))
+        f_info.write('Bonferroni corrected (0.05) alpha: {}\n'.format(str(0.05 / num_edges)))
         f_info.write('mu: {}\n'.format(str(mu)))
         f_info.write('sigma: {}\n'.format(str(sigma)))
 
     # Setting p_threshold to the given value, if no given value, set to Bonferroni corrected value
-    p_threshold = 0.05 / len(total_edge_number)
+    p_threshold = 0.05 / num_edges
     if p_value is not None:
         p_threshold = float(p_value)
 
@@ -120,30 +262,216 @@ def create_consensus_network(adjmat_dir, p_value, out_dir):
     with open(pathlib.PurePath(out_dir).joinpath('parameter_info_.txt'), 'w') as parameter_file:
         parameter_file.write(parameters)
 
-    # Writing out the consensus network preserving edges with statistically significant support
+    # Decision making if an edge has enough support or not: compute the z score of normal
+    # distribution and the corresponding p-value for all edges at once
+    if sigma != 0:
+        z = (edge_counts - mu) / sigma
+    else:
+        z = np.full(num_edges, 100.0)
+    keep = uprob(z) < p_threshold
+
+    # Writing out the consensus network preserving edges with statistically significant support,
+    # in the order of the sorted 'hub----target' edge names
+    if order is None:
+        order = sorted_edge_order(genes, edge_keys)
+    order = order[keep[order]]
+    hubs = genes[edge_keys[order] >> 32]
+    targets = genes[edge_keys[order] & 0xffffffff]
+    mis = (edge_mi[order] / edge_counts[order]).tolist()
     with open(out_network_path, 'w') as f_consensus_network:
         header = 'source\ttarget\tMI\n'
         f_consensus_network.write(header)
+        for start in range(0, len(order), 100000):
+            end = start + 100000
+            f_consensus_network.write(''.join('{}\t{}\t{:.4f}\n'.format(gene1, gene2, mi) for gene1, gene2, mi
+                                              in zip(hubs[start:end], targets[start:end], mis[start:end])))
+    return out_network_path
 
-        # Iterate over all edges in a sorted fashion
-        for key in sorted(total_edge_number.keys()):
-            # Extract first two gene involving an edge from the key (edge)
-            tks = key.split('----')
-            gene1 = tks[0]
-            gene2 = tks[1]
 
-            # Compute the z score of normal distribution
-            z = float(total_edge_number[key] - mu) / float(sigma) if sigma != 0 else 100
+def parse_adjacency_files(paths, workers=1):
+    """ Parse bootstrap networks, in worker processes if workers > 1. The networks are returned
+    in the order of paths whatever the number of workers; at most two per worker are parsed
+    ahead of the one being returned, which bounds the memory held by parsed networks.
+    Args:
+        paths (list): paths to network files
+        workers (int): number of worker processes
+    Returns:
+        iterator over the read_adjacency() results of paths
+    """
+    if workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield read_adjacency(path)
+        return
+
+    with multiprocessing.Pool(min(workers, len(paths))) as pool:
+        pending = []
+        next_path = 0
+        while next_path < len(paths) or pending:
+            while next_path < len(paths) and len(pending) < 2 * workers:
+                pending.append(pool.apply_async(read_adjacency, (paths[next_path],)))
+                next_path += 1
+            yield pending.pop(0).get()
+
+
+def read_adjacency(path):
+    """ Read a bootstrap network in either format written by sjaracne.exe.
+    Args:
+        path (str): path to a network file
+    Returns:
+        see read_binary_adjacency()
+    """
+    if is_binary_adjacency(path):
+        return read_binary_adjacency(path)
+    return read_text_adjacency(path)
 
-            # Compute p-value corresponding to the z score
-            pval = uprob(z)
 
-            # Decision making if the edge has enough support or not and therefore if it has to be remained or removed
-            if pval < p_threshold:
-                # Computing MI corresponding to an edge remaining in the network
-                mi = '{0:.4f}'.format(float(total_mi[key]) / float(total_edge_number[key]))
-                f_consensus_network.write('{}\t{}\t{}\n'.format(gene1, gene2, mi))
-    return out_network_path
+def read_text_adjacency(path):
+    """ Read a network written by sjaracne.exe in the text (.adj) format: one line per hub
+    gene, holding the hub followed by (target, MI) pairs, tab-separated; '>' lines hold the
+    parameters of the run.
+    Args:
+        path (str): path to a text network file
+    Returns:
+        see read_binary_adjacency(); the genes are the ones appearing in the edges
+    """
+    header = ''
+    hubs = []
+    hub_sizes = []
+    targets = []
+    mis = []
+    with open(path, 'r') as fadj:
+        for line in fadj:
+            # Processing header lines
+            if line[0] == '>':
+                header += line
+                continue
+            tokens = line.split('\t')
+            if len(tokens) % 2 == 0:
+                raise ValueError('{}: a target gene has no MI value: {}'.format(path, line.rstrip()))
+            if len(tokens) == 1:
+                continue
+            # First token is the hub id, odd indexes are the connected genes and even indexes are
+            # the corresponding value to the edge between the hub gene and the gene before it
+            hubs.append(tokens[0])
+            hub_sizes.append(len(tokens) // 2)
+            targets.extend(tokens[1::2])
+            mis.extend(tokens[2::2])
+
+    # Intern the gene names of the network
+    gene_ids = {gene: i for i, gene in enumerate(dict.fromkeys(hubs + targets))}
+    hub_ids = np.fromiter(map(gene_ids.__getitem__, hubs), dtype=np.int32, count=len(hubs))
+    target_ids = np.fromiter(map(gene_ids.__getitem__, targets), dtype=np.int32, count=len(targets))
+    return (header, gene_names(gene_ids), np.repeat(hub_ids, hub_sizes), target_ids,
+            np.fromiter(map(float, mis), dtype=np.float64, count=len(mis)))
+
+
+def intern_genes(gene_ids, genes):
+    """ Map the genes of one network to ids shared by all networks.
+    Args:
+        gene_ids (dict): gene name -> shared id, extended with the new genes
+        genes (numpy.ndarray): gene names of one network
+    Returns:
+        numpy.ndarray: shared id of each gene of the network
+    """
+    intern = gene_ids.setdefault
+    return np.array([intern(gene, len(gene_ids)) for gene in genes], dtype=np.int64)
+
+
+def gene_names(gene_ids):
+    """ Invert intern_genes().
+    Args:
+        gene_ids (dict): gene name -> shared id
+    Returns:
+        numpy.ndarray: gene names, indexed by shared id
+    """
+    genes = np.empty(len(gene_ids), dtype=object)
+    genes[list(gene_ids.values())] = list(gene_ids.keys())
+    return genes
+
+
+def edge_key_array(gene_map, hubs, targets):
+    """ Encode edges as int64 keys: the shared hub id in the upper 32 bits and the shared
+    target id in the lower 32 bits.
+    Args:
+        gene_map (numpy.ndarray): shared id of each gene of the network
+        hubs (numpy.ndarray): hub gene of each edge, as an index into gene_map
+        targets (numpy.ndarray): target gene of each edge, as an index into gene_map
+    Returns:
+        numpy.ndarray: int64 key of each edge
+    """
+    return (gene_map[hubs] << 32) | gene_map[targets]
+
+
+def fold_run(edge_keys, edge_counts, edge_mi, run_keys, run_mi):
+    """ Add the edges of one bootstrap network to the per-edge aggregates. The MI of an
+    edge is added in the same order as the networks, and as the lines within a network, so
+    that the totals are exactly the ones of a sequential sum.
+    Args:
+        edge_keys (numpy.ndarray): sorted edge keys
+        edge_counts (numpy.ndarray): number of networks with each edge
+        edge_mi (numpy.ndarray): total MI of each edge
+        run_keys (numpy.ndarray): edge keys of the network
+        run_mi (numpy.ndarray): MI of each edge of the network
+    Returns:
+        the updated edge_keys, edge_counts and edge_mi
+    """
+    if len(run_keys) == 0:
+        return edge_keys, edge_counts, edge_mi
+
+    order = np.argsort(run_keys, kind='stable')
+    run_keys = run_keys[order]
+    run_mi = run_mi[order]
+
+    # An edge listed more than once in a network (a hub listed twice) is added once per
+    # occurrence, the first occurrences of all edges first
+    starts = np.flatnonzero(np.r_[True, run_keys[1:] != run_keys[:-1]])
+    occurrence = np.arange(len(run_keys)) - np.repeat(starts, np.diff(np.r_[starts, len(run_keys)]))
+
+    for k in range(occurrence.max() + 1):
+        if k == 0 and len(starts) == len(run_keys):
+            keys, mis = run_keys, run_mi
+        else:
+            keys, mis = run_keys[occurrence == k], run_mi[occurrence == k]
+
+        pos = np.searchsorted(edge_keys, keys)
+        found = pos < len(edge_keys)
+        found[found] = edge_keys[pos[found]] == keys[found]
+        edge_counts[pos[found]] += 1
+        edge_mi[pos[found]] += mis[found]
+
+        new = ~found
+        if new.any():
+            edge_keys = np.insert(edge_keys, pos[new], keys[new])
+            edge_counts = np.insert(edge_counts, pos[new], 1)
+            edge_mi = np.insert(edge_mi, pos[new], mis[new])
+
+    return edge_keys, edge_counts, edge_mi
+
+
+def sorted_edge_order(genes, edge_keys):
+    """ Order edges as the strings 'hub----target' sort, without building the strings.
+    Comparing hub + '----' first and the targets next gives that order, unless one hub + '----'
+    is a prefix of another, i.e. a gene name holds '----' or is another name followed by one to
+    three '-'; such names fall back to sorting the strings.
+    Args:
+        genes (numpy.ndarray): gene names, indexed by gene id
+        edge_keys (numpy.ndarray): edge keys, see edge_key_array()
+    Returns:
+        numpy.ndarray: indexes of the edges in sorted order
+    """
+    hub_ids = edge_keys >> 32
+    target_ids = edge_keys & 0xffffffff
+    names = set(genes)
+    if any('----' in gene or any(gene.endswith('-' * k) and gene[:-k] in names for k in range(1, 4))
+           for gene in genes):
+        keys = [genes[hub] + '----' + genes[target] for hub, target in zip(hub_ids, target_ids)]
+        return np.array(sorted(range(len(keys)), key=keys.__getitem__), dtype=np.int64)
+
+    hub_rank = np.empty(len(genes), dtype=np.int64)
+    hub_rank[sorted(range(len(genes)), key=lambda i: genes[i] + '----')] = np.arange(len(genes))
+    target_rank = np.empty(len(genes), dtype=np.int64)
+    target_rank[sorted(range(len(genes)), key=genes.__getitem__)] = np.arange(len(genes))
+    return np.argsort((hub_rank[hub_ids] << 32) | target_rank[target_ids], kind='stable')
 
 
 def create_enhanced_consensus_network(exp_mat, network, out_dir, subnet=None):
@@ -160,79 +488,276 @@ def create_enhanced_consensus_network(exp_mat, network, out_dir, subnet=None):
         os.mkdir(out_dir)
 
     # Build output file name based on input network file path
-    network_file_name = os.path.basename(network)
-    input_net_name_tokens = re.split("_|\.", network_file_name)
-    out_file_name = ("_".join(input_net_name_tokens[0:2]) + "_ncol_" +
-                     "_".join(input_net_name_tokens[3:len(input_net_name_tokens) - 1]))
+    out_file_name = enhanced_network_name(network)
     header = ("source", "target", "source.symbol", "target.symbol", "MI", "pearson",
               "spearman", "slope", "p-value")
 
     # Read in subnetwork file
-    subnet_list = []
-    out_subnet = None
+    subnet_set = None
     if subnet:
-        out_subnet = open(pathlib.PurePath(out_dir).joinpath("sub_" + out_file_name + ".txt"), "w")
         with open(subnet) as subnet_file:
-            for _id in subnet_file:
-                subnet_list.append(_id.split("\n")[0].strip())
+            subnet_set = set(_id.split("\n")[0].strip() for _id in subnet_file)
 
-    exp = pd.read_csv(exp_mat, sep="\t", index_col=0)
-
-    exp_dict = dict()
+    # Read in the consensus network
+    nodes1 = []
+    nodes2 = []
+    mis = []
     with open(network, 'r') as fnet:
         fnet.readline()
-        with open(pathlib.PurePath(out_dir).joinpath(out_file_name + ".txt"), 'w') as fout:
-            fout.write('\t'.join(header) + '\n')
-            for line in fnet:
-                tokens = line.split('\t')
-                node1 = tokens[0]
-                node2 = tokens[1]
-                mi = float(tokens[2])
-
-                if node1 in exp_dict:
-                    temp = exp_dict[node1]
-                    gene_symbol1 = temp[0]
-                    exp_values1 = temp[1]
-                else:
-                    exp_symbol_values1 = exp.loc[node1].values
-                    gene_symbol1 = str(exp_symbol_values1[0])
-                    exp_values1 = exp_symbol_values1[1:].astype(float)
-                    exp_dict[node1] = (gene_symbol1, exp_values1)
-
-                if node2 in exp_dict:
-                    temp = exp_dict[node2]
-                    gene_symbol2 = temp[0]
-                    exp_values2 = temp[1]
-                else:
-                    exp_symbol_values2 = exp.loc[node2].values
-                    gene_symbol2 = str(exp_symbol_values2[0])
-                    exp_values2 = exp_symbol_values2[1:].astype(float)
-                    exp_dict[node2] = (gene_symbol2, exp_values2)
-
-                slope, intercept, r, p, stderr = stats.linregress(exp_values1, exp_values2)
-                scc, sp = stats.spearmanr(exp_values1, exp_values2)
-                pcc, pp = stats.pearsonr(exp_values1, exp_values2)
-
-                row = (node1, node2, gene_symbol1, gene_symbol2,
-                       "{0:.4f}".format(mi), "{0:.4f}".format(pcc), "{0:.4f}".format(scc),
-                       "{0:.4f}".format(slope), "{0:.4f}".format(p))
-                fout.write('\t'.join(row) + '\n')
-
-                if out_subnet is not None:
-                    if gene_symbol1 in subnet_list or gene_symbol2 in subnet_list:
-                        out_subnet.write('\t'.join(row) + '\n')
+        for line in fnet:
+            tokens = line.split('\t')
+            nodes1.append(tokens[0])
+            nodes2.append(tokens[1])
+            mis.append(float(tokens[2]))
+
+    # Center and rank each gene of the network once: row i of values holds the centered
+    # expression values of genes[i], row i of ranks its centered ranks
+    exp = pd.read_csv(exp_mat, sep="\t", index_col=0)
+    genes = list(dict.fromkeys(nodes1 + nodes2))
+    rows = exp.index.get_indexer(genes)
+    if (rows < 0).any():
+        raise KeyError(genes[int(np.flatnonzero(rows < 0)[0])])
+    gene_index = {gene: i for i, gene in enumerate(genes)}
+    symbols = [str(symbol) for symbol in exp.iloc[rows, 0].tolist()]
+    raw_values = exp.iloc[rows, 1:].to_numpy(dtype=float)
+    num_samples = raw_values.shape[1]
+    if num_samples == 0:
+        raise ValueError("Inputs must not be empty.")
+    values = raw_values - raw_values.mean(axis=1, keepdims=True)
+    ranks = stats.rankdata(raw_values, axis=1)
+    ranks = ranks - ranks.mean(axis=1, keepdims=True)
+    sum_squares = np.einsum('ij,ij->i', values, values)
+    rank_sum_squares = np.einsum('ij,ij->i', ranks, ranks)
+
+    ids1 = np.array([gene_index[node] for node in nodes1], dtype=np.int64)
+    ids2 = np.array([gene_index[node] for node in nodes2], dtype=np.int64)
+    # Regressing on a constant source gene is not defined
+    if num_samples > 1 and np.any(np.ptp(raw_values, axis=1)[ids1] == 0):
+        raise ValueError("Cannot calculate a linear regression "
+                         "if all x values are identical")
+
+    # Compute the statistics of the edges in chunks of about 32 MB of expression values, and write
+    # them out, as scipy's linregress, pearsonr and spearmanr would give them
+    chunk_size = max(1, 2 ** 22 // max(num_samples, 1))
+    out_subnet = None
+    if subnet_set is not None:
+        out_subnet = open(pathlib.PurePath(out_dir).joinpath("sub_" + out_file_name + ".txt"), "w")
+    with open(pathlib.PurePath(out_dir).joinpath(out_file_name + ".txt"), 'w') as fout:
+        fout.write('\t'.join(header) + '\n')
+        for start in range(0, len(nodes1), chunk_size):
+            end = start + chunk_size
+            a = ids1[start:end]
+            b = ids2[start:end]
+            pcc, slope, p = edge_regression(values[a], values[b], sum_squares[a], sum_squares[b])
+            scc = edge_correlation(ranks[a], ranks[b], rank_sum_squares[a], rank_sum_squares[b])
+
+            lines = []
+            sub_lines = []
+            for i, (node1, node2, mi) in enumerate(zip(nodes1[start:end], nodes2[start:end], mis[start:end])):
+                gene_symbol1 = symbols[a[i]]
+                gene_symbol2 = symbols[b[i]]
+                row = '\t'.join((node1, node2, gene_symbol1, gene_symbol2,
+                                 "{0:.4f}".format(mi), "{0:.4f}".format(pcc[i]), "{0:.4f}".format(scc[i]),
+                                 "{0:.4f}".format(slope[i]), "{0:.4f}".format(p[i]))) + '\n'
+                lines.append(row)
+                if subnet_set is not None and (gene_symbol1 in subnet_set or gene_symbol2 in subnet_set):
+                    sub_lines.append(row)
+            fout.write(''.join(lines))
+            if out_subnet is not None:
+                out_subnet.write(''.join(sub_lines))
 
     if out_subnet is not None:
         out_subnet.close()
 
 
+def enhanced_network_name(network):
+    """ Args:
+        network (str): path to a consensus network file, e.g. consensus_network_3col_.txt
+    Returns:
+        str: name of its enhanced network, without the .txt extension, e.g. consensus_network_ncol_
+    """
+    input_net_name_tokens = re.split("_|\.", os.path.basename(network))
+    return ("_".join(input_net_name_tokens[0:2]) + "_ncol_" +
+            "_".join(input_net_name_tokens[3:len(input_net_name_tokens) - 1]))
+
+
+def create_enhanced_consensus_networks(exp_mat, networks, out_dirs, subnet=None):
+    """ Create the enhanced networks of consensus networks that are nested, as those of create_consensus_networks()
+    are: the statistics of the edges are computed once, for the largest network, and the enhanced network of every
+    other one keeps the lines of its edges, in the same order. Each is the network
+    create_enhanced_consensus_network() writes.
+    Args:
+        exp_mat (str): path to an expression matrix file
+        networks (list): paths to the consensus network files
+        out_dirs (list): path to the output directory of each network
+        subnet (str, optional): path to a gene symbol file
+    Return:
+        None
+    """
+    sizes = []
+    for network in networks:
+        with open(network, 'rb') as fnet:
+            sizes.append(sum(1 for _ in fnet))
+    largest = int(np.argmax(sizes))
+    create_enhanced_consensus_network(exp_mat, networks[largest], out_dirs[largest], subnet)
+
+    name = enhanced_network_name(networks[largest]) + '.txt'
+    prefixes = [''] + (['sub_'] if subnet else [])
+    for i, (network, out_dir) in enumerate(zip(networks, out_dirs)):
+        if i == largest:
+            continue
+        if not os.path.isdir(out_dir):
+            os.mkdir(out_dir)
+        with open(network) as fnet:
+            fnet.readline()
+            edges = set(tuple(line.split('\t', 2)[:2]) for line in fnet)
+        for prefix in prefixes:
+            src = pathlib.PurePath(out_dirs[largest]).joinpath(prefix + name)
+            dst = pathlib.PurePath(out_dir).joinpath(prefix + enhanced_network_name(network) + '.txt')
+            with open(src) as fin, open(dst, 'w') as fout:
+                # the subnet file has no header line
+                if not prefix:
+                    fout.write(fin.readline())
+                fout.writelines(line for line in fin if tuple(line.split('\t', 2)[:2]) in edges)
+
+
+def edge_correlation(x, y, x_sum_squares, y_sum_squares):
+    """ Pearson correlation of centered vectors, pairwise over rows, clipped to [-1, 1].
+    Args:
+        x, y (numpy.ndarray): centered vectors, one per row
+        x_sum_squares, y_sum_squares (numpy.ndarray): sum of squares of each row
+    Returns:
+        numpy.ndarray: correlation of each pair of rows, nan if a row is constant
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.einsum('ij,ij->i', x, y) / np.sqrt(x_sum_squares * y_sum_squares)
+    return np.clip(r, -1.0, 1.0)
+
+
+def edge_regression(x, y, x_sum_squares, y_sum_squares):
+    """ Linear regression of y on x, pairwise over rows, as scipy.stats.linregress computes it.
+    Args:
+        x, y (numpy.ndarray): centered vectors, one per row
+        x_sum_squares, y_sum_squares (numpy.ndarray): sum of squares of each row
+    Returns:
+        r (numpy.ndarray): correlation coefficient of each pair
+        slope (numpy.ndarray): slope of each regression
+        p (numpy.ndarray): two-sided p-value of each slope
+    """
+    TINY = 1.0e-20
+    n = x.shape[1]
+    sum_xy = np.einsum('ij,ij->i', x, y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.clip(sum_xy / np.sqrt(x_sum_squares * y_sum_squares), -1.0, 1.0)
+        # A constant y has no correlation with x
+        r = np.where(y_sum_squares == 0, np.where(sum_xy == 0, np.nan, 0.0), r)
+        slope = sum_xy / x_sum_squares
+        if n == 2:
+            p = np.where(y[:, 0] == y[:, 1], 1.0, 0.0)
+        else:
+            df = n - 2
+            t = r * np.sqrt(df / ((1.0 - r + TINY) * (1.0 + r + TINY)))
+            p = 2 * special.stdtr(df, -np.abs(t))
+    return r, slope, p
+
+
+def is_binary_adjacency(path):
+    """ Tell whether a network file was written in the binary format of sjaracne.exe.
+    Args:
+        path (str): path to a network file
+    Returns:
+        bool: True for a binary network, False for a text (.adj) one
+    """
+    with open(path, 'rb') as f:
+        return f.read(len(BINARY_ADJ_MAGIC)) == BINARY_ADJ_MAGIC
+
+
+def read_binary_adjacency(path):
+    """ Read a network written by sjaracne.exe -F binary or -F zbinary. The layout is
+    described above Matrix::writeBinary() in SJARACNe/src/matrix.cpp.
+    Args:
+        path (str): path to a binary network file
+    Returns:
+        header (str): the '>' parameter lines of the network
+        genes (numpy.ndarray): gene ids (str), indexed by the hub and target ids
+        hubs (numpy.ndarray): hub gene id of each edge (int32)
+        targets (numpy.ndarray): target gene id of each edge (int32)
+        mis (numpy.ndarray): MI of each edge (float64), as the text format would hold it
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if data[:len(BINARY_ADJ_MAGIC)] != BINARY_ADJ_MAGIC:
+        raise ValueError('{} is not a binary SJARACNe network'.format(path))
+    flags, raw_size, stored_size = struct.unpack_from('<IQQ', data, 8)
+    body = data[28:28 + stored_size]
+    if flags & 1:
+        body = zlib.decompress(body)
+    if len(body) != raw_size:
+        raise ValueError('{} is truncated'.format(path))
+
+    pos = 0
+    header_length, = struct.unpack_from('<I', body, pos)
+    pos += 4
+    header = body[pos:pos + header_length].decode()
+    pos += header_length
+
+    num_genes, = struct.unpack_from('<I', body, pos)
+    pos += 4
+    genes = []
+    for _ in range(num_genes):
+        length, = struct.unpack_from('<I', body, pos)
+        pos += 4
+        genes.append(body[pos:pos + length].decode())
+        pos += length
+    genes = np.array(genes, dtype=object)
+
+    num_edges, = struct.unpack_from('<Q', body, pos)
+    pos += 8
+    hubs = np.frombuffer(body, dtype='<i4', count=num_edges, offset=pos)
+    targets = np.frombuffer(body, dtype='<i4', count=num_edges, offset=pos + 4 * num_edges)
+    mis = np.frombuffer(body, dtype='<f4', count=num_edges, offset=pos + 8 * num_edges)
+
+    return header, genes, hubs, targets, restore_text_mi(mis)
+
+
+def restore_text_mi(mis):
+    """ Turn float32 MI values back into the numbers parsed from the text format.
+    sjaracne.exe stores each MI rounded to the six significant digits it writes in a
+    text network; float32 keeps more than six digits, so rounding again gives the
+    decimal back, and dividing two exact integers yields the correctly rounded double.
+    Args:
+        mis (numpy.ndarray): float32 MI values
+    Returns:
+        numpy.ndarray: float64 MI values
+    """
+    mis = np.asarray(mis, dtype=np.float64)
+    restored = np.zeros_like(mis)
+    nonzero = (mis != 0) & np.isfinite(mis)
+    x = mis[nonzero]
+    exponent = np.floor(np.log10(np.abs(x))).astype(np.int64)
+    digits = 5 - exponent
+    up = digits >= 0
+    scale_up = 10.0 ** np.where(up, digits, 0)
+    scale_down = 10.0 ** np.where(up, 0, -digits)
+    restored[nonzero] = np.where(up, np.round(x * scale_up) / scale_up,
+                                 np.round(x / scale_down) * scale_down)
+    restored[~np.isfinite(mis)] = mis[~np.isfinite(mis)]
+    return restored
+
+
 def uprob(n):
     """ Implemented in statistics.py module inspired by Statistics::Distributions::uprob function in perl.
     Args:
-        n (float): z-score
+        n (float or numpy.ndarray): z-score(s)
     Returns:
-        p (float): p value
+        p (float or numpy.ndarray): p value(s)
     """
+    if np.ndim(n) > 0:
+        # z-scores take few distinct values (one per number of supporting networks), so the
+        # scalar formula is evaluated once per distinct value
+        values, inverse = np.unique(np.asarray(n, dtype=np.float64), return_inverse=True)
+        return np.array([uprob(float(value)) for value in values], dtype=np.float64)[inverse.ravel()].reshape(np.shape(n))
     p = 0
     if abs(n) < 1.9:
         p = (1 + abs(n) * (0.049867347 + abs(n) * (
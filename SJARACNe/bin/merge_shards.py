@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import shutil
+import argparse
+
+# Header line written by sjaracne.exe -x i/n
+SHARD_LINE = re.compile(r'^>\s+Shard\s+(\d+)/(\d+)\s*$')
+# Header lines naming an input file; a workflow engine may stage the inputs of every shard at another path
+FILE_LINE = re.compile(r'^(>\s+(?:Input|Subnetwork) file\s+)(.*?)\s*$')
+
+
+def main():
+    """ Handles arguments and invokes the driver function. """
+    head_description = '''Merge the shards of a network, computed by sjaracne.exe -x i/n, into the network of the
+unsharded run.'''
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     description=head_description)
+    parser.add_argument('-o', '--output-file', metavar='STR', required=True, help='merged network (.adj)')
+    parser.add_argument('shard_files', metavar='SHARD', nargs='+', help='the .adj file of each shard, in any order')
+    args = parser.parse_args()
+    try:
+        merge_shards(args.shard_files, args.output_file)
+    except ValueError as e:
+        sys.exit('Error - {}'.format(e))
+
+
+def read_shard_header(shard_file):
+    """ Read the header ('>' lines) of a shard
+    Args:
+        shard_file (str): .adj file written by sjaracne.exe -x i/n
+    Returns:
+        shard (int): i
+        num_shards (int): n
+        header (list): the header lines, without the shard line
+    """
+    shard, header = None, []
+    with open(shard_file) as f:
+        for line in f:
+            if not line.startswith('>'):
+                break
+            match = SHARD_LINE.match(line)
+            if match:
+                shard = int(match.group(1)), int(match.group(2))
+            else:
+                header.append(line)
+    if shard is None:
+        raise ValueError('{} is not a shard of a network'.format(shard_file))
+    return shard[0], shard[1], header
+
+
+def same_network(header, other):
+    """ Args:
+        header (list): header lines of a shard, see read_shard_header()
+        other (list): header lines of another shard
+    Returns:
+        bool: True if the two shards are of the same network: the headers are equal, except for the directories of
+        the input files
+    """
+    def key(line):
+        match = FILE_LINE.match(line)
+        return match.group(1) + os.path.basename(match.group(2)) if match else line
+    return len(header) == len(other) and all(key(a) == key(b) for a, b in zip(header, other))
+
+
+def merge_shards(shard_files, output_file):
+    """ Merge the shards of a network into one .adj file, identical to the network written by the unsharded run.
+    The shards must be a complete set, i/n for i = 1 .. n, run with the same parameters; the header is that of the
+    first shard given.
+    Args:
+        shard_files (list): the .adj file of each shard, in any order
+        output_file (str): merged network
+    Returns:
+        output_file (str): merged network
+    """
+    shards = {}
+    first_header = None
+    for shard_file in shard_files:
+        shard, num_shards, header = read_shard_header(shard_file)
+        if first_header is None:
+            first_header, expected = header, num_shards
+        elif not same_network(header, first_header) or num_shards != expected:
+            raise ValueError('{} is not a shard of the same network as {}'.format(shard_file, shard_files[0]))
+        if shard in shards:
+            raise ValueError('shard {}/{} is given twice: {} and {}'.format(shard, num_shards, shards[shard],
+                                                                          shard_file))
+        shards[shard] = shard_file
+    missing = sorted(set(range(1, expected + 1)) - set(shards))
+    if missing:
+        raise ValueError('missing shards {} of {}'.format(', '.join(str(i) for i in missing), expected))
+
+    with open(output_file, 'w') as fout:
+        fout.writelines(first_header)
+        for shard in range(1, expected + 1):
+            with open(shards[shard]) as fin:
+                for line in fin:
+                    if not line.startswith('>'):
+                        fout.write(line)
+                        break
+                shutil.copyfileobj(fin, fout)
+    return output_file
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import hashlib
+import logging
+import multiprocessing
+import numpy as np
+import pandas as pd
+from SJARACNe import engine
+
+# Fractions of the sample count at which the null MI is drawn: the slope of its tail changes linearly with the number
+# of samples, which takes two sample sizes or more to fit
+SIZE_FRACTIONS = (0.5, 0.75, 1.0)
+# Tail of the null MI that is fitted: from the TAIL largest fraction of the draws down to the MIN_COUNT largest draws
+TAIL = 0.1
+MIN_COUNT = 10
+# Points of the tail fitted per sample size, evenly spaced in log survival
+TAIL_POINTS = 50
+# Version of the calibration, part of the cache key; to be increased when its results change
+VERSION = 1
+
+
+def calibrate_threshold(exp_file, out_dir, num_samples=None, pairs=20000, permutations=5, bootstrap=True, seed=1,
+                        npar_limit=20, threads=None, cache_dir=None):
+    """ Fit the model of the MI threshold of sjaracne.exe -p, ln(p) = alpha + (beta + gamma * n) * MI for n samples,
+    to the null MI of a dataset, and write it to out_dir/config_threshold.txt. Random gene pairs of the dataset are
+    drawn at several sample sizes around num_samples, with the values of one gene permuted, and their MI computed by
+    the adaptive partitioning kernel of the engine on all threads; the tail of the null MI is fitted at every size.
+    config_kernel.txt of the default configuration is copied next to it, so that out_dir is a configuration directory
+    (-c, sjaracne.exe -H).
+    Args:
+        exp_file (str): expression matrix file
+        out_dir (str): directory of config_threshold.txt, created if missing
+        num_samples (int or None): number of samples of the networks to be built, at most that of the dataset (None:
+        all the samples of the dataset)
+        pairs (int): number of gene pairs drawn at each sample size
+        permutations (int): number of permutations of each pair
+        bootstrap (bool): resample the samples of each pair with replacement, as the bootstrap networks of the
+        workflow do (sjaracne.exe -r 1)
+        seed (int): seed of the random draws
+        npar_limit (int): maximum allowed value of npar (see '-N', the depth of sjaracne)
+        threads (int or None): number of threads computing the MI (None: all CPUs)
+        cache_dir (str or None): directory keeping the fits between runs, under a hash of the dataset (its contents),
+        num_samples and the other arguments; a fit found in it is not computed again
+    Returns:
+        config_file (str): path of config_threshold.txt
+        model (tuple): alpha, beta and gamma, as written
+    """
+    fingerprint = file_fingerprint(exp_file)
+    with open(exp_file) as f:
+        num_arrays = len(f.readline().rstrip('\r\n').split('\t')) - 2
+    if num_samples is None:
+        num_samples = num_arrays
+    sizes = sample_sizes(num_samples, num_arrays)
+
+    key = hashlib.sha256('{}\0{}\0{}\0{}\0{}\0{}\0{}\0{}\0{}'.format(
+        VERSION, fingerprint, file_fingerprint(engine.LIBRARY_PATH), num_samples, pairs, permutations, bootstrap,
+        seed, npar_limit).encode()).hexdigest()
+    os.makedirs(out_dir, exist_ok=True)
+    config_file = os.path.join(out_dir, 'config_threshold.txt')
+    cached = os.path.join(cache_dir, key + '.txt') if cache_dir else None
+    if cached and os.path.exists(cached):
+        logging.info('Calibration of {} for {} samples found in {}'.format(exp_file, num_samples, cached))
+        shutil.copyfile(cached, config_file)
+    else:
+        exp = pd.read_csv(exp_file, sep='\t')
+        values = exp.iloc[:, 2:].to_numpy(dtype=engine.value_dtype())
+        if values.shape[0] < 2:
+            raise ValueError('at least two genes are required to calibrate the MI threshold')
+        rng = np.random.default_rng(seed)
+        x = rng.integers(0, values.shape[0], pairs)
+        y = rng.integers(0, values.shape[0] - 1, pairs)
+        y[y >= x] += 1
+        x, y = np.repeat(x, permutations), np.repeat(y, permutations)
+        nulls = {}
+        for i, size in enumerate(sizes):
+            nulls[size] = engine.null_mi(values, x, y, size, bootstrap, seed + i, npar_limit,
+                                         threads or multiprocessing.cpu_count())
+            logging.info('Null MI of {} pairs drawn for {} samples'.format(len(x), size))
+        write_threshold_model(config_file, fit_threshold_model(nulls), '{}, {} samples, sha256 {}'.format(
+            os.path.basename(exp_file), num_samples, fingerprint[:12]))
+        if cached:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp = '{}.{}.tmp'.format(cached, os.getpid())
+            shutil.copyfile(config_file, tmp)
+            os.replace(tmp, cached)
+
+    # the constants as written, the same on a cache hit
+    model = read_threshold_model(config_file)
+    kernel_file = os.path.join(engine.DEFAULT_CONFIG_DIR, 'config_kernel.txt')
+    if os.path.abspath(out_dir) != os.path.abspath(engine.DEFAULT_CONFIG_DIR):
+        shutil.copyfile(kernel_file, os.path.join(out_dir, 'config_kernel.txt'))
+    logging.info('MI threshold model of {} samples: alpha {:.6g}, beta {:.6g}, gamma {:.6g}'.format(num_samples,
+                                                                                                   *model))
+    return config_file, model
+
+
+def sample_sizes(num_samples, num_arrays):
+    """ Args:
+        num_samples (int): number of samples of the networks to be built
+        num_arrays (int): number of samples of the dataset
+    Returns:
+        list: sample sizes at which the null MI is drawn, see SIZE_FRACTIONS
+    """
+    if num_samples > num_arrays:
+        raise ValueError('{} samples requested, but the dataset has {}'.format(num_samples, num_arrays))
+    sizes = sorted(set(int(round(num_samples * fraction)) for fraction in SIZE_FRACTIONS))
+    sizes = [size for size in sizes if size >= 2]
+    if len(sizes) < 2:
+        raise ValueError('too few samples to calibrate the MI threshold: {}'.format(num_samples))
+    return sizes
+
+
+def fit_threshold_model(nulls):
+    """ Fit ln P(MI >= t) = alpha + (beta + gamma * n) * t by least squares to the tail of the null MI, see TAIL
+    Args:
+        nulls (dict): the null MI (numpy.ndarray) drawn for each number of samples n
+    Returns:
+        tuple: alpha, beta and gamma, as in config_threshold.txt
+    """
+    rows, targets = [], []
+    for size, mis in nulls.items():
+        mis = np.sort(mis)[::-1]
+        top = int(len(mis) * TAIL)
+        if top <= MIN_COUNT:
+            raise ValueError('too few null MI drawn for {} samples: {}'.format(size, len(mis)))
+        ranks = np.unique(np.geomspace(MIN_COUNT, top, TAIL_POINTS).astype(int))
+        tail = mis[ranks - 1]
+        rows.append(np.column_stack([np.ones(len(ranks)), tail, size * tail]))
+        targets.append(np.log(ranks / len(mis)))
+    (alpha, beta, gamma), _, _, _ = np.linalg.lstsq(np.vstack(rows), np.concatenate(targets), rcond=None)
+    if any(beta + gamma * size >= 0 for size in nulls):
+        raise ValueError('the null MI does not decrease in probability: the dataset cannot be calibrated')
+    return float(alpha), float(beta), float(gamma)
+
+
+def write_threshold_model(config_file, model, name):
+    """ Write config_threshold.txt, as read by findThreshold() of sjaracne.exe
+    Args:
+        config_file (str): path of the file
+        model (tuple): alpha, beta and gamma
+        name (str): description of the fit, written in the header line
+    """
+    with open(config_file, 'w') as f:
+        f.write('> {}\n{:.6g}\t{:.6g}\t{:.6g}\n'.format(name, *model))
+
+
+def read_threshold_model(config_file):
+    """ Returns:
+        tuple: alpha, beta and gamma of config_threshold.txt, the first line that is not a header ('>') line
+    """
+    with open(config_file) as f:
+        for line in f:
+            if not line.startswith('>'):
+                return tuple(float(value) for value in line.split()[:3])
+    raise ValueError('Configuration file format error: {}'.format(config_file))
+
+
+def file_fingerprint(path):
+    """ SHA-256 of the contents of a file """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+import ctypes
+import os
+import numpy as np
+
+# Shared library built next to sjaracne.exe by "make" (or "make lib") in SJARACNe/
+LIBRARY_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'bin', 'libsjaracne.so')
+DEFAULT_CONFIG_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'config')
+
+# Phases of sjaracne_phase_stats()
+PHASES = ['mi', 'dpi', 'write']
+
+_library = None
+
+
+def load_library(path=LIBRARY_PATH):
+    """ Load the SJARACNe engine and declare the functions of SJARACNe/src/sjaracne.h. The
+    library is loaded once per process; ctypes releases the GIL while an engine function runs,
+    so networks can be built from several Python threads at once.
+    Args:
+        path (str): path to libsjaracne.so
+    Returns:
+        ctypes.CDLL: the loaded library
+    """
+    global _library
+    if _library is not None:
+        return _library
+
+    lib = ctypes.CDLL(path)
+    int_p = ctypes.POINTER(ctypes.c_int)
+    double_p = ctypes.POINTER(ctypes.c_double)
+    char_pp = ctypes.POINTER(ctypes.c_char_p)
+
+    lib.sjaracne_value_size.restype = ctypes.c_int
+    lib.sjaracne_value_size.argtypes = []
+    lib.sjaracne_find_threshold.restype = ctypes.c_double
+    lib.sjaracne_find_threshold.argtypes = [ctypes.c_char_p, ctypes.c_double, ctypes.c_int,
+                                            ctypes.c_char_p, ctypes.c_int]
+    lib.sjaracne_build_network.restype = ctypes.c_void_p
+    lib.sjaracne_build_network.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int, char_pp, char_pp,
+                                           int_p, ctypes.c_int, int_p, ctypes.c_int,
+                                           ctypes.c_double, ctypes.c_double, ctypes.c_int, ctypes.c_int,
+                                           ctypes.c_double, ctypes.c_int, ctypes.c_int,
+                                           ctypes.c_char_p, ctypes.c_int]
+    lib.sjaracne_num_edges.restype = ctypes.c_longlong
+    lib.sjaracne_num_edges.argtypes = [ctypes.c_void_p]
+    lib.sjaracne_get_edges.restype = None
+    lib.sjaracne_get_edges.argtypes = [ctypes.c_void_p, int_p, int_p, double_p]
+    lib.sjaracne_phase_stats.restype = None
+    lib.sjaracne_phase_stats.argtypes = [ctypes.c_void_p, ctypes.c_int, double_p, double_p,
+                                         ctypes.POINTER(ctypes.c_longlong)]
+    lib.sjaracne_write_network.restype = ctypes.c_int
+    lib.sjaracne_write_network.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p,
+                                           ctypes.c_char_p, ctypes.c_int]
+    lib.sjaracne_free_network.restype = None
+    lib.sjaracne_free_network.argtypes = [ctypes.c_void_p]
+    lib.sjaracne_pairwise_mi.restype = ctypes.c_int
+    lib.sjaracne_pairwise_mi.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int, int_p, int_p,
+                                         ctypes.c_longlong, ctypes.c_int, double_p, ctypes.c_char_p, ctypes.c_int]
+    lib.sjaracne_null_mi.restype = ctypes.c_int
+    lib.sjaracne_null_mi.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int, int_p, int_p, ctypes.c_longlong,
+                                     ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, double_p,
+                                     ctypes.c_char_p, ctypes.c_int]
+
+    _library = lib
+    return lib
+
+
+def value_dtype():
+    """ Returns:
+        numpy.dtype: type of the expression values stored by the engine, float64, or float32 if
+        the library was built with make FLOAT_VALUES=1
+    """
+    return np.dtype(np.float32 if load_library().sjaracne_value_size() == 4 else np.float64)
+
+
+def mi_threshold(p_value, num_arrays, config_dir=DEFAULT_CONFIG_DIR):
+    """ MI threshold for a p-value, as determined by sjaracne.exe -p.
+    Args:
+        p_value (float): p-value of the MI threshold
+        num_arrays (int): number of arrays (samples)
+        config_dir (str): directory containing config_threshold.txt
+    Returns:
+        float: the MI threshold
+    """
+    error = ctypes.create_string_buffer(1024)
+    threshold = load_library().sjaracne_find_threshold(config_dir.encode(), p_value, num_arrays,
+                                                      error, len(error))
+    if threshold < 0:
+        raise RuntimeError(error.value.decode())
+    return threshold
+
+
+def build_network(exp, gene_ids, gene_symbols=None, hubs=None, tfs=None, threshold=None, p_value=1.0,
+                  eps=1.0, bootstrap=False, seed=1, correction=0.0, npar_limit=20, threads=1,
+                  config_dir=DEFAULT_CONFIG_DIR, out_file=None, stats=None):
+    """ Build one network in memory, as sjaracne.exe would from the same data and parameters.
+    The expression values are handed to the engine without a copy when exp is a C-contiguous
+    array of value_dtype(); the engine then works on its own copy, to which the bootstrap
+    noise is added.
+    Args:
+        exp (numpy.ndarray): expression values, one row per gene and one column per sample
+        gene_ids (list): gene ids, the first column of an expression file
+        gene_symbols (list): gene symbols, the second column; genes sharing a symbol are not
+            connected. Defaults to gene_ids
+        hubs (list): ids of the hub genes (see '-s'); all genes if None
+        tfs (list): ids of the genes annotated as transcription factors (see '-l')
+        threshold (float): MI threshold (see '-t'); determined from p_value if None
+        p_value (float): p-value for the MI threshold (see '-p')
+        eps (float): DPI tolerance (see '-e'); 1 skips DPI
+        bootstrap (bool): resample the samples with replacement (see '-r')
+        seed (int): seed of the random number generator (see '-S')
+        correction (float): array measurement noise level (see '-n')
+        npar_limit (int): maximum allowed value of npar (see '-N')
+        threads (int): number of threads computing MI and DPI (see '-T')
+        config_dir (str): directory containing config_threshold.txt
+        out_file (str): if given, the network is also written to this text .adj file by the engine
+        stats (dict): if given, receives for each phase of the engine, computing MI ('mi'), applying DPI
+            ('dpi') and writing out_file ('write'), a dict of its wall_seconds, cpu_seconds and the
+            peak_rss_bytes of the process at its end
+    Returns:
+        header (str): the '>' parameter lines of the network
+        genes (numpy.ndarray): gene ids (str), indexed by the hub and target ids
+        hubs (numpy.ndarray): hub gene id of each edge (int32)
+        targets (numpy.ndarray): target gene id of each edge (int32)
+        mis (numpy.ndarray): MI of each edge (float64)
+    The tuple has the layout of create_consensus_network.read_adjacency(), so that it can be
+    given to ConsensusAccumulator.add().
+    """
+    lib = load_library()
+    values = np.ascontiguousarray(exp, dtype=value_dtype())
+    if values.ndim != 2:
+        raise ValueError('exp must be a two dimensional array')
+    num_genes, num_arrays = values.shape
+    genes = np.array([str(g) for g in gene_ids], dtype=object)
+    if len(genes) != num_genes:
+        raise ValueError('{} gene ids for {} rows of expression values'.format(len(genes), num_genes))
+    symbols = genes if gene_symbols is None else [str(s) for s in gene_symbols]
+    if len(symbols) != num_genes:
+        raise ValueError('{} gene symbols for {} rows of expression values'.format(len(symbols), num_genes))
+
+    if threshold is None:
+        threshold = mi_threshold(p_value, num_arrays, config_dir) if p_value != 1.0 else 0.0
+
+    index = {}
+    for i, g in enumerate(genes):
+        index.setdefault(g, i)
+    hub_ids = np.array([index[g] for g in hubs if g in index] if hubs is not None else [], dtype=np.intc)
+    tf_ids = np.array([index[g] for g in tfs if g in index] if tfs is not None else [], dtype=np.intc)
+
+    accnums = (ctypes.c_char_p * num_genes)(*[g.encode() for g in genes])
+    labels = (ctypes.c_char_p * num_genes)(*[s.encode() for s in symbols])
+    int_p = ctypes.POINTER(ctypes.c_int)
+    error = ctypes.create_string_buffer(1024)
+
+    network = lib.sjaracne_build_network(values.ctypes.data, num_genes, num_arrays, accnums, labels,
+                                         hub_ids.ctypes.data_as(int_p), len(hub_ids),
+                                         tf_ids.ctypes.data_as(int_p), len(tf_ids),
+                                         threshold, eps, int(bootstrap), seed, correction, npar_limit,
+                                         threads, error, len(error))
+    if not network:
+        raise RuntimeError(error.value.decode())
+    header = '>  Input file      <memory>\n' \
+             '>  MI threshold    {:g}\n' \
+             '>  MI P-value      {:g}\n' \
+             '>  DPI tolerance   {:g}\n' \
+             '>  Subnetwork file \n'.format(threshold, p_value, eps)
+    try:
+        if out_file is not None:
+            if lib.sjaracne_write_network(network, header.encode(), out_file.encode(), error, len(error)) != 0:
+                raise RuntimeError(error.value.decode())
+        if stats is not None:
+            for phase, name in enumerate(PHASES):
+                if name != 'write' or out_file is not None:
+                    stats[name] = phase_stats(lib, network, phase)
+        num_edges = lib.sjaracne_num_edges(network)
+        edge_hubs = np.empty(num_edges, dtype=np.intc)
+        edge_targets = np.empty(num_edges, dtype=np.intc)
+        edge_mis = np.empty(num_edges, dtype=np.float64)
+        lib.sjaracne_get_edges(network, edge_hubs.ctypes.data_as(int_p), edge_targets.ctypes.data_as(int_p),
+                               edge_mis.ctypes.data_as(ctypes.POINTER(ctypes.c_double)))
+    finally:
+        lib.sjaracne_free_network(network)
+
+    return header, genes, edge_hubs, edge_targets, edge_mis
+
+
+def phase_stats(lib, network, phase):
+    """ Args:
+        lib (ctypes.CDLL): the loaded library
+        network (int): handle of a network built by sjaracne_build_network()
+        phase (int): index of the phase in PHASES
+    Returns:
+        dict: wall_seconds, cpu_seconds and peak_rss_bytes of the phase
+    """
+    wall, cpu, peak_rss = ctypes.c_double(), ctypes.c_double(), ctypes.c_longlong()
+    lib.sjaracne_phase_stats(network, phase, ctypes.byref(wall), ctypes.byref(cpu), ctypes.byref(peak_rss))
+    return {'wall_seconds': wall.value, 'cpu_seconds': cpu.value, 'peak_rss_bytes': peak_rss.value}
+
+
+def pairwise_mi(exp, x, y, npar_limit=20):
+    """ Mutual information of pairs of genes, computed by the adaptive partitioning kernel of the engine. No noise
+    is added to the values, so tied values are ranked by sample position.
+    Args:
+        exp (numpy.ndarray): expression values, one row per gene and one column per sample
+        x (numpy.ndarray): row of the first gene of each pair
+        y (numpy.ndarray): row of the second gene of each pair
+        npar_limit (int): maximum allowed value of npar (see '-N')
+    Returns:
+        numpy.ndarray: MI of each pair (float64), 0 for a gene paired with itself
+    """
+    lib = load_library()
+    values = np.ascontiguousarray(exp, dtype=value_dtype())
+    x = np.ascontiguousarray(x, dtype=np.intc)
+    y = np.ascontiguousarray(y, dtype=np.intc)
+    if values.ndim != 2 or x.shape != y.shape:
+        raise ValueError('exp must be a two dimensional array and x, y of the same length')
+    mis = np.empty(len(x), dtype=np.float64)
+    int_p = ctypes.POINTER(ctypes.c_int)
+    error = ctypes.create_string_buffer(1024)
+    if lib.sjaracne_pairwise_mi(values.ctypes.data, values.shape[0], values.shape[1], x.ctypes.data_as(int_p),
+                                y.ctypes.data_as(int_p), len(x), npar_limit,
+                                mis.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), error, len(error)) != 0:
+        raise RuntimeError(error.value.decode())
+    return mis
+
+
+def null_mi(exp, x, y, num_samples, bootstrap=False, seed=1, npar_limit=20, threads=1):
+    """ Mutual information of pairs of genes under the null hypothesis of independence, computed by the adaptive
+    partitioning kernel of the engine: each pair is computed on num_samples samples drawn at random, with the values
+    of its second gene permuted among them and the noise of sjaracne.exe added to both. The result is determined by
+    seed, whatever the number of threads.
+    Args:
+        exp (numpy.ndarray): expression values, one row per gene and one column per sample
+        x (numpy.ndarray): row of the first gene of each pair
+        y (numpy.ndarray): row of the second gene of each pair; a pair may be given several times, for several
+        permutations
+        num_samples (int): number of samples of each pair, at most the number of columns of exp
+        bootstrap (bool): resample the samples of each pair with replacement, as in a bootstrap network (see '-r')
+        seed (int): seed of the random draws
+        npar_limit (int): maximum allowed value of npar (see '-N')
+        threads (int): number of threads
+    Returns:
+        numpy.ndarray: null MI of each pair (float64)
+    """
+    lib = load_library()
+    values = np.ascontiguousarray(exp, dtype=value_dtype())
+    x = np.ascontiguousarray(x, dtype=np.intc)
+    y = np.ascontiguousarray(y, dtype=np.intc)
+    if values.ndim != 2 or x.shape != y.shape:
+        raise ValueError('exp must be a two dimensional array and x, y of the same length')
+    mis = np.empty(len(x), dtype=np.float64)
+    int_p = ctypes.POINTER(ctypes.c_int)
+    error = ctypes.create_string_buffer(1024)
+    if lib.sjaracne_null_mi(values.ctypes.data, values.shape[0], values.shape[1], x.ctypes.data_as(int_p),
+                            y.ctypes.data_as(int_p), len(x), num_samples, int(bootstrap), seed, npar_limit, threads,
+                            mis.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), error, len(error)) != 0:
+        raise RuntimeError(error.value.decode())
+    return mis
@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import json
+import hashlib
+import shutil
+import subprocess
+import tempfile
+import time
+import logging
+import multiprocessing
+from SJARACNe.bin.QC_input import prepare_exp, prepare_probe
+from SJARACNe.bin.create_consensus_network import create_consensus_networks, create_enhanced_consensus_networks
+from SJARACNe.bin.merge_shards import merge_shards
+
+# Files that sjaracne_workflow.cwl leaves in the output directory
+WORKFLOW_OUTPUTS = ['consensus_network_ncol_.txt']
+
+# Run report written to the output directory when metrics are requested
+RUN_REPORT = 'run_report.json'
+
+# Rough peak memory of one bootstrap: a few bytes per byte of expression file on top of the process itself
+BOOTSTRAP_MEMORY_PER_INPUT_BYTE = 4
+BOOTSTRAP_MEMORY_OVERHEAD = 32 << 20
+
+
+def run_workflow(exp_file, probe_file, p_value_consensus, p_value_bootstrap, depth, config_dir, bootstrap_num,
+                 output_dir, tmpdir_prefix, cores=None, max_mem=None, cache_dir=None, cache_size=None,
+                 metrics=False, shards=1):
+    """ Run the steps of sjaracne_workflow.cwl without a workflow engine: validate the inputs and fix their line
+    endings in one pass, build the bootstrap networks in a bounded pool of processes and create the consensus network.
+    Several P-values may be swept at the cost of one run: each seed's MI is computed once for all the bootstrap
+    P-values (sjaracne.exe -w), and each bootstrap P-value's networks are aggregated once for all the consensus
+    P-values. The outputs of a sweep go to output_dir/pb_<P-value>/pc_<P-value>, with a level for each swept
+    P-value only.
+    Args:
+        exp_file (str): expression matrix file
+        probe_file (str): file with the hub genes
+        p_value_consensus (float or list): P-value threshold in building consensus network, or a list of them
+        p_value_bootstrap (float or list): P-value threshold in building bootstrap networks, or a list of them
+        depth (int): maximum partitioning depth
+        config_dir (str): directory containing ARACNe configuration files
+        bootstrap_num (int): number of bootstrap networks to generate
+        output_dir (str): final output directory
+        tmpdir_prefix (str): directory in which the intermediate files are kept
+        cores (int): number of bootstrap networks built at the same time, all CPUs if None
+        max_mem (int): memory budget in bytes of the bootstrap networks built at the same time, the physical
+            memory if None
+        cache_dir (str): directory of a BootstrapCache; bootstrap networks found in it are not built again, and
+            the others are extended from the state the cache keeps of the network of the same seed and options for
+            other hub genes (sjaracne.exe -I), which computes the MI of the new hub genes only
+        cache_size (int): size cap in bytes of the cache, unlimited if None
+        metrics (bool): have every bootstrap network report its phases and counters (sjaracne.exe -M) and write
+            their rollup, with the wall time of each step, to RUN_REPORT in output_dir; each shard reports as one
+            network
+        shards (int): number of shards each bootstrap network is split into (sjaracne.exe -x); the shards are
+            built as separate jobs and merged into the network; not with a list of bootstrap P-values
+    """
+    pcs = p_value_consensus if isinstance(p_value_consensus, list) else [p_value_consensus]
+    pbs = p_value_bootstrap if isinstance(p_value_bootstrap, list) else [p_value_bootstrap]
+    sweep = len(pbs) > 1
+    if sweep and shards > 1:
+        raise ValueError('a sweep of bootstrap P-values cannot be sharded')
+    cores = cores or multiprocessing.cpu_count()
+    work_dir = tempfile.mkdtemp(prefix='sjaracne_', dir=tmpdir_prefix)
+    logging.info('Intermediate files are in {}'.format(work_dir))
+    start = step_start = time.time()
+    steps = {}
+
+    # Step 0: validate input files and change their line endings
+    exp_file = prepare_exp(exp_file, os.path.join(work_dir, os.path.basename(exp_file)), cores)
+    probe_file = prepare_probe(probe_file, os.path.join(work_dir, os.path.basename(probe_file)))
+    logging.info('[prepare_inputs] done')
+    steps['prepare_inputs'], step_start = time.time() - step_start, time.time()
+
+    # Step 5: bootstrapping, the network of seed i is written to TF_run_i.adj; in a sweep, the networks of every
+    # bootstrap P-value are written to sweep_dir, then moved to the adjacent matrix directory of their P-value
+    adjmat_dir = os.path.join(work_dir, 'bootstrap')
+    sweep_dir = os.path.join(work_dir, 'sweep')
+    log_dir = os.path.join(work_dir, 'logs')
+    os.mkdir(adjmat_dir)
+    os.mkdir(log_dir)
+    adjmat_dirs = dict((pb, os.path.join(adjmat_dir, 'pb_{}'.format(pb)) if sweep else adjmat_dir) for pb in pbs)
+    if sweep:
+        os.mkdir(sweep_dir)
+        for pb in pbs:
+            os.mkdir(adjmat_dirs[pb])
+    jobs = bootstrap_jobs(exp_file, cores, max_mem)
+    logging.info('[bootstrap] {} networks{}, {} jobs at a time'.format(
+        bootstrap_num * len(pbs), ' of {} shards'.format(shards) if shards > 1 else '', jobs))
+    names = ['TF_run_{:03d}.adj'.format(seed) for seed in range(1, bootstrap_num + 1)]
+    # the P-values of each network still to be built
+    missing = dict((name, pbs) for name in names)
+    cache = keys = None
+    if cache_dir is not None:
+        # a network of a sweep is filed under the key of the network a run without sweep builds, which is the same
+        cache = BootstrapCache(cache_dir, cache_size)
+        keys = dict(((name, pb), cache.key(bootstrap_command(exp_file, probe_file, pb, depth, config_dir,
+                                                             os.path.join(adjmat_dirs[pb], name), seed)))
+                    for seed, name in enumerate(names, 1) for pb in pbs)
+        missing = dict((name, [pb for pb in pbs if not cache.fetch(keys[name, pb], os.path.join(adjmat_dirs[pb],
+                                                                                                name))])
+                       for name in names)
+        logging.info('[bootstrap] {} networks found in cache {}'.format(
+            bootstrap_num * len(pbs) - sum(len(missing[name]) for name in names), cache_dir))
+    tasks = [(bootstrap_command(exp_file, probe_file, missing[name] if sweep else pbs[0], depth, config_dir,
+                                os.path.join(sweep_dir if sweep else adjmat_dir, name), seed),
+              os.path.join(log_dir, name + '.log'))
+             for seed, name in enumerate(names, 1) if missing[name]]
+    state_keys = []
+    if cache is not None and not sweep and shards == 1:
+        # when only the hub genes have changed, each network is extended from the state of its seed
+        for command, _ in tasks:
+            state_keys.append(cache.state_key(command))
+            state_file = cache.entry(state_keys[-1], '.state')
+            os.makedirs(os.path.dirname(state_file), exist_ok=True)
+            command += ['-I', state_file]
+    cached = bootstrap_num * len(pbs) - sum(len(missing[name]) for name in names)
+    # the shards are kept out of adjmat_dir, which create_consensus_network() reads as a whole
+    shard_dir = os.path.join(work_dir, 'shards')
+    if shards > 1:
+        os.mkdir(shard_dir)
+        tasks = [shard_task(task, shard, shards, shard_dir) for task in tasks for shard in range(1, shards + 1)]
+    if metrics:
+        for command, log_file in tasks:
+            command += ['-M', log_file[:-len('.log')] + '.metrics.json']
+    pending, seconds_of = {}, {}
+    with multiprocessing.Pool(jobs) as pool:
+        done = cached
+        for out_name, returncode, seconds in pool.imap_unordered(run_command, tasks):
+            if returncode != 0:
+                pool.terminate()
+                raise RuntimeError('Bootstrap network {} failed with exit code {}, see {}'.format(
+                    out_name, returncode, os.path.join(log_dir, out_name + '.log')))
+            name = out_name.rsplit('.shard', 1)[0]
+            seconds_of[name] = seconds_of.get(name, 0.0) + seconds
+            if shards > 1:
+                pending[name] = pending.get(name, shards) - 1
+                if pending[name] > 0:
+                    continue
+                shard_files = [os.path.join(shard_dir, '{}.shard{}'.format(name, shard))
+                               for shard in range(1, shards + 1)]
+                merge_shards(shard_files, os.path.join(adjmat_dir, name))
+                for shard_file in shard_files:
+                    os.remove(shard_file)
+            for pb in missing[name]:
+                if sweep:
+                    os.replace(sweep_file(os.path.join(sweep_dir, name), pb), os.path.join(adjmat_dirs[pb], name))
+                # cached right away, so that an interrupted run resumes from here
+                if cache is not None:
+                    cache.store(keys[name, pb], os.path.join(adjmat_dirs[pb], name))
+            done += len(missing[name])
+            logging.info('[bootstrap] {}/{} {} done in {:.1f}s'.format(done, bootstrap_num * len(pbs), name,
+                                                                      seconds_of[name]))
+    if cache is not None:
+        cache.evict(keep=list(keys.values()) + state_keys)
+    steps['bootstrap'], step_start = time.time() - step_start, time.time()
+
+    # Step 7: generate the consensus networks; the bootstrap networks are read where they were written, once for
+    # all the consensus P-values
+    consensus_dir = os.path.join(work_dir, os.path.basename(output_dir))
+    out_dirs = {}
+    for pb in pbs:
+        for pc in pcs:
+            out_dirs[pb, pc] = os.path.join(*[consensus_dir] + (['pb_{}'.format(pb)] if sweep else []) +
+                                            (['pc_{}'.format(pc)] if len(pcs) > 1 else []))
+            os.makedirs(out_dirs[pb, pc], exist_ok=True)
+    networks = dict((pb, create_consensus_networks(adjmat_dirs[pb], pcs, [out_dirs[pb, pc] for pc in pcs], cores))
+                    for pb in pbs)
+    steps['consensus'], step_start = time.time() - step_start, time.time()
+    for pb in pbs:
+        create_enhanced_consensus_networks(exp_file, networks[pb], [out_dirs[pb, pc] for pc in pcs])
+    steps['enhanced_consensus'] = time.time() - step_start
+    logging.info('[consensus] done')
+
+    if metrics:
+        metrics_files = [task[0][-1] for task in tasks]
+        report = {'wall_seconds': time.time() - start, 'bootstrap_jobs': jobs,
+                  'cached_networks': cached,
+                  'steps': dict((name, {'wall_seconds': seconds}) for name, seconds in steps.items()),
+                  'bootstrap': rollup_metrics(metrics_files)}
+        with open(os.path.join(output_dir, RUN_REPORT), 'w') as f:
+            json.dump(report, f, indent=2)
+        logging.info('[metrics] run report written to {}'.format(os.path.join(output_dir, RUN_REPORT)))
+
+    hard_links = True
+    for out_dir in out_dirs.values():
+        dst_dir = os.path.join(output_dir, os.path.relpath(out_dir, consensus_dir))
+        os.makedirs(dst_dir, exist_ok=True)
+        hard_links = link_outputs(out_dir, dst_dir, WORKFLOW_OUTPUTS) and hard_links
+    if hard_links:
+        shutil.rmtree(work_dir)
+    else:
+        logging.info('Outputs are symbolic links, keeping {}'.format(work_dir))
+    logging.info('Workflow done in {:.1f}s'.format(time.time() - start))
+
+
+def bootstrap_command(exp_file, probe_file, p_value, depth, config_dir, out_file, seed):
+    """ Command line of one bootstrap network, as built by sjaracne.cwl
+    Args:
+        exp_file (str): expression matrix file
+        probe_file (str): file with the hub genes
+        p_value (float or list): P-value threshold in building bootstrap networks, or a list of them, of which
+            sjaracne.exe -w writes the networks as sweep_file(out_file, p_value)
+        depth (int): maximum partitioning depth
+        config_dir (str): directory containing ARACNe configuration files
+        out_file (str): network file
+        seed (int): seed of the random number generator
+    Returns:
+        list: the command line
+    """
+    if isinstance(p_value, list):
+        threshold = ['-w', ','.join('{:.10f}'.format(float(value)) for value in p_value)]
+    else:
+        threshold = ['-p', '{:.10f}'.format(float(p_value))]
+    return ['sjaracne.exe', '-i', exp_file, '-l', probe_file, '-s', probe_file] + threshold + \
+           ['-e', '0', '-a', 'adaptive_partitioning', '-r', '1', '-H', config_dir, '-N', str(depth),
+            '-o', out_file, '-S', str(seed), '-T', '1', '-F', 'text']
+
+
+def sweep_file(out_file, p_value):
+    """ Network written by sjaracne.exe -w for one of its P-values, see bootstrap_command()
+    Args:
+        out_file (str): network file of the command
+        p_value (float): P-value threshold
+    Returns:
+        str: out_file with _p and the P-value, as given to -w, inserted before the .adj extension
+    """
+    root, ext = os.path.splitext(out_file) if out_file.endswith('.adj') else (out_file, '')
+    return '{}_p{:.10f}{}'.format(root, float(p_value), ext)
+
+
+def shard_task(task, shard, shards, shard_dir):
+    """ Task building one shard of a bootstrap network
+    Args:
+        task (tuple): command line of the network (see bootstrap_command()) and file receiving its output
+        shard (int): shard to build, 1 .. shards
+        shards (int): number of shards of the network
+        shard_dir (str): directory receiving the shard, as <network file name>.shard<shard>
+    Returns:
+        tuple: command line of the shard and file receiving its output, next to that of the network
+    """
+    command, log_file = task
+    out = command.index('-o') + 1
+    name = '{}.shard{}'.format(os.path.basename(command[out]), shard)
+    command = command[:out] + [os.path.join(shard_dir, name)] + command[out + 1:] + ['-x', '{}/{}'.format(shard,
+                                                                                                        shards)]
+    return command, os.path.join(os.path.dirname(log_file), name + '.log')
+
+
+def run_command(task):
+    """ Run the command of a bootstrap network
+    Args:
+        task (tuple): command line (see bootstrap_command()) and file receiving its output
+    Returns:
+        name (str): file name of the network
+        returncode (int): exit code of the command
+        seconds (float): wall time of the command
+    """
+    command, log_file = task
+    start = time.time()
+    with open(log_file, 'w') as log:
+        returncode = subprocess.call(command, stdout=log, stderr=subprocess.STDOUT)
+    return os.path.basename(command[command.index('-o') + 1]), returncode, time.time() - start
+
+
+def rollup_metrics(metrics_files):
+    """ Combine the metrics reports of several runs of sjaracne.exe (see its option -M)
+    Args:
+        metrics_files (list): paths of the reports
+    Returns:
+        dict: the number of networks; for each phase, its wall_seconds and cpu_seconds summed over the runs and
+        its largest peak_rss_bytes; the counters summed over the networks, npar_histogram added up bin by bin;
+        and the largest peak_rss_bytes of a run, the memory a bootstrap job needs
+    """
+    phases, counters, histogram = {}, {}, []
+    networks = peak_rss = 0
+    for path in metrics_files:
+        with open(path) as f:
+            report = json.load(f)
+        peak_rss = max(peak_rss, report['total']['peak_rss_bytes'])
+        for section in [report['phases']] + [network['phases'] for network in report['networks']]:
+            for name, stats in section.items():
+                total = phases.setdefault(name, {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'peak_rss_bytes': 0})
+                total['wall_seconds'] += stats['wall_seconds']
+                total['cpu_seconds'] += stats['cpu_seconds']
+                total['peak_rss_bytes'] = max(total['peak_rss_bytes'], stats['peak_rss_bytes'])
+        for network in report['networks']:
+            networks += 1
+            for name, value in network['counters'].items():
+                if name == 'npar_histogram':
+                    histogram += [0] * (len(value) - len(histogram))
+                    for npar, count in enumerate(value):
+                        histogram[npar] += count
+                else:
+                    counters[name] = counters.get(name, 0) + value
+    counters['npar_histogram'] = histogram
+    return {'networks': networks, 'phases': phases, 'counters': counters, 'peak_rss_bytes': peak_rss}
+
+
+def bootstrap_jobs(exp_file, cores, max_mem=None):
+    """ Number of bootstrap networks to build at the same time
+    Args:
+        exp_file (str): expression matrix file
+        cores (int): number of CPUs to use
+        max_mem (int): memory budget in bytes, the physical memory if None
+    Returns:
+        int: at most cores, and at least one
+    """
+    if max_mem is None:
+        try:
+            max_mem = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+        except (AttributeError, ValueError, OSError):
+            return max(1, cores)
+    per_job = BOOTSTRAP_MEMORY_PER_INPUT_BYTE * os.path.getsize(exp_file) + BOOTSTRAP_MEMORY_OVERHEAD
+    return max(1, min(cores, max_mem // per_job))
+
+
+def link_outputs(src_dir, dst_dir, names):
+    """ Put output files into the output directory without copying them: hard links, or symbolic links when the
+    two directories are on different file systems
+    Args:
+        src_dir (str): directory with the outputs
+        dst_dir (str): output directory
+        names (list): file names of the outputs
+    Returns:
+        bool: True if every output was hard linked, so that src_dir can be removed
+    """
+    hard_links = True
+    for name in names:
+        src, dst = os.path.join(src_dir, name), os.path.join(dst_dir, name)
+        if os.path.lexists(dst):
+            os.remove(dst)
+        try:
+            os.link(src, dst)
+        except OSError:
+            os.symlink(os.path.abspath(src), dst)
+            hard_links = False
+    return hard_links
+
+
+class BootstrapCache(object):
+    """ Content-addressed store of bootstrap networks. A network is filed under a hash of everything that
+    determines it: the contents of the input files and of the sjaracne.exe binary, and the other arguments of its
+    command line (p-value, depth, DPI tolerance, seed, ...). Files are kept as <dir>/<key[:2]>/<key>.adj; their
+    modification time records their last use, and the least recently used ones are removed when the cache grows
+    beyond its size cap. The network states of sjaracne.exe -I, which let a network be extended to more hub genes,
+    are kept as <dir>/<key[:2]>/<key>.state under a hash of the same command line without its hub gene files.
+    """
+    # Options of bootstrap_command() naming files whose contents, not paths, determine the network; -H is the
+    # configuration directory, of which sjaracne.exe reads config_threshold.txt
+    file_options = {'-i': None, '-l': None, '-s': None, '-H': 'config_threshold.txt'}
+    # Options naming output files, which do not change the network
+    output_options = {'-o', '-M', '-I'}
+    # Options naming the hub gene files, which the state of a network does not depend on
+    hub_options = {'-l', '-s'}
+
+    def __init__(self, path, max_size=None):
+        self.path = path
+        self.max_size = max_size
+        self.file_hashes = {}
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, command, ignore=()):
+        """ Args:
+            command (list): command line of a bootstrap network, see bootstrap_command()
+            ignore (iterable): other options left out of the key
+        Returns:
+            str: key of the network
+        """
+        digest = hashlib.sha256()
+        digest.update(self.file_hash(shutil.which(command[0]) or command[0]).encode())
+        args = iter(command[1:])
+        for option in args:
+            value = next(args)
+            if option in self.output_options or option in ignore:
+                continue
+            if option in self.file_options:
+                if self.file_options[option] is not None:
+                    value = os.path.join(value, self.file_options[option])
+                value = self.file_hash(value)
+            digest.update('{}\0{}\0'.format(option, value).encode())
+        return digest.hexdigest()
+
+    def file_hash(self, path):
+        """ SHA-256 of the contents of a file, computed once per file """
+        if path not in self.file_hashes:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+            self.file_hashes[path] = digest.hexdigest()
+        return self.file_hashes[path]
+
+    def state_key(self, command):
+        """ Args:
+            command (list): command line of a bootstrap network, see bootstrap_command()
+        Returns:
+            str: key of the state of the network, the same for all hub genes
+        """
+        return self.key(command, self.hub_options)
+
+    def entry(self, key, suffix='.adj'):
+        return os.path.join(self.path, key[:2], key + suffix)
+
+    def fetch(self, key, dst):
+        """ Put the network of a key at dst, if it is in the cache
+        Args:
+            key (str): key of the network
+            dst (str): path of the network
+        Returns:
+            bool: True on a cache hit
+        """
+        src = self.entry(key)
+        try:
+            os.utime(src)
+            place_file(src, dst)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def store(self, key, src):
+        """ File a network under its key
+        Args:
+            key (str): key of the network
+            src (str): path of the network
+        """
+        dst = self.entry(key)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(dst, os.getpid())
+        place_file(src, tmp)
+        os.replace(tmp, dst)
+
+    def evict(self, keep=()):
+        """ Remove the least recently used networks and network states until the cache fits in its size cap
+        Args:
+            keep (iterable): keys of networks and states not to be removed
+        """
+        if self.max_size is None:
+            return
+        keep = set(self.entry(key, suffix) for key in keep for suffix in ('.adj', '.state'))
+        entries = []
+        for sub_dir in os.listdir(self.path):
+            sub_dir = os.path.join(self.path, sub_dir)
+            if os.path.isdir(sub_dir):
+                for name in os.listdir(sub_dir):
+                    if name.endswith('.adj') or name.endswith('.state'):
+                        st = os.stat(os.path.join(sub_dir, name))
+                        entries.append((st.st_mtime, st.st_size, os.path.join(sub_dir, name)))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            if path not in keep:
+                os.remove(path)
+                total -= size
+        if total > self.max_size:
+            logging.info('Bootstrap cache {} holds {} bytes of networks in use, more than its cap'.format(
+                self.path, total))
+
+
+def place_file(src, dst):
+    """ Hard link src to dst, or copy it if the two are on different file systems """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def parse_p_values(text):
+    """ Parse a P-value threshold, or several separated by commas
+    Args:
+        text (str): P-values, e.g. 1e-5 or 1e-5,1e-7
+    Returns:
+        list: the P-values as given, each in (0, 1] and none given twice
+    """
+    p_values = [value.strip() for value in str(text).split(',')]
+    seen = set()
+    for value in p_values:
+        try:
+            number = float(value)
+        except ValueError:
+            raise ValueError('invalid P-value: {}'.format(value))
+        if not 0 < number <= 1:
+            raise ValueError('P-value out of the range (0, 1]: {}'.format(value))
+        if number in seen:
+            raise ValueError('P-value given twice: {}'.format(value))
+        seen.add(number)
+    return p_values
+
+
+def parse_memory_size(text):
+    """ Parse a memory size such as 512M, 16G or 1.5T; a number without unit is in megabytes
+    Args:
+        text (str): memory size
+    Returns:
+        int: size in bytes
+    """
+    match = re.fullmatch(r'\s*([0-9]*\.?[0-9]+)\s*([KMGT]?)B?\s*', text, re.IGNORECASE)
+    if match is None:
+        raise ValueError('invalid memory size: {}'.format(text))
+    unit = match.group(2).upper() or 'M'
+    return int(float(match.group(1)) * (1 << (10 * ' KMGT'.index(unit))))
@@ -7,6 +7,8 @@ import subprocess
 import shlex
 import logging
 import pathlib
+from SJARACNe.calibration import calibrate_threshold
+from SJARACNe.executor import parse_memory_size, parse_p_values, run_workflow
 
 
 def main():
@@ -22,9 +24,11 @@ def main():
     parent_parser.add_argument('-g', '--hub-genes', metavar='FILE', required=True,
                                help='Path to a file containing a list of symbols to be considered as hub genes.')
     parent_parser.add_argument('-pc', '--p-value-consensus', metavar='FLOAT', default=1e-5,
-                               help='P-value threshold to select edges in building consensus network.')
+                               help='P-value threshold to select edges in building consensus network. The native '
+                                    'mode also takes several, separated by commas.')
     parent_parser.add_argument('-pb', '--p-value-bootstrap', metavar='FLOAT', default=1e-7,
-                               help='P-value threshold to filter mutual information in building bootstrap networks.')
+                               help='P-value threshold to filter mutual information in building bootstrap networks. '
+                                    'The native mode also takes several, separated by commas.')
     parent_parser.add_argument('-d', '--depth', metavar='INT', default=40, help='maximum partitioning depth.')
     parent_parser.add_argument('-c', '--config-dir', metavar='DIR', help='Directory containing ARACNe configuration '
                                                                          'files. Use default configs if not provided.')
@@ -32,6 +36,9 @@ def main():
                                help='Number of bootstrap networks to generate.')
     parent_parser.add_argument('-o', '--output-dir', metavar='DIR', required=True,
                                help='Path to final output directory.')
+    parent_parser.add_argument('--shards', metavar='INT', type=int, default=1,
+                               help='Split each bootstrap network into this many jobs, each computing a slice of the '
+                                    'hub genes; their outputs are merged into the network (default: 1).')
     parent_parser.add_argument('-tmp', '--tmpdir-prefix', dest='tmpdir_prefix',metavar='DIR', required=True,
                                help='Specify tmp path,default is /tmp.')
 
@@ -41,12 +48,56 @@ def main():
     subparser_local = subparsers.add_parser('local', parents=[parent_parser], help='run cwltool in a local workstation')
     subparser_local.add_argument('-s', '--serial', help='run cwltool in serial mode', action='store_true')
 
+    # Create a subparser for running the workflow without a workflow engine
+    subparser_native = subparsers.add_parser('native', parents=[parent_parser],
+                                             help='run the workflow with the built-in executor, without cwltool')
+    subparser_native.add_argument('--cores', metavar='INT', type=int, help='maximum number of bootstrap networks '
+                                                                           'built at the same time (default: all CPUs)')
+    subparser_native.add_argument('--max-mem', metavar='SIZE', type=parse_memory_size,
+                                  help='memory budget of the bootstrap networks built at the same time, e.g. 16G or '
+                                       '512M (default: physical memory)')
+    subparser_native.add_argument('--cache-dir', metavar='DIR', help='directory keeping bootstrap networks between '
+                                                                     'runs; networks found in it are not rebuilt')
+    subparser_native.add_argument('--cache-size', metavar='SIZE', type=parse_memory_size,
+                                  help='size cap of the cache directory, e.g. 10G; least recently used networks '
+                                       'are removed first (default: no cap)')
+    subparser_native.add_argument('--metrics', action='store_true',
+                                  help='write run_report.json to the output directory: time, CPU time, peak memory '
+                                       'and counters of each phase of the bootstrap networks, and time of each step')
+
     # Create a subparser for running cwlexec
     subparser_lsf = subparsers.add_parser('lsf', parents=[parent_parser], help='run cwlexec in a IBM LSF cluster')
     subparser_lsf.add_argument('-j', '--config-json', metavar='FILE', required=True, help='LSF-specific configuration '
                                                                                           'file in JSON format to be '
                                                                                           'used for workflow execution')
 
+    # Create a subparser for fitting config_threshold.txt to a dataset
+    subparser_calibrate = subparsers.add_parser('calibrate', help='fit the MI threshold of the P-values to the null '
+                                                                  'MI of a dataset and write config_threshold.txt')
+    subparser_calibrate.add_argument('-e', '--exp-file', metavar='FILE', required=True,
+                                     help='Path to an expression matrix file.')
+    subparser_calibrate.add_argument('-o', '--output-dir', metavar='DIR', required=True,
+                                     help='Configuration directory to write, to be given as -c to the other '
+                                          'subcommands.')
+    subparser_calibrate.add_argument('-s', '--samples', metavar='INT', type=int,
+                                     help='Number of samples of the networks to be built (default: all the samples '
+                                          'of the expression matrix).')
+    subparser_calibrate.add_argument('-d', '--depth', metavar='INT', type=int, default=40,
+                                     help='maximum partitioning depth.')
+    subparser_calibrate.add_argument('--pairs', metavar='INT', type=int, default=20000,
+                                     help='Number of random gene pairs drawn at each sample size (default: 20000).')
+    subparser_calibrate.add_argument('--permutations', metavar='INT', type=int, default=5,
+                                     help='Number of permutations of each gene pair (default: 5).')
+    subparser_calibrate.add_argument('--no-bootstrap', dest='bootstrap', action='store_false',
+                                     help='Draw the samples without replacement, for networks built without '
+                                          'resampling (sjaracne.exe without -r).')
+    subparser_calibrate.add_argument('--seed', metavar='INT', type=int, default=1, help='Seed of the random draws.')
+    subparser_calibrate.add_argument('--threads', metavar='INT', type=int,
+                                     help='Number of threads computing MI (default: all CPUs).')
+    subparser_calibrate.add_argument('--cache-dir', metavar='DIR',
+                                     help='Directory keeping calibrations between runs, under a hash of the '
+                                          'expression matrix and the number of samples.')
+
     if len(sys.argv) == 1:
         parser.print_help()
         sys.exit(0)
@@ -54,6 +105,15 @@ def main():
     args = parser.parse_args()
     logging.basicConfig(level=logging.INFO)
 
+    if args.subcommand == 'calibrate':
+        try:
+            calibrate_threshold(args.exp_file, args.output_dir, args.samples, args.pairs, args.permutations,
+                                args.bootstrap, args.seed, args.depth, args.threads, args.cache_dir)
+        except ValueError as e:
+            sys.exit('Error - {}'.format(e))
+        logging.info('All done.')
+        return
+
     # to make executable and config findable
     installed_path = os.path.dirname(os.path.realpath(__file__))
     os.environ['PATH'] += (os.pathsep + installed_path + '/bin')
@@ -70,6 +130,20 @@ def main():
     if not os.path.isdir(args.output_dir):
         os.makedirs(args.output_dir)
     output_dir_name = os.path.basename(args.output_dir)
+    if args.shards < 1:
+        sys.exit('Error - the number of shards must be at least 1.')
+    try:
+        p_values_consensus = parse_p_values(args.p_value_consensus)
+        p_values_bootstrap = parse_p_values(args.p_value_bootstrap)
+    except ValueError as e:
+        sys.exit('Error - {}'.format(e))
+    # a sweep computes the networks of several P-values at the cost of one run, see run_workflow()
+    if len(p_values_consensus) + len(p_values_bootstrap) > 2 and args.subcommand != 'native':
+        sys.exit('Error - several P-values can only be swept in the native mode.')
+    if len(p_values_bootstrap) > 1 and args.shards > 1:
+        sys.exit('Error - a sweep of bootstrap P-values cannot be sharded.')
+    # the sharded workflow scatters the shards of every bootstrap network and merges them
+    workflow = 'sjaracne_workflow.cwl' if args.shards == 1 else 'sjaracne_sharded_workflow.cwl'
     # Create input yml file in a temp directory
     with open(pathlib.PurePath(args.output_dir).joinpath('sjaracne_workflow.yml'), 'w') as fp_yml:
         logging.info(fp_yml.name)
@@ -83,6 +157,8 @@ def main():
                    'final_out_dir_name: {}'.format(os.path.abspath(args.exp_file), os.path.abspath(args.hub_genes),
                                                    args.p_value_consensus, args.p_value_bootstrap, args.depth,
                                                    config_dir, args.bootstrap_num, output_dir_name)
+        if args.shards > 1:
+            contents += '\nshard_num: {}'.format(args.shards)
         logging.info(contents)
         fp_yml.write(contents)
         fp_yml.flush()
@@ -90,16 +166,25 @@ def main():
 
         if args.subcommand == 'local':
             if args.serial:
-                cmd = 'cwltool --tmpdir-prefix {} --outdir {} {}/sjaracne_workflow.cwl {}'.format(args.tmpdir_prefix, args.output_dir, cwl_path,fp_yml.name)
+                cmd = 'cwltool --tmpdir-prefix {} --outdir {} {}/{} {}'.format(args.tmpdir_prefix, args.output_dir, cwl_path, workflow, fp_yml.name)
             else:
-                cmd = 'cwltool --tmpdir-prefix {} --parallel --outdir {} {}/sjaracne_workflow.cwl {}'.format(args.tmpdir_prefix, args.output_dir,cwl_path, fp_yml.name)
+                cmd = 'cwltool --tmpdir-prefix {} --parallel --outdir {} {}/{} {}'.format(args.tmpdir_prefix, args.output_dir, cwl_path, workflow, fp_yml.name)
         elif args.subcommand == 'lsf':
-                cmd = 'cwlexec -pe PATH -c {} --outdir {} {}/sjaracne_workflow.cwl {}'.format(
-                    args.config_json, args.output_dir, cwl_path, fp_yml.name)
+                cmd = 'cwlexec -pe PATH -c {} --outdir {} {}/{} {}'.format(
+                    args.config_json, args.output_dir, cwl_path, workflow, fp_yml.name)
+        elif args.subcommand == 'native':
+            run_workflow(args.exp_file, args.hub_genes,
+                         p_values_consensus if len(p_values_consensus) > 1 else args.p_value_consensus,
+                         p_values_bootstrap if len(p_values_bootstrap) > 1 else args.p_value_bootstrap,
+                         int(args.depth), config_dir, int(args.bootstrap_num), args.output_dir,
+                         args.tmpdir_prefix, args.cores, args.max_mem, args.cache_dir, args.cache_size,
+                         args.metrics, args.shards)
+            cmd = None
         else:
             sys.exit('Error - invalid subcommand.')
-        logging.info(cmd)
-        run_shell_command_call(cmd)
+        if cmd is not None:
+            logging.info(cmd)
+            run_shell_command_call(cmd)
 
     logging.info('All done.')
 
@@ -0,0 +1,496 @@
+//------------------------------------------------------------------------------------
+// C interface of the SJARACNe engine (see sjaracne.h); it lets a host program such as
+// Python build networks from expression values held in its own memory, without
+// going through the input and output files of sjaracne.exe
+//------------------------------------------------------------------------------------
+
+#include <algorithm>
+#include <cstdlib>
+#include <cstring>
+#include <fstream>
+#include <mutex>
+#include <new>
+#include <random>
+#include <thread>
+#include "matrix.h"
+#include "phase.h"
+#include "sjaracne.h"
+
+struct SJARACNeNetwork
+{
+   Microarray_Set      data;       // markers of the network; the values are released
+   Matrix              matrix;     // the network, as sjaracne.exe would write it
+   std::vector<int>    ids;        // hub genes, empty if all genes were computed
+   std::vector<int>    hubs;       // edges, see sjaracne_get_edges()
+   std::vector<int>    targets;
+   std::vector<double> mis;
+   PhaseStats          phases[3];  // computing MI, applying DPI, writing the network
+};
+
+// std::rand() has a single state per process, so networks built at the same time by
+// different threads draw their bootstrap samples and noise one after the other
+
+static std::mutex randomMutex;
+
+
+//------------------------------------------------------------------------------------
+
+static void setError(char *error, int errorSize, const std::string& s)
+{
+   if (error && errorSize > 0)
+   {
+      std::strncpy(error, s.c_str(), errorSize - 1);
+      error[errorSize - 1] = '\0';
+   }
+}
+
+//------------------------------------------------------------------------------------
+
+int sjaracne_value_size(void)
+{
+   return sizeof(ExprValue);
+}
+
+//------------------------------------------------------------------------------------
+
+double sjaracne_find_threshold(const char *homeDir, double pvalue, int numArrays,
+                               char *error, int errorSize)
+{
+   Parameter p;
+
+   p.home_dir = homeDir;
+   p.pvalue   = pvalue;
+
+   if (p.home_dir.length() > 0 && p.home_dir[p.home_dir.length() - 1] != '/')
+      p.home_dir += "/";
+
+   try
+   {
+      findThreshold(numArrays, p);
+   }
+   catch (const std::string& s)
+   {
+      setError(error, errorSize, s);
+      return -1.0;
+   }
+
+   return p.threshold;
+}
+
+//------------------------------------------------------------------------------------
+// sjaracne_build_network() follows runStandard() and buildNetwork() in main.cpp; the
+// values are copied once into the working dataset, since addNoise() modifies them
+
+SJARACNeNetwork *sjaracne_build_network(const void *values, int numMarkers,
+                                        int numArrays, const char **accnums,
+                                        const char **labels, const int *hubIds,
+                                        int numHubs, const int *tfIds, int numTFs,
+                                        double threshold, double eps, int bootstrap,
+                                        int seed, double correction, int nparLimit,
+                                        int numThreads, char *error, int errorSize)
+{
+   SJARACNeNetwork *network = NULL;
+
+   try
+   {
+      if (numMarkers < 1 || numArrays < 2)
+         throw std::string("At least one marker and two arrays are required!");
+
+      network = new SJARACNeNetwork;
+
+      Microarray_Set& data = network->data;
+      std::vector<int>& ids = network->ids;
+
+      const ExprValue *v = static_cast<const ExprValue *>(values);
+
+      data.numArrays = numArrays;
+      data.values.assign(v, v + (size_t) numMarkers * numArrays);
+      data.markerset.reserve(numMarkers);
+
+      for (int i = 0; i < numMarkers; i++)
+         data.markerset.push_back(Marker(i, std::string("_") + accnums[i],
+                                         labels[i]));
+
+      data.indexMarkers();
+
+      for (int i = 0; i < numHubs; i++)
+      {
+         if (hubIds[i] < 0 || hubIds[i] >= numMarkers)
+            throw std::string("Hub gene index out of range!");
+
+         ids.push_back(hubIds[i]);
+      }
+
+      Transfac transfac;
+
+      for (int i = 0; i < numTFs; i++)
+         if (tfIds[i] >= 0 && tfIds[i] < numMarkers)
+            transfac[tfIds[i]] = 1;
+
+      data.computeMarkerBandwidth(NULL);
+
+      std::vector<int> bs, *arrays = NULL;
+
+      {
+         std::lock_guard<std::mutex> lock(randomMutex);
+
+         std::srand(seed);
+
+         if (bootstrap)
+         {
+            data.bootStrap(bs, NULL);
+            arrays = &bs;
+         }
+
+         data.addNoise();
+      }
+
+      PhaseTimer timer;
+
+      data.createEdgeMatrix(numArrays, network->matrix, threshold, -1, correction,
+                            nparLimit, ids, arrays, numThreads);
+
+      network->phases[0] = timer.stop();
+      timer.start();
+
+      if (eps != 1.0)
+         network->matrix.reduce(eps, ids, transfac, numThreads);
+
+      network->phases[1] = timer.stop();
+
+      std::vector<ExprValue>().swap(data.values); // only the markers are needed now
+
+      network->matrix.getEdges(ids, network->hubs, network->targets, network->mis);
+   }
+   catch (const std::string& s)
+   {
+      delete network;
+      setError(error, errorSize, s);
+      return NULL;
+   }
+   catch (const std::bad_alloc&)
+   {
+      delete network;
+      setError(error, errorSize, "Out of memory!");
+      return NULL;
+   }
+
+   return network;
+}
+
+//------------------------------------------------------------------------------------
+
+long long sjaracne_num_edges(const SJARACNeNetwork *network)
+{
+   return network->hubs.size();
+}
+
+//------------------------------------------------------------------------------------
+
+void sjaracne_get_edges(const SJARACNeNetwork *network, int *hubs, int *targets,
+                        double *mis)
+{
+   long long numEdges = network->hubs.size();
+
+   if (numEdges == 0)
+      return;
+
+   std::memcpy(hubs,    &network->hubs[0],    numEdges * sizeof(int));
+   std::memcpy(targets, &network->targets[0], numEdges * sizeof(int));
+   std::memcpy(mis,     &network->mis[0],     numEdges * sizeof(double));
+}
+
+//------------------------------------------------------------------------------------
+
+void sjaracne_phase_stats(const SJARACNeNetwork *network, int phase, double *wall,
+                          double *cpu, long long *peakRss)
+{
+   PhaseStats s;
+
+   if (phase >= 0 && phase < 3)
+      s = network->phases[phase];
+
+   *wall    = s.wall;
+   *cpu     = s.cpu;
+   *peakRss = s.peakRss;
+}
+
+//------------------------------------------------------------------------------------
+
+int sjaracne_write_network(SJARACNeNetwork *network, const char *header,
+                           const char *filename, char *error, int errorSize)
+{
+   try
+   {
+      PhaseTimer timer;
+
+      std::ofstream out(filename);
+      if (!out.is_open())
+         throw "Unable to open " + std::string(filename);
+
+      out << header;
+      network->matrix.write(out, network->data, network->ids);
+      out.close();
+
+      if (!out)
+         throw "Unable to write " + std::string(filename);
+
+      network->phases[2] = timer.stop();
+   }
+   catch (const std::string& s)
+   {
+      setError(error, errorSize, s);
+      return -1;
+   }
+
+   return 0;
+}
+
+//------------------------------------------------------------------------------------
+
+void sjaracne_free_network(SJARACNeNetwork *network)
+{
+   delete network;
+}
+
+//------------------------------------------------------------------------------------
+// sjaracne_pairwise_mi() ranks each marker once, then calls the MI kernel for every
+// pair, as createEdgeMatrix() does; no noise is added, so tied values are ranked by
+// array position
+
+int sjaracne_pairwise_mi(const void *values, int numMarkers, int numArrays,
+                         const int *x, const int *y, long long numPairs, int nparLimit,
+                         double *mis, char *error, int errorSize)
+{
+   try
+   {
+      if (numMarkers < 1 || numArrays < 2)
+         throw std::string("At least one marker and two arrays are required!");
+
+      Microarray_Set data;
+
+      const ExprValue *v = static_cast<const ExprValue *>(values);
+
+      data.numArrays = numArrays;
+      data.values.assign(v, v + (size_t) numMarkers * numArrays);
+
+      for (int i = 0; i < numMarkers; i++)
+         data.markerset.push_back(Marker(i, "", "---"));
+
+      std::vector<bool> needed(numMarkers, false);
+
+      for (long long k = 0; k < numPairs; k++)
+      {
+         if (x[k] < 0 || x[k] >= numMarkers || y[k] < 0 || y[k] >= numMarkers)
+            throw std::string("Marker index out of range!");
+
+         needed[x[k]] = needed[y[k]] = true;
+      }
+
+      MarkerRanks ranks;
+      ranks.compute(data, numArrays, NULL, needed);
+
+      for (long long k = 0; k < numPairs; k++)
+         mis[k] = data.calculateMI(numArrays, x[k], y[k], 0.0, 0.0, nparLimit, NULL,
+                                   &ranks);
+   }
+   catch (const std::string& s)
+   {
+      setError(error, errorSize, s);
+      return -1;
+   }
+   catch (const std::bad_alloc&)
+   {
+      setError(error, errorSize, "Out of memory!");
+      return -1;
+   }
+
+   return 0;
+}
+
+//------------------------------------------------------------------------------------
+// subsetRanks() ranks the arrays of sample among themselves, from 1, given the ranks
+// of a marker over all the arrays (a permutation of 1 .. numArrays, see computeOne()):
+// taken[] counts the arrays of each rank in the sample, and becomes the first rank of
+// those arrays.
+// An array drawn several times (see '-r') takes consecutive ranks, in the order of
+// sample, as the noise added after bootStrap() would rank it.
+
+static void subsetRanks(const int *allRanks, const std::vector<int>& sample,
+                        int numSamples, std::vector<int>& taken, std::vector<int>& ranks)
+{
+   std::fill(taken.begin(), taken.end(), 0);
+
+   for (int a = 0; a < numSamples; a++)
+      taken[allRanks[sample[a]]]++;
+
+   for (int r = 1, count = 1; r < (int) taken.size(); r++)
+   {
+      int t = taken[r];
+      taken[r] = count;
+      count += t;
+   }
+
+   for (int a = 0; a < numSamples; a++)
+      ranks[a] = taken[allRanks[sample[a]]]++;
+}
+
+//------------------------------------------------------------------------------------
+// nullPairs() computes the null MI of the pairs k = first, first + step, ... (see
+// sjaracne_null_mi()) from the ranks of the markers over all the arrays; an error
+// ends the thread and is kept in failure
+
+static void nullPairs(const Microarray_Set *data, const MarkerRanks *all, const int *x,
+                      const int *y, long long numPairs, int numSamples, bool bootstrap,
+                      int seed, int nparLimit, long long first, long long step,
+                      double *mis, std::string *failure, std::mutex *failureMutex)
+{
+   try
+   {
+      int numArrays = data->Get_Num_Microarrays();
+
+      // a two-marker dataset whose ranks are set pair by pair
+
+      Microarray_Set pair;
+      pair.markerset.push_back(Marker(0, "", "---"));
+      pair.markerset.push_back(Marker(1, "", "---"));
+
+      MarkerRanks ranks;
+      ranks.maNum = numSamples;
+      ranks.ranks.assign(2, std::vector<int>(numSamples));
+
+      std::vector<int> arrays(numArrays), sample(numSamples), taken(numArrays + 1);
+      std::vector<int> yranks(numSamples);
+
+      for (long long k = first; k < numPairs; k += step)
+      {
+         std::seed_seq seq = {(unsigned int) seed, (unsigned int) (k & 0xffffffff),
+                              (unsigned int) (k >> 32)};
+         std::mt19937 generator(seq);
+
+         // a partial shuffle makes the first numSamples entries of arrays a random
+         // subset of the arrays
+
+         for (int a = 0; a < numArrays; a++)
+            arrays[a] = a;
+
+         for (int a = 0; a < numSamples; a++)
+         {
+            std::uniform_int_distribution<int> draw(a, numArrays - 1);
+            std::swap(arrays[a], arrays[draw(generator)]);
+         }
+
+         // with bootstrap, the sample is drawn from the subset with replacement
+
+         std::uniform_int_distribution<int> resample(0, numSamples - 1);
+
+         for (int a = 0; a < numSamples; a++)
+            sample[a] = arrays[bootstrap ? resample(generator) : a];
+
+         subsetRanks(all->get(x[k]), sample, numSamples, taken, ranks.ranks[0]);
+         subsetRanks(all->get(y[k]), sample, numSamples, taken, yranks);
+
+         // the values of y are permuted among the arrays of the subset
+
+         std::shuffle(yranks.begin(), yranks.end(), generator);
+         ranks.ranks[1] = yranks;
+
+         mis[k] = pair.calculateMI(numSamples, 0, 1, 0.0, 0.0, nparLimit, NULL, &ranks);
+      }
+   }
+   catch (const std::string& s)
+   {
+      std::lock_guard<std::mutex> lock(*failureMutex);
+      *failure = s;
+   }
+   catch (const std::bad_alloc&)
+   {
+      std::lock_guard<std::mutex> lock(*failureMutex);
+      *failure = "Out of memory!";
+   }
+}
+
+//------------------------------------------------------------------------------------
+// sjaracne_null_mi() adds the noise of addNoise() to the values, drawn from seed, and
+// ranks the markers of the pairs once over all the arrays; the ranks of a subset of
+// the arrays follow from those in linear time. The pairs are spread over numThreads
+// threads, and every pair draws from a generator of its own, seeded by seed and k, so
+// the MI do not depend on numThreads.
+
+int sjaracne_null_mi(const void *values, int numMarkers, int numArrays, const int *x,
+                     const int *y, long long numPairs, int numSamples, int bootstrap,
+                     int seed, int nparLimit, int numThreads, double *mis, char *error,
+                     int errorSize)
+{
+   try
+   {
+      if (numMarkers < 1 || numArrays < 2)
+         throw std::string("At least one marker and two arrays are required!");
+
+      if (numSamples < 2 || numSamples > numArrays)
+         throw std::string("The number of samples must be between 2 and the number "
+                           "of arrays!");
+
+      std::vector<bool> needed(numMarkers, false);
+
+      for (long long k = 0; k < numPairs; k++)
+      {
+         if (x[k] < 0 || x[k] >= numMarkers || y[k] < 0 || y[k] >= numMarkers)
+            throw std::string("Marker index out of range!");
+
+         needed[x[k]] = needed[y[k]] = true;
+      }
+
+      if (numThreads < 1)
+         numThreads = 1;
+
+      Microarray_Set data;
+
+      const ExprValue *v = static_cast<const ExprValue *>(values);
+
+      data.numArrays = numArrays;
+      data.values.assign(v, v + (size_t) numMarkers * numArrays);
+
+      for (int i = 0; i < numMarkers; i++)
+         data.markerset.push_back(Marker(i, "", "---"));
+
+      std::mt19937 generator(seed);
+      std::uniform_real_distribution<double> noise(0.0, 1e-10);
+
+      for (size_t i = 0; i < data.values.size(); i++)
+         data.values[i] += noise(generator);
+
+      MarkerRanks all;
+      all.compute(data, numArrays, NULL, needed, NULL, numThreads);
+
+      std::string failure;
+      std::mutex failureMutex;
+      std::vector<std::thread> workers;
+
+      for (int t = 1; t < numThreads; t++)
+         workers.push_back(std::thread(nullPairs, &data, &all, x, y, numPairs,
+                                       numSamples, bootstrap != 0, seed, nparLimit, t,
+                                       numThreads, mis, &failure, &failureMutex));
+
+      nullPairs(&data, &all, x, y, numPairs, numSamples, bootstrap != 0, seed, nparLimit,
+                0, numThreads, mis, &failure, &failureMutex);
+
+      for (int t = 0; t < (int) workers.size(); t++)
+         workers[t].join();
+
+      if (failure != "")
+         throw failure;
+   }
+   catch (const std::string& s)
+   {
+      setError(error, errorSize, s);
+      return -1;
+   }
+   catch (const std::bad_alloc&)
+   {
+      setError(error, errorSize, "Out of memory!");
+      return -1;
+   }
+
+   return 0;
+}
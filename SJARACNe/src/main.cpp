@@ -4,25 +4,35 @@
 // Modifications by S.V. Rice, 2017; this version assumes adaptive_partitioning
 //------------------------------------------------------------------------------------
 
+#include <algorithm>
 #include <cmath>
 #include <cstdio>
 #include <cstdlib>
 #include <ctime>
 #include <fstream>
 #include <sstream>
+#include "mapfile.h"
 #include "matrix.h"
 #include "parseargs.h"
+#include "phase.h"
 
 //------------------------------------------------------------------------------------
 
-const int NUM_OPTIONS = 20;
+const int NUM_OPTIONS = 31;
 
 const char *option[NUM_OPTIONS] =
 {
 "-a <algorithm>     default: adaptive_partitioning",
-"-c <+/-probeId %>  Conditional network reconstruction, default: NONE [****]\n"
+"-B <count>         Number of bootstrap networks built from a single reading of\n"
+"                   the input, with seeds S, S+1, ... (see '-S'), default: 0\n"
+"                   (one network) [5]",
+"-C <file>          Binary cache of the parsed input dataset; created if missing,\n"
+"                   rebuilt if the input file has changed, default: NONE",
+"-c <+/-probeId %>  Conditional network reconstruction, default: NONE [4]\n"
 "                   [format: \"+24 0.35\", \"-1973_s_at 0.4\"]",
 "-e <tolerance>     DPI tolerance, default: 1",
+"-F <format>        Output format of the network: text, binary or zbinary (binary\n"
+"                   compressed with zlib), default: text [6]",
 "-f <mean> <cv>     Gene filter by the mean and coefficient of variance (cv) of\n"
 "                   the expression values, default: mean=0, cv=0",
 "-H <ARACNE_HOME>   Directory containing ARACNE configuration files,\n"
@@ -30,49 +40,122 @@ const char *option[NUM_OPTIONS] =
 "-h <probeId>       Hub gene (only MI w/ hub gene will be computed),\n"
 "                   default: NONE",
 "--h | --help       Display this help and exit",
+"-I <file>          Network state for an incremental extension of the hub genes of\n"
+"                   '-s': read if it exists, then rewritten, default: NONE [11]",
 "-i <file>          Input gene expression profile dataset (required)",
 "-j <file>          Existing adjacency matrix (.adj) file",
 "-k <kernel_width>  Gaussian kernel width (accurate method only),\n"
 "                   default: determined by program",
 "-l <file>          File containing a list of probes annotated as transcription\n"
-"                   factors in the input dataset, default: NONE [***]",
+"                   factors in the input dataset, default: NONE [3]",
+"-m <file>          Batch of conditional networks, one condition per line in the\n"
+"                   format of '-c' (e.g. \"+24 0.35\"), default: NONE [10]",
+"-M <file>          JSON report of the time, CPU time and memory of each phase and\n"
+"                   of the work counters of each network, default: NONE [7]",
 "-N <npar_limit>    Maximum allowed value of npar, default: 20",
 "-S <Seed>	    Initial seed for random number generator, default: 1",
 "-n <level>         Array measurement noise level, default: 0",
-"-o <file>          Output file name (optional) [*]",
-"-p <p-value>       P-value for MI threshold (e.g., 1e-7), default: 1 [**]",
+"-o <file>          Output file name (optional) [1]",
+"-p <p-value>       P-value for MI threshold (e.g., 1e-7), default: 1 [2]",
+"-R <rho>           Spearman prefilter: compute the MI of a pair only if the\n"
+"                   absolute Spearman correlation of its ranks is at least rho,\n"
+"                   default: 0 (all pairs). Not conservative: edges above the MI\n"
+"                   threshold can be lost, check with '-V on' [12]",
 "-r <sample_number> Bootstrap sample number, default: 0",
 "-s <file>          File containing a list of probes for which a subnetwork will\n"
 "                   be constructed, default: NONE",
+"-T <threads>       Number of threads used to compute the MI matrix and to apply\n"
+"                   DPI, default: 1",
 "-t <threshold>     MI threshold, default: 0",
-"-v <verbose>       on|off, default: off"
+"-V <validate>      on|off: also compute the MI of the pairs the prefilter '-R'\n"
+"                   skips, and report its recall, default: off",
+"-v <verbose>       on|off, default: off",
+"-w <p1,p2,...>     Sweep: write one network for each MI p-value, all from a single\n"
+"                   MI computation at the loosest one, default: NONE [9]",
+"-x <i/n>           Compute shard i of n of the hub genes of '-s' and write its\n"
+"                   part of the network, default: 1/1 [8]"
 };
 
-const int NUM_USAGE_NOTES = 4;
+const int NUM_USAGE_NOTES = 12;
 
 const char *usageNotes[NUM_USAGE_NOTES] =
 {
-"   [*] If no output file is specified by the user, an output will be\n"
+"   [1] If no output file is specified by the user, an output will be\n"
 "       automatically generated in the same directory as the input file by\n"
 "       appending some of the parameter values, such as kernel width, MI\n"
 "       threshold, tolerance and so on, at the end of the input file name, and\n"
 "       changing the file extension to \".adj\".",
-"  [**] If the '-t' option is supplied, it will enforce the program to use the\n"
+"   [2] If the '-t' option is supplied, it will enforce the program to use the\n"
 "       specified MI threshold, therefore the '-p' option will be ignored.\n"
 "       Otherwise, the program will automatically determine the MI threshold\n"
 "       given the p-value. The default, p-value=1, will preserve all pairwise MI.",
-" [***] This option is ideal for transcriptional network reconstruction. If\n"
+"   [3] This option is ideal for transcriptional network reconstruction. If\n"
 "       provided, DPI will not remove any connection of a transcription factor (TF)\n"
 "       by connections between two probes not annotated as TFs. This option is\n"
 "       often used in conjunction with '-s', which specifies a list of probes that\n"
 "       are either the same or a subset of the probes specified by '-l'.",
-"[****] Conditional network reconstructs the network given a specified probe being\n"
+"   [4] Conditional network reconstructs the network given a specified probe being\n"
 "       most expressed or least expressed. In the format that follows '-c', probeId\n"
 "       indicates the probe to be conditioned on; '+' or '-' specify whether the\n"
 "       upper or lower tail of the probe's expression should be used as the\n"
 "       condition, and '%' is a percentage between (0,1) specifying the proportion\n"
 "       of samples used as the conditioning subset. Example usage: \"-c +24 0.35\",\n"
-"       \"-c -1973_s_at 0.4\"."
+"       \"-c -1973_s_at 0.4\".",
+"   [5] Network i (i = 1, ..., count) is identical to the one produced by a\n"
+"       separate run with seed S+i-1. Its output file name is the output file\n"
+"       name with \"_i\" (three digits) inserted before the \".adj\" extension,\n"
+"       e.g. \"-B 100 -S 1 -o TF_run.adj\" writes TF_run_001.adj ... TF_run_100.adj.",
+"   [6] The binary format holds the same header lines, edges and MI values as\n"
+"       the text format (see Matrix::writeBinary() in matrix.cpp); it is read by\n"
+"       create_consensus_network.py, but not by '-j'.",
+"   [7] The report has a \"phases\" object for reading the input (\"parse\") and\n"
+"       computing the kernel bandwidths (\"bandwidth\"), then one entry per network\n"
+"       in \"networks\" with its phases: \"bootstrap\" (resampling and noise), \"mi\",\n"
+"       \"dpi\" and \"write\", and its counters: pairs evaluated, pairs above the\n"
+"       MI threshold, edges removed by DPI, bytes written and a histogram of npar.\n"
+"       Each phase has wall_seconds, cpu_seconds and peak_rss_bytes (of the process).",
+"   [8] The hub genes are split into n contiguous slices in the order of the\n"
+"       '-s' file; the MI of the genes of the other slices that DPI needs is computed\n"
+"       too, but not written. Every shard of a network must be run with the same\n"
+"       options and seed; merge_shards.py then joins the shard outputs, in any\n"
+"       order, into the file the unsharded run writes.",
+"   [9] The MI is computed once, with the threshold of the largest p-value;\n"
+"       each network then keeps the edges above its own threshold before DPI, and is\n"
+"       identical to the one a separate run with '-p' writes. Its output file name\n"
+"       is the output file name with \"_p\" and the p-value, as given, inserted\n"
+"       before the \".adj\" extension, e.g. \"-w 1e-5,1e-7 -o TF_run.adj\" writes\n"
+"       TF_run_p1e-5.adj and TF_run_p1e-7.adj (with '-B', after the bootstrap\n"
+"       number: TF_run_001_p1e-5.adj). Each network reports a \"filter\" phase in\n"
+"       '-M'. It cannot be used with '-t', '-p', '-n', '-j' or '-x'.",
+"  [10] The input is read once for all the conditions, and the noise added to\n"
+"       the expression values, with their ranks over all the arrays, is shared by\n"
+"       the conditions (with '-r', by those of the same number of arrays). Each\n"
+"       network is identical to the one a separate run with '-c' writes; its output\n"
+"       file name is the output file name with \"_c\", the probe, \"H\" (+) or\n"
+"       \"L\" (-) and \"_\" and the percentage inserted before the \".adj\"\n"
+"       extension, e.g. \"-m conditions.txt -o TF_run.adj\" writes\n"
+"       TF_run_c24H_0.35.adj for \"+24 0.35\" (with '-B', after the bootstrap\n"
+"       number: TF_run_001_c24H_0.35.adj). It cannot be used with '-c' or '-j'.",
+"  [11] The state holds the MI rows of the hub genes before DPI, with the\n"
+"       edges DPI removed. If it was saved with the same input, seed and options\n"
+"       (everything but the '-s' and '-l' files), only the rows of hub genes added\n"
+"       to '-s' are computed, and DPI is applied again only to the rows it may\n"
+"       change; the rows of hub genes no longer listed are dropped. The network is\n"
+"       identical to the one a run without '-I' writes. Otherwise all the rows are\n"
+"       computed. It cannot be used with '-j', '-w', '-x', '-B' or '-m'.",
+"  [12] The Spearman correlations of the hub genes with all the genes are\n"
+"       computed from the ranks the MI kernel uses, a block of hub genes at a time,\n"
+"       before their MI; a pair below rho is skipped, and counted as \"pairs_skipped\"\n"
+"       in '-M'. No value of rho is safe: a pair can have an MI above the threshold\n"
+"       and a Spearman correlation near zero, e.g. a non-monotonic relation, or two\n"
+"       genes of sparse single-cell data that are zero in most samples (on the\n"
+"       Tcell1170 test data, rho 0.05 loses 3 of the 11 edges at p 1e-7); the\n"
+"       repeated samples of '-r' lose more. With '-V on', the MI of every pair is\n"
+"       computed, the network written is still the prefiltered one, and the recall\n"
+"       of the pairs above the MI threshold and of the network edges (after DPI) is\n"
+"       reported against the network computed without prefilter (\"pairs_missed\",\n"
+"       \"edges_missed\"). Check the recall of rho on one network of the data with\n"
+"       '-V on' before using it."
 };
 
 //------------------------------------------------------------------------------------
@@ -103,30 +186,50 @@ Parameter parseParameter(int argc, char *argv[])
    ARGBEGIN
    {
       case 'a': temp         = ARGF(); break;            // algorithm
+      case 'B': p.numBootstraps = std::atoi(ARGF()); break; // number of bootstraps
+      case 'C': p.cachefile  = ARGF(); break;            // dataset cache
       case 'c': temp         = ARGF();                   // condition
                 p.condition  = temp.substr(0,1);
                 p.controlId  = temp.substr(1);
                 p.percent    = std::atof(ARGF());
             break;
       case 'e': p.eps        = std::atof(ARGF()); break; // DPI tolerance
+      case 'F': p.format     = ARGF(); break;            // output format
       case 'f': p.mean       = std::atof(ARGF());        // mean
                 p.cv         = std::atof(ARGF());        // coefficient of variance
                 break;
       case 'H': p.home_dir   = ARGF(); break;            // ARACNE_HOME
+      case 'I': p.statefile  = ARGF(); break;            // network state
       case 'h': p.hub        = ARGF(); break;            // hub gene
       case 'i': p.infile     = ARGF(); break;            // input file
       case 'j': p.adjfile    = ARGF(); break;            // adjacency matrix file
       case 'k': p.sigma      = std::atof(ARGF()); break; // gaussian kernel width
       case 'l': p.annotfile  = ARGF(); break;            // TF annotation file
+      case 'm': p.conditionfile = ARGF(); break;         // batch of conditions
+      case 'M': p.metricsfile = ARGF(); break;           // metrics report
       case 'N': p.nparLimit  = std::atoi(ARGF()); break; // max npar value
       case 'S': p.seed       = std::atoi(ARGF()); break; // seed
       case 'n': p.correction = std::atof(ARGF()); break; // correction for noise
       case 'o': p.outfile    = ARGF(); break;            // output file
       case 'p': p.pvalue     = std::atof(ARGF()); break; // p-value
+      case 'R': p.minRho     = std::atof(ARGF()); break; // Spearman prefilter
       case 'r': p.sample     = std::atoi(ARGF()); break; // bootstrap sample number
       case 's': p.subnetfile = ARGF(); break;            // subset of probes
+      case 'T': p.numThreads = std::atoi(ARGF()); break; // number of threads
       case 't': p.threshold  = std::atof(ARGF()); break; // mi threshold
+      case 'V': p.validate   = ARGF(); break;            // prefilter validation
       case 'v': p.verbose    = ARGF(); break;            // verbose
+      case 'w': temp         = ARGF();                   // p-value sweep
+                for (size_t begin = 0, end = 0; end != std::string::npos; begin = end + 1)
+                {
+                   end = temp.find(',', begin);
+                   p.sweep.push_back(temp.substr(begin, end - begin));
+                }
+                break;
+      case 'x': temp         = ARGF();                   // shard
+                if (std::sscanf(temp.c_str(), "%d/%d", &p.shard, &p.numShards) != 2)
+                   throw "Shard '-x' must be i/n: " + temp;
+                break;
       default : throw std::string("unknown parameter ") + ARGC();
    }
    ARGEND;
@@ -141,51 +244,808 @@ Parameter parseParameter(int argc, char *argv[])
 
 //------------------------------------------------------------------------------------
 
-void findThreshold(int n, Parameter& p)
+// insertSuffix() inserts suffix before the ".adj" extension of outfile
+
+static std::string insertSuffix(const std::string& outfile, const std::string& suffix)
+{
+   int len = outfile.length();
+
+   if (len >= 4 && outfile.substr(len - 4) == ".adj")
+      return outfile.substr(0, len - 4) + suffix + ".adj";
+   else
+      return outfile + suffix;
+}
+
+// bootstrapOutfileName() inserts the bootstrap number before the ".adj" extension
+
+static std::string bootstrapOutfileName(const std::string& outfile, int b)
+{
+   char buffer[20];
+   std::sprintf(buffer, "_%03i", b);
+
+   return insertSuffix(outfile, buffer);
+}
+
+// sweepOutfileName() inserts the p-value of a sweep ('-w') before the ".adj" extension
+
+static std::string sweepOutfileName(const std::string& outfile,
+                                    const std::string& pvalue)
+{
+   return insertSuffix(outfile, "_p" + pvalue);
+}
+
+// conditionOutfileName() inserts the condition of q, as createOutfileName() names it,
+// and its percentage before the ".adj" extension, e.g. "_c24H_0.35"
+
+static std::string conditionOutfileName(const std::string& outfile,
+                                        const Parameter& q)
+{
+   char buffer[20];
+   std::sprintf(buffer, "_%g", q.percent);
+
+   return insertSuffix(outfile, "_c" + q.controlId + (q.condition == "+" ? "H" : "L") +
+                                buffer);
+}
+
+//------------------------------------------------------------------------------------
+// NetworkMetrics holds what the metrics report ('-M') records about one network
+
+class NetworkMetrics
+{
+public:
+   NetworkMetrics()
+      : seed(0), outfile(), phases(), counters(), bytesWritten(0) { }
+
+   int            seed;
+   std::string    outfile;
+   PhaseLog       phases;
+   KernelCounters counters;
+   long long      bytesWritten;
+};
+
+//------------------------------------------------------------------------------------
+// shardIds() returns the hub genes of shard p.shard of p.numShards ('-x'): a
+// contiguous slice of ids, so that the shards, written in shard order, list the hub
+// genes in the order of the unsharded network
+
+static std::vector<int> shardIds(const std::vector<int>& ids, const Parameter& p)
+{
+   long long n     = ids.size();
+   long long begin = n * (p.shard - 1) / p.numShards;
+   long long end   = n * p.shard / p.numShards;
+
+   return std::vector<int>(ids.begin() + begin, ids.begin() + end);
+}
+
+//------------------------------------------------------------------------------------
+// supportIds() returns the hub genes of ids, outside of rows, that are neighbors of
+// rows in matrix: DPI reads the MI of two neighbors of a row from the row of the first
+// one if it has been computed, so a shard computes these rows as the unsharded run
+// does, but does not reduce or write them
+
+static std::vector<int> supportIds(Matrix& matrix, const std::vector<int>& ids,
+                                   const std::vector<int>& rows)
+{
+   matrix.freeze();
+
+   int n = matrix.numRows();
+
+   std::vector<int> support;
+   std::vector<bool> isHub, seen(n, false);
+
+   for (int i = 0; i < (int) ids.size(); i++)
+   {
+      if (ids[i] >= (int) isHub.size())
+         isHub.resize(ids[i] + 1, false);
+
+      isHub[ids[i]] = true;
+   }
+
+   for (int i = 0; i < (int) rows.size(); i++)
+      if (rows[i] < n)
+         seen[rows[i]] = true;
+
+   for (int i = 0; i < (int) rows.size(); i++)
+   {
+      if (rows[i] >= n)
+         continue;
+
+      for (long long e = matrix.rowStart[rows[i]]; e < matrix.rowStart[rows[i] + 1]; e++)
+      {
+         int g = matrix.neighbor[e];
+
+         if (g < (int) isHub.size() && isHub[g] && (g >= n || !seen[g]))
+         {
+            if (g >= n)
+            {
+               seen.resize(g + 1, false);
+               n = g + 1;
+            }
+
+            seen[g] = true;
+            support.push_back(g);
+         }
+      }
+   }
+
+   return support;
+}
+
+//------------------------------------------------------------------------------------
+// stateSignature() describes what the MI rows of a network depend on besides its hub
+// genes: the expression values before noise, the active markers, the arrays, the seed
+// and the MI options; a network state ('-I') saved under another signature is not
+// reused
+
+static std::string stateSignature(const Microarray_Set& data, const Parameter& p,
+                                  int nsample, int controlId,
+                                  const std::vector<int> *arrays)
+{
+   std::string active(data.markerset.size(), '0');
+
+   for (int i = 0; i < (int) data.markerset.size(); i++)
+      if (data.markerset[i].isActive)
+         active[i] = '1';
+
+   std::ostringstream sig;
+   sig.precision(17);
+
+   sig << "values " << hashBytes(reinterpret_cast<const char *>(data.values.data()),
+                                 data.values.size() * sizeof(ExprValue))
+       << " active " << hashBytes(active.data(), active.size())
+       << " arrays " << data.numArrays << " nsample " << nsample
+       << " control " << controlId;
+
+   if (arrays != NULL)
+      sig << " subset " << hashBytes(reinterpret_cast<const char *>(arrays->data()),
+                                     arrays->size() * sizeof(int));
+
+   sig << " seed " << p.seed << " sample " << p.sample << " threshold " << p.threshold
+       << " correction " << p.correction << " npar " << p.nparLimit
+       << " prefilter " << p.minRho << " value_size " << sizeof(ExprValue);
+
+   return sig.str();
+}
+
+//------------------------------------------------------------------------------------
+// extendNetwork() computes the rows of the hub genes ids into matrix, starting from the
+// network state p.statefile ('-I') if it was saved under signature: only the rows of
+// new hub genes are computed, and those of hub genes no longer in ids are dropped.
+// DPI of a row reads the row, the rows of its neighbors (see getNodeMI()) and the
+// transcription factor flags of these genes, so a saved row keeps its intermediates
+// unless one of them gained or lost a row or a flag. rows receives the rows of ids,
+// each one once, and dirty those DPI has to be applied to.
+
+static void extendNetwork(Microarray_Set& data, const Parameter& p, int nsample,
+                          int controlId, std::vector<int> *arrays,
+                          const std::vector<int>& ids, Transfac& transfac,
+                          const std::string& signature, Matrix& matrix,
+                          const MarkerRanks *allRanks, RankScreen *prefilter,
+                          std::vector<int>& rows, std::vector<int>& dirty)
+{
+   int numMarkers = data.markerset.size();
+
+   std::vector<bool> isRow(numMarkers, false);
+
+   for (int i = 0; i < (int) ids.size(); i++)
+      if (ids[i] != controlId && !isRow[ids[i]])
+      {
+         isRow[ids[i]] = true;
+         rows.push_back(ids[i]);
+      }
+
+   double epsilon;
+   std::vector<int> stored, tfs;
+
+   if (!matrix.readState(p.statefile, signature, epsilon, stored, tfs))
+   {
+      std::cout << "[INCREMENTAL] No state of this input and options in "
+                << p.statefile << ", computing all " << rows.size() << " rows"
+                << std::endl;
+
+      data.createEdgeMatrix(nsample, matrix, p.threshold, controlId, p.correction,
+                            p.nparLimit, rows, arrays, p.numThreads, allRanks,
+                            prefilter);
+      dirty = rows;
+      return;
+   }
+
+   // drop the rows of the hub genes no longer listed, and compute those of the new ones
+
+   std::vector<bool> isStored(numMarkers, false), hadRow(numMarkers, false);
+   int numDropped = 0;
+
+   for (int i = 0; i < (int) stored.size(); i++)
+   {
+      if (stored[i] >= numMarkers)
+         throw "Invalid network state file " + p.statefile;
+
+      isStored[stored[i]] = true;
+      hadRow[stored[i]]   = (matrix.rowSize(stored[i]) > 0);
+   }
+
+   matrix.thaw();
+
+   for (int i = 0; i < (int) stored.size(); i++)
+      if (!isRow[stored[i]])
+      {
+         NodeMap().swap(matrix.nmv[stored[i]]);
+         numDropped++;
+      }
+
+   std::vector<int> added;
+
+   for (int i = 0; i < (int) rows.size(); i++)
+      if (!isStored[rows[i]])
+         added.push_back(rows[i]);
+
+   if (added.size() > 0)
+      data.createEdgeMatrix(nsample, matrix, p.threshold, controlId, p.correction,
+                            p.nparLimit, added, arrays, p.numThreads, allRanks,
+                            prefilter);
+
+   matrix.freeze();
+
+   // the genes whose row or transcription factor flag differs from the saved network
+
+   std::vector<bool> changed(numMarkers, false), wasTF(numMarkers, false),
+                     isTF(numMarkers, false);
+
+   for (int i = 0; i < (int) tfs.size(); i++)
+      if (tfs[i] >= 0 && tfs[i] < numMarkers)
+         wasTF[tfs[i]] = true;
+
+   for (Transfac::iterator tpos = transfac.begin(); tpos != transfac.end(); ++tpos)
+      if (tpos->first >= 0 && tpos->first < numMarkers)
+         isTF[tpos->first] = true;
+
+   int n = matrix.numRows();
+
+   for (int g = 0; g < numMarkers; g++)
+   {
+      bool hasRow = (isRow[g] && g < n && matrix.rowSize(g) > 0);
+
+      changed[g] = (hasRow != hadRow[g] || isTF[g] != wasTF[g]);
+   }
+
+   // without transcription factors DPI protects no edge at all, and intermediates of
+   // another tolerance are of no use
+
+   bool all = (epsilon != p.eps || tfs.empty() != transfac.empty());
+
+   for (int i = 0; i < (int) rows.size(); i++)
+   {
+      int r = rows[i];
+
+      bool redo = (all || !isStored[r] || changed[r]);
+
+      for (long long e = matrix.rowStart[r]; !redo && e < matrix.rowStart[r + 1]; e++)
+         redo = (matrix.neighbor[e] < numMarkers && changed[matrix.neighbor[e]]);
+
+      if (redo)
+      {
+         for (long long e = matrix.rowStart[r]; e < matrix.rowStart[r + 1]; e++)
+            matrix.intermediate[e] = -1;
+
+         dirty.push_back(r);
+      }
+   }
+
+   std::cout << "[INCREMENTAL] Rows reused from " << p.statefile << ": "
+             << rows.size() - added.size() << ", computed: " << added.size()
+             << ", dropped: " << numDropped << ", reduced by DPI: " << dirty.size()
+             << std::endl;
+}
+
+//------------------------------------------------------------------------------------
+// reduceAndWrite() applies DPI to matrix and writes it as p.outfile, recording both in
+// metrics; dirty, if given, lists the rows of rows DPI is applied to, the others
+// having been reduced already (see extendNetwork())
+
+static void reduceAndWrite(Microarray_Set& data, const Parameter& p, Matrix& matrix,
+                           const std::vector<int>& rows, bool empty,
+                           Transfac& transfac, NetworkMetrics& metrics,
+                           const std::vector<int> *dirty=NULL)
+{
+   PhaseTimer timer;
+
+   if (p.eps != 1.0 && !empty && (dirty == NULL || dirty->size() > 0))
+   {
+      std::cout << "[NETWORK] Applying DPI ..." << std::endl;
+      matrix.reduce(p.eps, (dirty != NULL ? *dirty : rows), transfac, p.numThreads);
+
+      metrics.phases.add("dpi", timer.stop());
+   }
+
+   timer.start();
+
+   metrics.bytesWritten = matrix.write(data, rows, p);
+
+   metrics.phases.add("write", timer.stop());
+
+   metrics.seed     = p.seed;
+   metrics.outfile  = p.outfile;
+   metrics.counters = kernelCounters;
+}
+
+//------------------------------------------------------------------------------------
+// removePairs() removes the edges of pairs, in both directions, from matrix
+
+static void removePairs(Matrix& matrix, const std::vector<std::pair<int, int> >& pairs)
+{
+   matrix.thaw();
+
+   int n = matrix.nmv.size();
+
+   for (int k = 0; k < (int) pairs.size(); k++)
+   {
+      if (pairs[k].first < n)
+         matrix.nmv[pairs[k].first].erase(pairs[k].second);
+
+      if (pairs[k].second < n)
+         matrix.nmv[pairs[k].second].erase(pairs[k].first);
+   }
+
+   matrix.freeze();
+}
+
+//------------------------------------------------------------------------------------
+// reportRecall() applies DPI to reference, the network computed without the Spearman
+// prefilter ('-V'), and reports how many of the edges of its rows (those written)
+// filtered, the prefiltered network after DPI, lacks or has in addition
+
+static void reportRecall(const Parameter& p, Matrix& reference, const Matrix& filtered,
+                         const std::vector<int>& rows, Transfac& transfac,
+                         NetworkMetrics& metrics)
+{
+   PhaseTimer timer;
+
+   if (p.eps != 1.0)
+      reference.reduce(p.eps, rows, transfac, p.numThreads);
+
+   int n = reference.numRows();
+
+   std::vector<int> written;
+   std::vector<bool> seen(n, false);
+
+   for (int i = 0; i < (rows.size() == 0 ? n : (int) rows.size()); i++)
+   {
+      int r = (rows.size() == 0 ? i : rows[i]);
+
+      if (r < n && !seen[r])
+      {
+         seen[r] = true;
+         written.push_back(r);
+      }
+   }
+
+   long long edges = 0, missed = 0, kept = 0;
+
+   for (int i = 0; i < (int) written.size(); i++)
+   {
+      int r = written[i];
+
+      for (long long e = reference.rowStart[r]; e < reference.rowStart[r + 1]; e++)
+         if (reference.intermediate[e] < 0)
+         {
+            long long f = (r < filtered.numRows() ?
+                           filtered.findEdge(r, reference.neighbor[e]) : -1);
+
+            edges++;
+
+            if (f < 0 || filtered.intermediate[f] >= 0)
+               missed++;
+         }
+
+      if (r < filtered.numRows())
+         for (long long e = filtered.rowStart[r]; e < filtered.rowStart[r + 1]; e++)
+            if (filtered.intermediate[e] < 0)
+               kept++;
+   }
+
+   const KernelCounters& c = metrics.counters;
+
+   std::cout << "[PREFILTER] Pairs above the MI threshold skipped: " << c.pairsMissed
+             << " of " << c.pairsAboveThreshold << " (recall "
+             << (c.pairsAboveThreshold > 0 ?
+                 1.0 - (double) c.pairsMissed / c.pairsAboveThreshold : 1.0)
+             << ")" << std::endl;
+
+   std::cout << "[PREFILTER] Network edges lost: " << missed << " of " << edges
+             << " (recall " << (edges > 0 ? 1.0 - (double) missed / edges : 1.0)
+             << "), edges gained: " << kept - (edges - missed) << std::endl;
+
+   metrics.counters.edgesMissed = missed;
+   metrics.phases.add("validate", timer.stop());
+}
+
+//------------------------------------------------------------------------------------
+// buildNetwork() computes (or reads, see '-j'), reduces and writes one network, or
+// one network per p-value of a sweep ('-w'), appending their metrics to networks;
+// data is modified by the noise added to the expression values, unless noiseAdded
+// says that it has been added already. allRanks, if given, ranks all the arrays of
+// data (see MarkerRanks::deriveOne()). With '-I', the network is extended from its
+// saved state, which is then rewritten.
+
+static void buildNetwork(Microarray_Set& data, const Parameter& p, int nsample,
+                         int controlId, std::vector<int> *arrays,
+                         const std::vector<int>& ids, Transfac& transfac,
+                         std::vector<NetworkMetrics>& networks,
+                         const MarkerRanks *allRanks=NULL, bool noiseAdded=false)
+{
+   kernelCounters.clear();
+
+   NetworkMetrics metrics;
+   PhaseTimer timer;
+
+   std::srand(p.seed);
+
+   Matrix matrix;
+
+   // with '-x', only the shard's slice of the hub genes is reduced and written; an
+   // empty slice gives an empty network, never one of all genes
+
+   std::vector<int> rows = (p.numShards > 1 ? shardIds(ids, p) : ids);
+   bool empty = (p.numShards > 1 && rows.size() == 0);
+
+   // the state is saved under the expression values before the noise is added
+
+   std::string signature;
+   std::vector<int> stateRows, dirty;
+
+   if (p.statefile != "")
+      signature = stateSignature(data, p, nsample, controlId, arrays);
+
+   RankScreen screen(p.minRho, p.validate == "on");
+   RankScreen *prefilter = (p.minRho > 0.0 ? &screen : NULL);
+
+   if (p.adjfile != "")
+   {
+      matrix.read(data, p);
+      metrics.phases.add("read_network", timer.stop());
+   }
+   else
+   {
+      std::vector<int> bs;
+
+      if (p.sample > 0)
+      {
+         data.bootStrap(bs, arrays);
+         arrays = &bs;
+      }
+
+      if (!noiseAdded)
+         data.addNoise();
+
+      metrics.phases.add("bootstrap", timer.stop());
+      timer.start();
+
+      if (p.statefile != "")
+         extendNetwork(data, p, nsample, controlId, arrays, ids, transfac, signature,
+                       matrix, allRanks, prefilter, stateRows, dirty);
+      else if (!empty)
+         data.createEdgeMatrix(nsample, matrix, p.threshold, controlId, p.correction,
+                               p.nparLimit, rows, arrays, p.numThreads, allRanks,
+                               prefilter);
+
+      if (!empty && p.numShards > 1 && p.eps != 1.0)
+      {
+         std::vector<int> support = supportIds(matrix, ids, rows);
+
+         if (support.size() > 0)
+            data.createEdgeMatrix(nsample, matrix, p.threshold, controlId,
+                                  p.correction, p.nparLimit, support, arrays,
+                                  p.numThreads, allRanks, prefilter);
+      }
+
+      metrics.phases.add("mi", timer.stop());
+
+      if (prefilter != NULL)
+         std::cout << "[PREFILTER] Pairs " << (screen.validate ? "to be " : "")
+                   << "skipped: " << kernelCounters.pairsSkipped << " of "
+                   << kernelCounters.pairsEvaluated +
+                      (screen.validate ? 0 : kernelCounters.pairsSkipped)
+                   << std::endl;
+   }
+
+   // with '-V', matrix holds the network computed without prefilter, which is kept
+   // as the reference; removing the pairs the prefilter skips gives the prefiltered
+   // network
+
+   Matrix reference;
+
+   if (screen.validate)
+   {
+      matrix.freeze();
+      reference = matrix;
+      removePairs(matrix, screen.missed);
+   }
+
+   if (p.sweep.size() == 0)
+   {
+      reduceAndWrite(data, p, matrix, rows, empty, transfac, metrics,
+                     p.statefile != "" ? &dirty : NULL);
+
+      if (screen.validate)
+         reportRecall(p, reference, matrix, rows, transfac, metrics);
+
+      if (p.statefile != "")
+      {
+         timer.start();
+         matrix.writeState(p.statefile, signature, p.eps, stateRows, transfac);
+         metrics.phases.add("state", timer.stop());
+      }
+
+      networks.push_back(metrics);
+      return;
+   }
+
+   // the sweep: matrix holds the edges above the loosest threshold, p.threshold; each
+   // network keeps those above its own before DPI, which changes the copy only. The
+   // first network reports the bootstrap and MI phases and the kernel counters.
+
+   matrix.freeze();
+
+   for (int k = 0; k < (int) p.sweep.size(); k++)
+   {
+      Parameter q(p);
+
+      q.pvalue    = std::atof(p.sweep[k].c_str());
+      q.threshold = p.sweepThresholds[k];
+      q.outfile   = sweepOutfileName(p.outfile, p.sweep[k]);
+
+      if (k > 0)
+      {
+         kernelCounters.clear();
+         metrics = NetworkMetrics();
+      }
+
+      std::cout << "[SWEEP] P-value " << p.sweep[k] << " (MI threshold "
+                << q.threshold << ")" << std::endl;
+
+      Matrix filtered;
+
+      timer.start();
+      filtered.filter(matrix, q.threshold);
+      metrics.phases.add("filter", timer.stop());
+
+      reduceAndWrite(data, q, filtered, rows, empty, transfac, metrics);
+      networks.push_back(metrics);
+   }
+}
+
+//------------------------------------------------------------------------------------
+// Condition is one network of a batch of conditional networks ('-m'): its parameters,
+// with the condition and MI threshold, its control probe and the arrays of its
+// condition
+
+class Condition
+{
+public:
+   Condition()
+      : param(), controlId(-1), arrays() { }
+
+   Parameter        param;
+   int              controlId;
+   std::vector<int> arrays;
+};
+
+//------------------------------------------------------------------------------------
+// buildConditionalNetworks() builds the network of each condition with seed p.seed
+// and output file p.outfile (see conditionOutfileName()), as a separate run with '-c'
+// would. The random draws of such a run, and so the noise added to the expression
+// values, are the same for all conditions, or with '-r' for those of as many arrays:
+// the noisy values and their ranks over all arrays are computed once for those, and
+// each condition derives the ranks of its arrays from them. The expression values of
+// data are left untouched.
+
+static void buildConditionalNetworks(Microarray_Set& data, const Parameter& p,
+                                     std::vector<Condition>& conditions,
+                                     const std::vector<int>& ids, Transfac& transfac,
+                                     std::vector<NetworkMetrics>& networks)
 {
-   std::string filename = p.home_dir + "config_threshold.txt";
+   int numConditions = conditions.size();
+   int numMarkers    = data.markerset.size();
+
+   // the number of random draws before the noise: those of bootStrap()
+
+   std::vector<std::pair<int, int> > byDraws;
+
+   for (int i = 0; i < numConditions; i++)
+      byDraws.push_back(std::make_pair(p.sample > 0 ? conditions[i].arrays.size() : 0,
+                                       i));
 
-   std::ifstream infile(filename.c_str());
-   if (!infile.is_open())
-      throw "Unable to open " + filename;
+   std::sort(byDraws.begin(), byDraws.end());
 
-   std::string line;
+   std::vector<bool> needed(numMarkers, false);
 
-   std::getline(infile, line);
-   while (line.length() > 0 && line[0] == '>')
-      std::getline(infile, line);
+   for (int i = 0; i < numMarkers; i++)
+      needed[i] = data.markerset[i].isActive;
+
+   for (int i = 0; i < (int) ids.size(); i++)
+      needed[ids[i]] = true;
+
+   Microarray_Set noisy;
+   MarkerRanks allRanks;
+
+   for (int k = 0; k < numConditions; k++)
+   {
+      Condition& c = conditions[byDraws[k].second];
+
+      Parameter q(c.param);
+
+      q.seed    = p.seed;
+      q.outfile = conditionOutfileName(p.outfile, c.param);
+
+      std::cout << "[CONDITION] " << c.param.condition << c.param.controlId << " "
+                << c.param.percent << " (" << c.arrays.size() << " arrays)" << std::endl;
+
+      PhaseLog phases;
+      PhaseTimer timer;
+
+      if (k == 0 || byDraws[k].first != byDraws[k - 1].first)
+      {
+         noisy = data;
 
-   std::istringstream sin(line);
+         std::srand(p.seed);
 
-   if (!sin.good() || sin.peek() == EOF)
-      throw "Configuration file format error: " + filename;
+         for (int i = 0; i < byDraws[k].first; i++)
+            std::rand();
 
-   double alpha, beta, gamma;
-   sin >> alpha >> beta >> gamma;
-   p.threshold = (alpha - std::log(p.pvalue)) / (-beta - gamma * n);
+         noisy.addNoise();
 
-   infile.close();
+         allRanks.compute(noisy, noisy.Get_Num_Microarrays(), NULL, needed, NULL,
+                          p.numThreads);
+
+         phases.add("noise", timer.stop());
+         timer.start();
+      }
+
+      // the variances, used by the correction ('-n'), are those of the values
+      // without noise
+
+      data.computeMarkerBandwidth(&c.arrays);
+
+      for (int i = 0; i < numMarkers; i++)
+      {
+         noisy.markerset[i].var       = data.markerset[i].var;
+         noisy.markerset[i].bandwidth = data.markerset[i].bandwidth;
+      }
+
+      phases.add("bandwidth", timer.stop());
+
+      int first = networks.size();
+
+      buildNetwork(noisy, q, c.arrays.size(), c.controlId, &c.arrays, ids, transfac,
+                   networks, &allRanks, true);
+
+      std::vector<std::pair<std::string, PhaseStats> >& log = networks[first].phases.phases;
+      log.insert(log.begin(), phases.phases.begin(), phases.phases.end());
+   }
+}
+
+//------------------------------------------------------------------------------------
+// writeMetrics() writes the metrics report ('-M'), see usage note [7]
+
+static void writeMetrics(const Parameter& p, const PhaseStats& total,
+                         const PhaseLog& phases,
+                         const std::vector<NetworkMetrics>& networks)
+{
+   std::ofstream out(p.metricsfile.c_str());
+   if (!out.is_open())
+      throw "Unable to open " + p.metricsfile;
+
+   out << "{\n";
+   out << "  \"input\": " << jsonString(p.infile) << ",\n";
+   out << "  \"threads\": " << p.numThreads << ",\n";
+   out << "  \"total\": ";
+   writeJson(out, total);
+   out << ",\n";
+   out << "  \"phases\": {\n";
+   phases.writeJson(out, "    ");
+   out << "  },\n";
+   out << "  \"networks\": [\n";
+
+   for (size_t i = 0; i < networks.size(); i++)
+   {
+      const NetworkMetrics& n = networks[i];
+      const KernelCounters& c = n.counters;
+
+      out << "    {\n";
+      out << "      \"seed\": " << n.seed << ",\n";
+      out << "      \"output\": " << jsonString(n.outfile) << ",\n";
+      out << "      \"phases\": {\n";
+      n.phases.writeJson(out, "        ");
+      out << "      },\n";
+      out << "      \"counters\": {\"pairs_evaluated\": " << c.pairsEvaluated
+          << ", \"pairs_above_threshold\": " << c.pairsAboveThreshold
+          << ", \"edges_removed_by_dpi\": " << c.edgesRemoved
+          << ", \"bytes_written\": " << n.bytesWritten
+          << ",\n                   \"pairs_skipped\": " << c.pairsSkipped
+          << ", \"pairs_missed\": " << c.pairsMissed
+          << ", \"edges_missed\": " << c.edgesMissed
+          << ",\n                   \"npar_histogram\": [";
+
+      for (size_t k = 0; k < c.nparHistogram.size(); k++)
+         out << (k > 0 ? ", " : "") << c.nparHistogram[k];
+
+      out << "]}\n";
+      out << "    }" << (i + 1 < networks.size() ? ",\n" : "\n");
+   }
+
+   out << "  ]\n";
+   out << "}\n";
+
+   out.close();
+
+   if (!out)
+      throw "Unable to write " + p.metricsfile;
+}
+
+//------------------------------------------------------------------------------------
+// setThreshold() determines the MI threshold of p.pvalue, or those of the p-values of
+// a sweep ('-w'), for nsample arrays
+
+static void setThreshold(Parameter& p, int nsample)
+{
+   if (p.sweep.size() > 0)
+   {
+      // the MI is computed at the loosest threshold of the sweep; p.pvalue and
+      // p.threshold only name the output files of createOutfileName()
+
+      for (int k = 0; k < (int) p.sweep.size(); k++)
+      {
+         Parameter q(p);
+
+         q.pvalue = std::atof(p.sweep[k].c_str());
+
+         if (q.pvalue != 1.0)
+            findThreshold(nsample, q);
+
+         p.sweepThresholds.push_back(q.threshold);
+
+         std::cout << "MI threshold determined for p=" << q.pvalue << ": "
+                   << q.threshold << std::endl;
+
+         if (k == 0 || q.threshold < p.threshold)
+         {
+            p.threshold = q.threshold;
+            p.pvalue    = q.pvalue;
+         }
+      }
+   }
+   else if (p.threshold == 0.0 && p.pvalue != 1.0)
+   {
+      findThreshold(nsample, p);
+
+      std::cout << "MI threshold determined for p=" << p.pvalue << ": " << p.threshold
+                << std::endl;
+   }
 }
 
 //------------------------------------------------------------------------------------
 
 void runStandard(int argc, char *argv[])
 {
+   PhaseTimer total, timer;
+   PhaseLog phases;
+
    Parameter p = parseParameter(argc, argv);
-   std::srand(p.seed);
    Microarray_Set data;
 
-   data.read(p.infile);
+   data.read(p.infile, p.cachefile);
 
    if (p.mean > 0.0 || p.cv > 0.0)
       std::cout << data.filter(p.mean, p.cv)
                 << " markers disabled due to lack of dynamic range."
                 << std::endl << std::endl;
 
+   phases.add("parse", timer.stop());
+
    std::vector<int> lower, upper, *arrays = NULL;
 
    int controlId = -1;
-   int nsample   = data.uarrays.size();
+   int nsample   = data.Get_Num_Microarrays();
 
    if (p.controlId != "")
    {
@@ -202,18 +1062,45 @@ void runStandard(int argc, char *argv[])
              << " (" << data.Get_Num_Active_Markers() << " active)"
              << ", Array No: " << nsample << std::endl;
 
-   if (p.threshold == 0.0 && p.pvalue != 1.0)
+   // a batch of conditions ('-m') has the arrays, MI threshold and bandwidths of each
+   // condition
+
+   std::vector<Condition> conditions;
+
+   for (int i = 0; i < (int) p.conditions.size(); i++)
    {
-      findThreshold(nsample, p);
+      Condition c;
 
-      std::cout << "MI threshold determined for p=" << p.pvalue << ": " << p.threshold
-                << std::endl;
+      c.param = p;
+      parseCondition(p.conditions[i], c.param);
+
+      c.controlId = data.getProbeId(c.param.controlId);
+      if (c.controlId == -1)
+         throw "Cannot find marker: " + c.param.controlId;
+
+      data.getHighLowPercent(c.param.percent, c.controlId, lower, upper);
+      c.arrays.swap(c.param.condition == "+" ? upper : lower);
+      lower.clear();
+      upper.clear();
+
+      setThreshold(c.param, c.arrays.size());
+
+      conditions.push_back(c);
    }
 
-   if (p.correction != 0.0)
-      data.computeMarkerVariance(arrays);
+   if (conditions.size() == 0)
+   {
+      setThreshold(p, nsample);
+
+      timer.start();
 
-   data.computeMarkerBandwidth(arrays);
+      if (p.correction != 0.0)
+         data.computeMarkerVariance(arrays);
+
+      data.computeMarkerBandwidth(arrays);
+
+      phases.add("bandwidth", timer.stop());
+   }
 
    std::vector<int> ids;
 
@@ -243,6 +1130,14 @@ void runStandard(int argc, char *argv[])
          ids.push_back(gid);
    }
 
+   if (p.numShards > 1 && ids.size() == 0)
+      throw "None of the hub genes of \"" + p.subnetfile + "\" are found, nothing to "
+            "shard!";
+
+   if (p.statefile != "" && ids.size() == 0)
+      throw "None of the hub genes of \"" + p.subnetfile + "\" are found, nothing to "
+            "extend!";
+
    Transfac transfac;
 
    int numTFs = p.tf_list.size();
@@ -257,36 +1152,44 @@ void runStandard(int argc, char *argv[])
      transfac[gid] = 1;
    }
 
-   Matrix matrix;
+   if (p.outfile == "")
+      createOutfileName(p);
 
-   if (p.adjfile != "")
-      matrix.read(data, p);
+   std::vector<NetworkMetrics> networks;
+
+   if (p.numBootstraps == 0 && conditions.size() > 0)
+      buildConditionalNetworks(data, p, conditions, ids, transfac, networks);
+   else if (p.numBootstraps == 0)
+      buildNetwork(data, p, nsample, controlId, arrays, ids, transfac, networks);
    else
    {
-      std::vector<int> bs;
+      // the input is read once; each bootstrap starts from an untouched copy of it,
+      // since addNoise() modifies the expression values
 
-      if (p.sample > 0)
+      for (int b = 1; b <= p.numBootstraps; b++)
       {
-         data.bootStrap(bs, arrays);
-     arrays = &bs;
-      }
+         Parameter q(p);
 
-      data.addNoise();
+         q.seed    = p.seed + b - 1;
+         q.outfile = bootstrapOutfileName(p.outfile, b);
 
-      data.createEdgeMatrix(nsample, matrix, p.threshold, controlId, p.correction,
-                            p.nparLimit, ids, arrays);
-   }
+         std::cout << "[BOOTSTRAP] " << b << " of " << p.numBootstraps
+                   << " (seed " << q.seed << ")" << std::endl;
 
-   if (p.eps != 1.0)
-   {
-      std::cout << "[NETWORK] Applying DPI ..." << std::endl;
-      matrix.reduce(p.eps, ids, transfac);
-   }
+         if (conditions.size() > 0)
+            buildConditionalNetworks(data, q, conditions, ids, transfac, networks);
+         else
+         {
+            Microarray_Set sample(data);
 
-   if (p.outfile == "")
-      createOutfileName(p);
+            buildNetwork(sample, q, nsample, controlId, arrays, ids, transfac,
+                         networks);
+         }
+      }
+   }
 
-   matrix.write(data, ids, p);
+   if (p.metricsfile != "")
+      writeMetrics(p, total.stop(), phases, networks);
 }
 
 //------------------------------------------------------------------------------------
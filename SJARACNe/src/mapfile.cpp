@@ -0,0 +1,95 @@
+//------------------------------------------------------------------------------------
+// MappedFile -- read-only memory mapping of a whole file
+//------------------------------------------------------------------------------------
+
+#include <cstring>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#include "mapfile.h"
+
+//------------------------------------------------------------------------------------
+
+bool MappedFile::open(const std::string& filename)
+{
+   close();
+
+   int fd = ::open(filename.c_str(), O_RDONLY);
+   if (fd < 0)
+      return false;
+
+   struct stat st;
+
+   if (::fstat(fd, &st) != 0)
+   {
+      ::close(fd);
+      return false;
+   }
+
+   size  = st.st_size;
+   mtime = st.st_mtime;
+
+   if (size == 0) // an empty file cannot be mapped
+   {
+      ::close(fd);
+      data = "";
+      return true;
+   }
+
+   void *addr = ::mmap(NULL, size, PROT_READ, MAP_PRIVATE, fd, 0);
+   ::close(fd);
+
+   if (addr == MAP_FAILED)
+   {
+      size = 0;
+      return false;
+   }
+
+   ::madvise(addr, size, MADV_SEQUENTIAL);
+
+   data   = static_cast<const char *>(addr);
+   mapped = true;
+
+   return true;
+}
+
+//------------------------------------------------------------------------------------
+
+void MappedFile::close()
+{
+   if (mapped)
+      ::munmap(const_cast<char *>(data), size);
+
+   data   = NULL;
+   size   = 0;
+   mtime  = 0;
+   mapped = false;
+}
+
+//------------------------------------------------------------------------------------
+// hashBytes() computes a 64-bit hash of a block of memory, eight bytes at a time; it
+// is used to tell whether a file has changed, not for security
+
+unsigned long long hashBytes(const char *data, std::size_t size)
+{
+   const unsigned long long prime = 0x100000001b3ULL;
+
+   unsigned long long h = 0xcbf29ce484222325ULL ^ size;
+
+   std::size_t i = 0;
+
+   for (; i + 8 <= size; i += 8)
+   {
+      unsigned long long word;
+      std::memcpy(&word, data + i, 8);
+
+      h = (h ^ word) * prime;
+      h ^= h >> 29;
+   }
+
+   for (; i < size; i++)
+      h = (h ^ static_cast<unsigned char>(data[i])) * prime;
+
+   return h ^ (h >> 32);
+}
@@ -0,0 +1,45 @@
+//------------------------------------------------------------------------------------
+// MappedFile -- read-only memory mapping of a whole file
+//------------------------------------------------------------------------------------
+
+#ifndef MAPFILE_H__
+#define MAPFILE_H__
+
+#include <cstddef>
+#include <string>
+
+//------------------------------------------------------------------------------------
+// The MappedFile class maps a file into memory so that it can be parsed in place,
+// without going through iostreams. The mapping is released by close() or when the
+// object is destroyed.
+//------------------------------------------------------------------------------------
+
+class MappedFile
+{
+public:
+   MappedFile()
+      : data(NULL), size(0), mtime(0), mapped(false) { }
+   ~MappedFile() { close(); }
+
+   const char *data;     // first byte of the file
+   std::size_t size;     // size of the file in bytes
+   long long   mtime;    // last modification time (seconds since the epoch)
+
+   bool open(const std::string& filename); // false if the file cannot be mapped
+   void close();
+
+   const char *begin() const { return data; }
+   const char *end()   const { return data + size; }
+
+private:
+   bool mapped;
+
+   MappedFile(const MappedFile&);            // not copyable
+   MappedFile& operator=(const MappedFile&);
+};
+
+//------------------------------------------------------------------------------------
+
+unsigned long long hashBytes(const char *data, std::size_t size);
+
+#endif
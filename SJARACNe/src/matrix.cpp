@@ -5,7 +5,9 @@
 //------------------------------------------------------------------------------------
 
 #include <algorithm>
+#include <atomic>
 #include <cctype>
+#include <cmath>
 #include <cstdio>
 #include <cstdlib>
 #include <ctime>
@@ -15,10 +17,115 @@
 #include <iterator>
 #include <sstream>
 #include <iostream>
+#include <mutex>
+#include <thread>
 #include "matrix.h"
 #include "util.h"
 
-int maxNpar = 0; // maximum observed value of npar
+#ifdef SJARACNE_ZLIB
+#include <zlib.h>
+#endif
+
+std::atomic<int> maxNpar(0); // maximum observed value of npar
+
+KernelCounters kernelCounters;
+
+static thread_local KernelCounters threadCounters; // counts of the calling thread
+static std::mutex countersMutex;                   // serializes kernelCounters.add()
+
+//------------------------------------------------------------------------------------
+// updateMaxNpar() raises maxNpar to npar; safe to call from several threads
+
+static void updateMaxNpar(int npar)
+{
+   int current = maxNpar.load();
+
+   while (npar > current && !maxNpar.compare_exchange_weak(current, npar))
+      ;
+}
+
+//------------------------------------------------------------------------------------
+
+void KernelCounters::countPair(int npar)
+{
+   pairsEvaluated++;
+
+   if ((int) nparHistogram.size() <= npar)
+      nparHistogram.resize(npar + 1, 0);
+
+   nparHistogram[npar]++;
+}
+
+void KernelCounters::add(const KernelCounters& c)
+{
+   pairsEvaluated      += c.pairsEvaluated;
+   pairsAboveThreshold += c.pairsAboveThreshold;
+   edgesRemoved        += c.edgesRemoved;
+   pairsSkipped        += c.pairsSkipped;
+   pairsMissed         += c.pairsMissed;
+   edgesMissed         += c.edgesMissed;
+
+   if (nparHistogram.size() < c.nparHistogram.size())
+      nparHistogram.resize(c.nparHistogram.size(), 0);
+
+   for (size_t n = 0; n < c.nparHistogram.size(); n++)
+      nparHistogram[n] += c.nparHistogram[n];
+}
+
+//------------------------------------------------------------------------------------
+// RowScheduler hands out the rows of the adjacency matrix to worker threads (see
+// createEdgeMatrix() and Matrix::reduce()), optionally reports the progress, and
+// records the first error thrown by a worker so that it can be rethrown by the
+// calling thread
+
+class RowScheduler
+{
+public:
+   RowScheduler(int inCount, bool report=true)
+      : next(0), done(0), count(inCount), step(report ? std::ceil(0.1 * inCount) : 0),
+        failed(false), error(), mutex()
+   {
+      std::time(&start);
+   }
+
+   std::atomic<int>  next;   // index of the next row to be claimed
+   std::atomic<int>  done;   // number of rows finished
+   int               count;  // total number of rows
+   int               step;   // number of rows between two progress reports, or 0
+   std::time_t       start;  // timestamp of the start of the computation
+   std::atomic<bool> failed; // true if a worker has thrown an error
+   std::string       error;  // message of the first error thrown by a worker
+   std::mutex        mutex;  // serializes progress output and error recording
+
+   int  claim() { return (failed ? count : next++); }
+   void finishRow();
+   void fail(const std::string& s);
+};
+
+void RowScheduler::finishRow()
+{
+   int n = ++done;
+
+   if (step > 0 && n % step == 0)
+   {
+      std::lock_guard<std::mutex> lock(mutex);
+
+      std::time_t now;
+      std::time(&now);
+      std::cout << 10 * n / step << "%, time: " << std::difftime(now, start)
+                << std::endl;
+   }
+}
+
+void RowScheduler::fail(const std::string& s)
+{
+   std::lock_guard<std::mutex> lock(mutex);
+
+   if (!failed)
+      error = s;
+
+   failed = true;
+}
 
 //------------------------------------------------------------------------------------
 
@@ -53,43 +160,15 @@ public:
    }
 };
 
-//------------------------------------------------------------------------------------
-
-class GenePair
-{
-public:
-   GenePair()
-      : x(), y(), xi(), yi(), maId() { }
-
-   GenePair(double inX, double inY, int inMaId)
-      : x(inX), y(inY), xi(), yi(), maId(inMaId) { }
-
-   double x;    // Get_X(), Set_X()
-   double y;    // Get_Y(), Set_Y()
-   int    xi;   // index of x; Get_XI(), Set_XI()
-   int    yi;   // index of y; Get_YI(), Set_YI()
-   int    maId; // Get_MaID(), Set_MaID()
-};
-
-typedef std::vector<GenePair> GenePairVector;
+// orders array values the way the adaptive partitioning algorithm ranks them:
+// increasing value, ties broken by array position
 
-typedef std::binary_function<GenePair, GenePair, bool> GenePairBinaryFunction;
-
-class Sort_X : GenePairBinaryFunction
-{
-public:
-   bool operator()(const GenePair& a, const GenePair& b) const
-   {
-      return (a.x < b.x || a.x == b.x && a.maId < b.maId);
-   }
-};
-
-class Sort_Y : GenePairBinaryFunction
+class SortRank_ArrayValuePair : ArrayValuePairBinaryFunction
 {
 public:
-   bool operator()(const GenePair& a, const GenePair& b) const
+   bool operator()(const ArrayValuePair& a, const ArrayValuePair& b) const
    {
-      return (a.y < b.y || a.y == b.y && a.maId < b.maId);
+      return (a.value < b.value || a.value == b.value && a.arrayId < b.arrayId);
    }
 };
 
@@ -126,7 +205,7 @@ std::ostream& operator<<(std::ostream& out, const Microarray_Set& ms)
    const char *delim = "\t";
 
    int numMarkers     = ms.markerset.size();
-   int numMicroarrays = ms.uarrays.size();
+   int numMicroarrays = ms.numArrays;
 
    if (ms.header.size() > 0)
       std::copy(ms.header.begin(), ms.header.end(),
@@ -150,7 +229,7 @@ std::ostream& operator<<(std::ostream& out, const Microarray_Set& ms)
       out << ms.markerset[i].accnum << "\t" << ms.markerset[i].label;
 
       for (int j = 0; j < numMicroarrays; j++)
-         out << delim << ms.uarrays[j][i].value;
+         out << delim << ms.Get_Value(j, i);
 
       if (i < numMarkers - 1)
          out << "\n";
@@ -161,122 +240,179 @@ std::ostream& operator<<(std::ostream& out, const Microarray_Set& ms)
 
 //------------------------------------------------------------------------------------
 
-void Matrix::saveNode(int i, int j, double mi)
+void Matrix::freeze()
 {
-   NodeMap& nmap = nmv[i];
+   // moves the rows from the NodeMaps into the CSR arrays, releasing each NodeMap
+   // as soon as it has been copied
 
-   NodeMap::iterator npos = nmap.find(j);
+   if (frozen)
+      return;
 
-   if (npos == nmap.end())
-      nmap.insert(std::make_pair(j, Node(mi)));
-   else
-      npos->second.mutinfo = mi;
+   int numMaps = nmv.size();
+
+   long long total = 0;
+
+   for (int i = 0; i < numMaps; i++)
+      total += nmv[i].size();
+
+   rowStart.assign(1, 0);
+   rowStart.reserve(numMaps + 1);
+
+   neighbor.clear();
+   mutinfo.clear();
+   intermediate.clear();
+
+   neighbor.reserve(total);
+   mutinfo.reserve(total);
+   intermediate.reserve(total);
+
+   for (int i = 0; i < numMaps; i++)
+   {
+      for (NodeMap::iterator npos = nmv[i].begin(); npos != nmv[i].end(); ++npos)
+      {
+         neighbor.push_back(npos->first);
+         mutinfo.push_back(npos->second.mutinfo);
+         intermediate.push_back(npos->second.intermediate);
+      }
+
+      rowStart.push_back(neighbor.size());
+
+      NodeMap().swap(nmv[i]);
+   }
+
+   NodeMapVector().swap(nmv);
+
+   frozen = true;
 }
 
 //------------------------------------------------------------------------------------
 
-void Matrix::read(Microarray_Set& data, const Parameter& p)
+void Matrix::thaw()
 {
-   std::ifstream in(p.adjfile.c_str());
-   if (!in.is_open())
-      throw "Unable to open " + p.adjfile;
+   if (!frozen)
+      return;
+
+   int numFrozen = rowStart.size() - 1;
 
-   read(in, data, p);
+   nmv.assign(numFrozen, NodeMap());
 
-   in.close();
+   for (int i = 0; i < numFrozen; i++)
+      for (long long e = rowStart[i]; e < rowStart[i + 1]; e++)
+      {
+         Node node(mutinfo[e]);
+         node.intermediate = intermediate[e];
+
+         nmv[i].insert(nmv[i].end(), std::make_pair(neighbor[e], node));
+      }
+
+   rowStart.assign(1, 0);
+   std::vector<int>().swap(neighbor);
+   std::vector<double>().swap(mutinfo);
+   std::vector<int>().swap(intermediate);
+
+   frozen = false;
 }
 
 //------------------------------------------------------------------------------------
+// filter() makes this matrix the edges of source (frozen, not reduced) with an MI of
+// at least threshold: the matrix createEdgeMatrix() computes for that threshold if
+// source was computed for a lower one without correction ('-n')
 
-void Matrix::read(std::istream& in, Microarray_Set& data, const Parameter& p)
+void Matrix::filter(const Matrix& source, double threshold)
 {
-   std::string line;
+   NodeMapVector().swap(nmv);
 
-   std::getline(in, line);
-   while (line.length() > 0 && line[0] == '>')
-      std::getline(in, line);
+   int n = source.numRows();
 
-   while (in.good())
-   {
-      std::istringstream sin(line);
-      std::string label;
+   rowStart.assign(1, 0);
+   rowStart.reserve(n + 1);
 
-      std::getline(sin, label, '\t');
-      label = "_" + label;
+   neighbor.clear();
+   mutinfo.clear();
+   intermediate.clear();
 
-      int geneId1 = data.getProbeId(label);
-      if (geneId1 == -1)
-         throw "Cannot find marker: " + label + " in the ADJ file!";
+   for (int i = 0; i < n; i++)
+   {
+      for (long long e = source.rowStart[i]; e < source.rowStart[i + 1]; e++)
+         if (source.mutinfo[e] >= threshold)
+         {
+            neighbor.push_back(source.neighbor[e]);
+            mutinfo.push_back(source.mutinfo[e]);
+            intermediate.push_back(-1);
+         }
 
-      data.markerset[geneId1].isActive = true;
+      rowStart.push_back(neighbor.size());
+   }
 
-      while (nmv.size() <= geneId1)
-         nmv.push_back(NodeMap());
+   frozen          = true;
+   writeTriangular = source.writeTriangular;
+   writeReduced    = source.writeReduced;
+   writeEmptyGenes = source.writeEmptyGenes;
+}
 
-      std::getline(sin, label, '\t');
-      label = "_" + label;
+//------------------------------------------------------------------------------------
 
-      while (sin.good())
-      {
-         std::string value;
+long long Matrix::findEdge(int i, int j) const
+{
+   // returns the CSR index of the edge (i, j) of a frozen matrix, or -1
 
-         std::getline(sin, value, '\t');
+   const int *first = &neighbor[0] + rowStart[i];
+   const int *last  = &neighbor[0] + rowStart[i + 1];
 
-         double mi = std::atof(value.c_str());
+   const int *pos = std::lower_bound(first, last, j);
 
-         if (mi >= p.threshold)
-         {
-            int geneId2 = data.getProbeId(label);
-            if (geneId2 == -1)
-               throw "Cannot find marker: " + label + " in the ADJ file!";
+   return (pos != last && *pos == j ? pos - &neighbor[0] : -1);
+}
 
-            while (nmv.size() <= geneId2)
-               nmv.push_back(NodeMap());
+//------------------------------------------------------------------------------------
 
-            saveNode(geneId1, geneId2, mi);
-         }
+void Matrix::saveNode(int i, int j, double mi)
+{
+   if (frozen)
+      thaw();
 
-         std::getline(sin, label, '\t');
-         label = "_" + label;
-      }
+   NodeMap& nmap = nmv[i];
 
-      std::getline(in, line);
-   }
+   NodeMap::iterator npos = nmap.find(j);
+
+   if (npos == nmap.end())
+      nmap.insert(std::make_pair(j, Node(mi)));
+   else
+      npos->second.mutinfo = mi;
 }
 
 //------------------------------------------------------------------------------------
 
 void Matrix::writeGeneLine(std::ostream& out, const Microarray_Set& data, int geneId)
 {
-   NodeMap& nmap = nmv[geneId];
+   freeze();
 
    const Marker& marker = data.markerset[geneId];
 
-   if (nmap.size() == 0 &&
+   if (rowSize(geneId) == 0 &&
        (!writeEmptyGenes || !marker.isActive && !marker.isControl))
       return;
 
    out << marker.accnum.substr(1);
 
-   for (NodeMap::iterator npos = nmap.begin(); npos != nmap.end(); ++npos)
+   for (long long e = rowStart[geneId]; e < rowStart[geneId + 1]; e++)
    {
-      int   id   = npos->first;
-      Node& node = npos->second;
+      int id = neighbor[e];
 
-      if (writeTriangular && id <= geneId || !writeReduced && node.intermediate >= 0)
+      if (writeTriangular && id <= geneId || !writeReduced && intermediate[e] >= 0)
          continue;
 
       const Marker& marker = data.markerset[id];
 
       out << "\t" << marker.accnum.substr(1);
 
-      if (node.intermediate >= 0)
-         out << "." << node.intermediate;
+      if (intermediate[e] >= 0)
+         out << "." << intermediate[e];
 
-      out << "\t" << node.mutinfo;
+      out << "\t" << mutinfo[e];
    }
 
-   out << std::endl;
+   out << '\n';
 }
 
 //------------------------------------------------------------------------------------
@@ -292,23 +428,22 @@ void Matrix::writeGeneList(const Microarray_Set& data, const std::string& name,
 
    std::cout << "Writing gene list: "<< filename << std::endl;
 
-   NodeMap& nmap = nmv[probeId];
+   freeze();
 
    const Marker& marker = data.markerset[probeId];
 
-   if (nmap.size() == 0 &&
+   if (rowSize(probeId) == 0 &&
        (!writeEmptyGenes || !marker.isActive && !marker.isControl))
       return;
 
-   for (NodeMap::iterator npos = nmap.begin(); npos != nmap.end(); ++npos)
+   for (long long e = rowStart[probeId]; e < rowStart[probeId + 1]; e++)
    {
-      int   id   = npos->first;
-      Node& node = npos->second;
+      int id = neighbor[e];
 
       const Marker& marker = data.markerset[id];
 
       if (id != probeId)
-         out << id << "\t" << marker.accnum << "t" << node.mutinfo << std::endl;
+         out << id << "\t" << marker.accnum << "t" << mutinfo[e] << std::endl;
    }
 
    out.close();
@@ -321,9 +456,11 @@ void Matrix::write(std::ostream& out, const Microarray_Set& data,
 {
    int numIds = ids.size();
 
+   freeze();
+
    if (numIds == 0)
    {
-      int numNodeMaps = nmv.size();
+      int numNodeMaps = numRows();
 
       for (int id = 0; id < numNodeMaps; id++)
          writeGeneLine(out, data, id);
@@ -333,29 +470,187 @@ void Matrix::write(std::ostream& out, const Microarray_Set& data,
          writeGeneLine(out, data, ids[i]);
 }
 
+//------------------------------------------------------------------------------------
+// getEdges() lists the edges that write() would write, in the same order: hubs[e] and
+// targets[e] are the gene ids of edge e, and mis[e] is its MI value
+
+void Matrix::getEdges(const std::vector<int>& ids, std::vector<int>& hubs,
+                      std::vector<int>& targets, std::vector<double>& mis)
+{
+   freeze();
+
+   hubs.clear();
+   targets.clear();
+   mis.clear();
+
+   std::vector<int> rows;
+
+   if (ids.size() == 0)
+      for (int id = 0; id < numRows(); id++)
+         rows.push_back(id);
+   else
+      rows = ids;
+
+   for (int i = 0; i < (int) rows.size(); i++)
+   {
+      int geneId = rows[i];
+
+      for (long long e = rowStart[geneId]; e < rowStart[geneId + 1]; e++)
+      {
+         int id = neighbor[e];
+
+         if (writeTriangular && id <= geneId || !writeReduced && intermediate[e] >= 0)
+            continue;
+
+         hubs.push_back(geneId);
+         targets.push_back(id);
+         mis.push_back(mutinfo[e]);
+      }
+   }
+}
+
+//------------------------------------------------------------------------------------
+// writeBinary() writes the network in the binary format read by
+// create_consensus_network.py. Numbers are in native byte order (little-endian on
+// x86 and ARM):
+//
+//    char[8]  magic "SJARADJ1"
+//    uint32   flags (1 = the body is compressed with zlib)
+//    uint64   size of the body in bytes, before compression
+//    uint64   size of the body in bytes, as stored
+//    body:
+//       uint32  length of the header text, header text ('>' lines)
+//       uint32  number of genes, then for each gene: uint32 length, accession
+//       uint64  number of edges E
+//       int32   hub gene ids [E]
+//       int32   target gene ids [E]
+//       float32 MI values [E]
+//
+// The edges are the ones write() would write, in the same order. Each MI value is
+// rounded to the six significant digits of the text format before it is stored as a
+// float32, so that it can be turned back into exactly the same number. DPI
+// intermediates are not stored.
+
+static void appendBytes(std::string& buffer, const void *p, std::size_t n)
+{
+   buffer.append(static_cast<const char *>(p), n);
+}
+
+void Matrix::writeBinary(std::ostream& out, const Microarray_Set& data,
+                         const std::vector<int>& ids, const std::string& header,
+                         bool compress)
+{
+   std::vector<int>    hubs, targets;
+   std::vector<double> edgeMI;
+
+   getEdges(ids, hubs, targets, edgeMI);
+
+   std::vector<float> mis(edgeMI.size());
+
+   for (size_t e = 0; e < edgeMI.size(); e++)
+   {
+      char text[32];
+      std::snprintf(text, sizeof(text), "%.6g", edgeMI[e]);
+
+      mis[e] = std::strtof(text, NULL);
+   }
+
+   // assemble the body
+
+   std::string body;
+
+   unsigned int headerLength = header.length();
+   appendBytes(body, &headerLength, 4);
+   body += header;
+
+   unsigned int numGenes = data.markerset.size();
+   appendBytes(body, &numGenes, 4);
+
+   for (unsigned int i = 0; i < numGenes; i++)
+   {
+      const std::string& accnum = data.markerset[i].accnum;
+
+      unsigned int length = accnum.length() - 1;
+      appendBytes(body, &length, 4);
+      body.append(accnum, 1, std::string::npos);
+   }
+
+   unsigned long long numEdges = hubs.size();
+   appendBytes(body, &numEdges, 8);
+
+   if (numEdges > 0)
+   {
+      appendBytes(body, &hubs[0],    4 * numEdges);
+      appendBytes(body, &targets[0], 4 * numEdges);
+      appendBytes(body, &mis[0],     4 * numEdges);
+   }
+
+   // write the file
+
+   unsigned int flags = 0;
+   unsigned long long rawSize = body.size();
+
+   if (compress)
+   {
+#ifdef SJARACNE_ZLIB
+      uLongf zipSize = compressBound(rawSize);
+      std::string zipped(zipSize, '\0');
+
+      if (compress2(reinterpret_cast<Bytef *>(&zipped[0]), &zipSize,
+                    reinterpret_cast<const Bytef *>(body.data()), rawSize,
+                    Z_DEFAULT_COMPRESSION) != Z_OK)
+         throw std::string("Unable to compress the network!");
+
+      zipped.resize(zipSize);
+      body.swap(zipped);
+      flags |= 1;
+#else
+      throw std::string("Compressed output requires zlib!");
+#endif
+   }
+
+   unsigned long long storedSize = body.size();
+
+   out.write("SJARADJ1", 8);
+   out.write(reinterpret_cast<const char *>(&flags), 4);
+   out.write(reinterpret_cast<const char *>(&rawSize), 8);
+   out.write(reinterpret_cast<const char *>(&storedSize), 8);
+   out.write(body.data(), body.size());
+}
+
 //------------------------------------------------------------------------------------
 
-void Matrix::write(const Microarray_Set& data, const std::vector<int>& ids,
-                   const Parameter& p, bool writeFull)
+long long Matrix::write(const Microarray_Set& data, const std::vector<int>& ids,
+                        const Parameter& p, bool writeFull)
 {
+   // returns the number of bytes written
+
    if (!writeFull)
-      return;
+      return 0;
 
-   std::ofstream out(p.outfile.c_str());
+   bool binary = !equalIgnoreCase(p.format, "text");
+
+   std::ofstream out(p.outfile.c_str(), binary ? std::ios::out | std::ios::binary
+                                               : std::ios::out);
    if (!out.is_open())
       throw "Unable to open " + p.outfile;
 
    std::cout << "Writing matrix: " << p.outfile << std::endl;
 
-   out << ">  Input file      " << p.infile     << std::endl;
+   std::ostringstream hdr;
+
+   hdr << ">  Input file      " << p.infile     << std::endl;
    //out << ">  ADJ file        " << p.adjfile    << std::endl;
    //out << ">  Output file     " << p.outfile    << std::endl;
    //out << ">  Kernel width    " << p.sigma      << std::endl;
-   out << ">  MI threshold    " << p.threshold  << std::endl;
-   out << ">  MI P-value      " << p.pvalue     << std::endl;
-   out << ">  DPI tolerance   " << p.eps        << std::endl;
+   hdr << ">  MI threshold    " << p.threshold  << std::endl;
+   hdr << ">  MI P-value      " << p.pvalue     << std::endl;
+   hdr << ">  DPI tolerance   " << p.eps        << std::endl;
    //out << ">  Correction      " << p.correction << std::endl;
-   out << ">  Subnetwork file " << p.subnetfile << std::endl;
+   hdr << ">  Subnetwork file " << p.subnetfile << std::endl;
+
+   if (p.numShards > 1)
+      hdr << ">  Shard           " << p.shard << "/" << p.numShards << std::endl;
    //out << ">  Hub probe       " << p.hub        << std::endl;
    //out << ">  Control probe   " << p.controlId  << std::endl;
    //out << ">  Condition       " << p.condition  << std::endl;
@@ -364,11 +659,24 @@ void Matrix::write(const Microarray_Set& data, const std::vector<int>& ids,
    //out << ">  Filter mean     " << p.mean       << std::endl;
    //out << ">  Filter CV       " << p.cv         << std::endl;
 
-   write(out, data, ids);
+   if (binary)
+      writeBinary(out, data, ids, hdr.str(), equalIgnoreCase(p.format, "zbinary"));
+   else
+   {
+      out << hdr.str();
+      write(out, data, ids);
+   }
+
+   long long size = out.tellp();
 
    out.close();
 
+   if (!out)
+      throw "Unable to write " + p.outfile;
+
    std::cout << "Maximum observed npar: " << maxNpar << std::endl;
+
+   return size;
 }
 
 //------------------------------------------------------------------------------------
@@ -377,6 +685,8 @@ void Matrix::createEntries(int numEntries)
 {
    // create entries for all rows in the matrix
 
+   thaw();
+
    for (int i = 0; i < numEntries; i++)
       nmv.push_back(NodeMap());
 }
@@ -393,27 +703,26 @@ void Matrix::addNode(int i, int j, double edgeValue, bool symmetric)
 
 //------------------------------------------------------------------------------------
 
-double Matrix::getNodeMI(int geneId1, int geneId2)
+double Matrix::getNodeMI(int geneId1, int geneId2) const
 {
    // this function returns a positive MI value if the node has been computed and
    // survived the thresholding; returns 0.0 if the node has been computed but did not
-   // survive the thresholding; or returns -1.0 if the node has not yet been computed
+   // survive the thresholding; or returns -1.0 if the node has not yet been computed;
+   // the matrix must be frozen
 
-   if (nmv.size() > geneId1 && nmv[geneId1].size() > 0)
-   {
-      NodeMap& nmap = nmv[geneId1];
+   int n = numRows();
 
-      NodeMap::iterator npos = nmap.find(geneId2);
+   if (n > geneId1 && rowSize(geneId1) > 0)
+   {
+      long long e = findEdge(geneId1, geneId2);
 
-      return (npos == nmap.end() ? 0.0 : npos->second.mutinfo);
+      return (e < 0 ? 0.0 : mutinfo[e]);
    }
-   else if (nmv.size() > geneId2 && nmv[geneId2].size() > 0)
+   else if (n > geneId2 && rowSize(geneId2) > 0)
    {
-      NodeMap& nmap = nmv[geneId2];
+      long long e = findEdge(geneId2, geneId1);
 
-      NodeMap::iterator npos = nmap.find(geneId1);
-
-      return (npos == nmap.end() ? 0.0 : npos->second.mutinfo);
+      return (e < 0 ? 0.0 : mutinfo[e]);
    }
    else
       return -1.0;
@@ -421,26 +730,29 @@ double Matrix::getNodeMI(int geneId1, int geneId2)
 
 //------------------------------------------------------------------------------------
 
-static bool protectedByTFLogic(Transfac &transfac,
+static bool protectedByTFLogic(const std::vector<bool>& isTF,
                                int geneId1, int geneId2, int geneId3)
 {
-   bool isA = (transfac.find(geneId1) != transfac.end());
-   bool isB = (transfac.find(geneId2) != transfac.end());
-   bool isC = (transfac.find(geneId3) != transfac.end());
+   bool isA = isTF[geneId1];
+   bool isB = isTF[geneId2];
+   bool isC = isTF[geneId3];
 
    return ((isA || isB) && !isC);
 }
 
 //------------------------------------------------------------------------------------
 
-void Matrix::reduceOneNode(int row_idx, double epsilon, Transfac& transfac)
+void Matrix::reduceOneNode(int row_idx, double epsilon, const std::vector<bool>& isTF)
 {
-   NodeMap& nmap = nmv[row_idx];
+   // isTF flags the transcription factors of every gene of the matrix; it is empty if
+   // there are no transcription factors. Only the intermediates of row row_idx are
+   // written, so several rows can be reduced at the same time.
 
    std::vector<ArrayValuePair> miVector;
+   miVector.reserve(rowSize(row_idx));
 
-   for (NodeMap::iterator npos = nmap.begin(); npos != nmap.end(); ++npos)
-      miVector.push_back(ArrayValuePair(npos->first, npos->second.mutinfo));
+   for (long long e = rowStart[row_idx]; e < rowStart[row_idx + 1]; e++)
+      miVector.push_back(ArrayValuePair(neighbor[e], mutinfo[e]));
 
    SortDecreasing_ArrayValuePair sorter;
    std::sort(miVector.begin(), miVector.end(), sorter);
@@ -464,13 +776,13 @@ void Matrix::reduceOneNode(int row_idx, double epsilon, Transfac& transfac)
 
          double valueBC = getNodeMI(geneId1, geneId2);
 
-         if (valueBC > minMI && (transfac.size() == 0 ||
-             !protectedByTFLogic(transfac, row_idx, geneId1, geneId2)))
+         if (valueBC > minMI && (isTF.size() == 0 ||
+             !protectedByTFLogic(isTF, row_idx, geneId1, geneId2)))
          {
-            NodeMap::iterator npos = nmap.find(geneId1);
+            long long e = findEdge(row_idx, geneId1);
 
-            if (npos != nmap.end())
-               npos->second.intermediate = geneId2;
+            if (e >= 0)
+               intermediate[e] = geneId2;
 
             break;
          }
@@ -478,26 +790,92 @@ void Matrix::reduceOneNode(int row_idx, double epsilon, Transfac& transfac)
    }
 }
 
+//------------------------------------------------------------------------------------
+// reduceRows() is run by each worker thread of Matrix::reduce(); rows[i] is the row
+// reduced by the i-th task, or -1 if there is nothing to do
+
+static void reduceRows(Matrix *matrix, const std::vector<int> *rows, double epsilon,
+                       const std::vector<bool> *isTF, RowScheduler *scheduler)
+{
+   for (int i = scheduler->claim(); i < scheduler->count; i = scheduler->claim())
+      if ((*rows)[i] >= 0)
+         matrix->reduceOneNode((*rows)[i], epsilon, *isTF);
+}
+
 //------------------------------------------------------------------------------------
 
-void Matrix::reduce(double epsilon, const std::vector<int>& ids, Transfac& transfac)
+void Matrix::reduce(double epsilon, const std::vector<int>& ids, Transfac& transfac,
+                    int numThreads)
 {
    std::time_t t1, t2;
    std::time(&t1);
 
+   freeze();
+
+   int n = numRows();
+
+   // the rows to reduce, each one once
+
+   std::vector<int> rows;
+
    if (ids.size() == 0)
+      for (int i = 0; i < n; i++)
+         rows.push_back(i);
+   else
    {
-      int numMarkers = nmv.size();
+      std::vector<bool> seen(n, false);
 
-      for (int i = 0; i < numMarkers; i++)
-         reduceOneNode(i, epsilon, transfac);
+      for (int i = 0; i < (int) ids.size(); i++)
+         if (ids[i] < n && !seen[ids[i]])
+         {
+            seen[ids[i]] = true;
+            rows.push_back(ids[i]);
+         }
    }
-   else
+
+   // a flag per gene is faster to look up than the Transfac map
+
+   std::vector<bool> isTF;
+
+   if (transfac.size() > 0)
    {
-      int numIds = ids.size();
+      // in hub mode the neighbors of a row may lie beyond the last row
 
-      for (int i = 0; i < numIds; i++)
-         reduceOneNode(ids[i], epsilon, transfac);
+      int size = n;
+
+      for (long long e = 0; e < (long long) neighbor.size(); e++)
+         size = std::max(size, neighbor[e] + 1);
+
+      isTF.assign(size, false);
+
+      for (Transfac::iterator tpos = transfac.begin(); tpos != transfac.end(); ++tpos)
+         if (tpos->first >= 0 && tpos->first < size)
+            isTF[tpos->first] = true;
+   }
+
+   RowScheduler scheduler(rows.size(), false);
+
+   std::vector<std::thread> workers;
+
+   for (int t = 1; t < numThreads; t++)
+      workers.push_back(std::thread(reduceRows, this, &rows, epsilon, &isTF,
+                                    &scheduler));
+
+   reduceRows(this, &rows, epsilon, &isTF, &scheduler);
+
+   for (int t = 0; t < (int) workers.size(); t++)
+      workers[t].join();
+
+   KernelCounters counters;
+
+   for (int i = 0; i < (int) rows.size(); i++)
+      for (long long e = rowStart[rows[i]]; e < rowStart[rows[i] + 1]; e++)
+         if (intermediate[e] >= 0)
+            counters.edgesRemoved++;
+
+   {
+      std::lock_guard<std::mutex> lock(countersMutex);
+      kernelCounters.add(counters);
    }
 
    std::time(&t2);
@@ -528,10 +906,36 @@ bool Microarray_Set::isSameGene(int i, int j) const
 
 //------------------------------------------------------------------------------------
 
+void Microarray_Set::indexMarkers()
+{
+   // builds the accession number index used by getAccessionId(); when an accession
+   // number occurs more than once, the first marker is kept, as in a linear search
+
+   int numMarkers = markerset.size();
+
+   accnumIndex.clear();
+   accnumIndex.reserve(numMarkers);
+
+   for (int i = 0; i < numMarkers; i++)
+      accnumIndex.insert(std::make_pair(markerset[i].accnum, i));
+
+   numIndexed = numMarkers;
+}
+
+//------------------------------------------------------------------------------------
+
 int Microarray_Set::getAccessionId(const std::string& accnum) const
 {
    int numMarkers = markerset.size();
 
+   if (numIndexed == numMarkers)
+   {
+      std::unordered_map<std::string, int>::const_iterator ipos =
+         accnumIndex.find(accnum);
+
+      return (ipos == accnumIndex.end() ? -1 : ipos->second);
+   }
+
    for (int i = 0; i < numMarkers; i++)
       if (markerset[i].accnum == accnum)
          return i;
@@ -566,6 +970,12 @@ void Microarray_Set::Set_ColHeader(int i, const std::string& hdr)
 
 void Microarray_Set::Set_Marker(int i, const Marker& m)
 {
+   if (numIndexed >= 0) // the accession number index is out of date
+   {
+      accnumIndex.clear();
+      numIndexed = -1;
+   }
+
    while (i >= markerset.size())
       markerset.push_back(Marker());
 
@@ -574,15 +984,73 @@ void Microarray_Set::Set_Marker(int i, const Marker& m)
 
 //------------------------------------------------------------------------------------
 
+Microarray Microarray_Set::Get_Microarray(int arrayId) const
+{
+   int numMarkers = (numArrays > 0 ? values.size() / numArrays : 0);
+
+   Microarray uarray;
+   uarray.reserve(numMarkers);
+
+   for (int m = 0; m < numMarkers; m++)
+      uarray.push_back(Get_Probe(arrayId, m));
+
+   return uarray;
+}
+
+//------------------------------------------------------------------------------------
+
+void Microarray_Set::Set_Num_Microarrays(int n)
+{
+   // changes the number of arrays, keeping the values of the remaining ones; this
+   // relayouts the whole matrix, so the reader calls it before storing any value
+
+   if (n == numArrays)
+      return;
+
+   int numMarkers = (numArrays > 0 ? values.size() / numArrays : 0);
+   int numCopied  = std::min(n, numArrays);
+
+   std::vector<ExprValue> newValues((size_t) numMarkers * n, 0.0);
+   std::vector<double>    newPvalues(pvalues.empty() ? 0 : newValues.size(), 0.0);
+
+   for (int m = 0; m < numMarkers; m++)
+      for (int a = 0; a < numCopied; a++)
+      {
+         newValues[(size_t) m * n + a] = Get_Value(a, m);
+
+         if (!pvalues.empty())
+            newPvalues[(size_t) m * n + a] = Get_PValue(a, m);
+      }
+
+   numArrays = n;
+   values.swap(newValues);
+   pvalues.swap(newPvalues);
+}
+
+//------------------------------------------------------------------------------------
+
 void Microarray_Set::Set_Probe(int i, int j, Probe p)
 {
-   while (i >= uarrays.size())
-      uarrays.push_back(Microarray());
+   // i is the array, j is the marker
+
+   if (i >= numArrays)
+      Set_Num_Microarrays(i + 1);
+
+   if ((size_t) j * numArrays >= values.size())
+   {
+      values.resize((size_t) (j + 1) * numArrays, 0.0);
 
-   while (j >= uarrays[i].size())
-      uarrays[i].push_back(Probe());
+      if (!pvalues.empty())
+         pvalues.resize(values.size(), 0.0);
+   }
+
+   if (p.pvalue != 0.0 && pvalues.empty())
+      pvalues.resize(values.size(), 0.0);
 
-   uarrays[i][j] = p;
+   valueAt(i, j) = p.value;
+
+   if (!pvalues.empty())
+      pvalues[(size_t) j * numArrays + i] = p.pvalue;
 }
 
 //------------------------------------------------------------------------------------
@@ -705,162 +1173,11 @@ int Microarray_Set::readHeader(std::istream& in)
 
 //------------------------------------------------------------------------------------
 
-void Microarray_Set::read(const std::string& filename)
-{
-   std::ifstream in(filename.c_str());
-   if (!in.is_open())
-      throw "Unable to open " + filename;
-
-   read(in);
-
-   in.close();
-}
-
-//------------------------------------------------------------------------------------
-
-void Microarray_Set::read(std::istream& in)
-{
-   std::ios_base::iostate oldState = in.exceptions();
-   in.exceptions(std::ios_base::badbit | std::ios_base::failbit);
-
-   try
-   {
-      std::string line;
-      std::getline(in, line);
-      std::istringstream sin(line);
-      int arrno = readHeader(sin);
-
-      // we need to decide whether the input file contain only expression
-      // or (value, pvalue) pairs
-
-      int bypass_line_cnt = 0;
-      std::getline(in, line);
-
-      while (line.length() >= 11 && line.substr(0, 11) == "Description")
-      {
-         bypass_line_cnt++;
-         std::getline(in, line);
-      }
-
-      std::cout << "\n[READ] " << bypass_line_cnt
-                << " Description lines bypassed." << std::endl;
-
-      std::istringstream pin(line);
-      std::vector<std::string> firstprobe;
-      std::string token;
-
-      do
-      {
-         std::getline(pin, token, '\t');
-         firstprobe.push_back(token);
-      }
-      while (pin.good() && pin.peek() != '\015' && pin.peek() != EOF);
-
-      int valueNo = firstprobe.size() - 2;
-
-      if (arrno == valueNo)
-      {
-         // single expression values
-         std::cout << "[READ] P-value columns not found." << std::endl;
-
-         int proben = 0; // probe number
-
-         std::istringstream fin(line);
-         std::string accnum, label;
-
-         std::getline(fin, accnum, '\t');
-         std::getline(fin, label,  '\t');
-
-         accnum = "_" + accnum;
-
-         Marker m(proben, accnum, label);
-         Set_Marker(proben, m);
-         readMarkerNoPvalue(fin, proben++);
-
-         while (in.good() && in.peek() != EOF)
-         {
-            std::getline(in, line);
-            std::istringstream sin(line);
-
-            std::getline(sin, accnum, '\t');
-            std::getline(sin, label,  '\t');
-
-            accnum = "_" + accnum;
-
-            Marker m(proben, accnum, label);
-            Set_Marker(proben, m);
-
-            if (readMarkerNoPvalue(sin, proben) != arrno)
-            {
-               std::ostringstream s;
-               s << "Incorrect data format at line no: " << proben + 2;
-               throw s.str();
-            }
-
-            proben++;
-         }
-      }
-      else if (2 * arrno == valueNo)
-      {
-         // (value, pvalue) pairs
-         std::cout << "[READ] (value, p-value) pairs found." << std::endl;
-
-         int proben = 0; // probe number
-
-         std::istringstream fin(line);
-         std::string accnum, label;
-
-         std::getline(fin, accnum, '\t');
-         std::getline(fin, label,  '\t');
-
-         accnum = "_" + accnum;
-
-         Marker m(proben, accnum, label);
-         Set_Marker(proben, m);
-         readMarkerWithPvalue(fin, proben++);
-
-         while (in.good() && in.peek() != EOF)
-         {
-            std::getline(in, line);
-            std::istringstream sin(line);
-
-            std::getline(sin, accnum, '\t');
-            std::getline(sin, label,  '\t');
-
-            accnum = "_" + accnum;
-
-            Marker m(proben, accnum, label);
-            Set_Marker(proben, m);
-
-            if (readMarkerWithPvalue(sin, proben) != arrno)
-            {
-               std::ostringstream s;
-               s << "Incorrect data format at line no: " << proben + 2;
-               throw s.str();
-            }
-
-            proben++;
-         }
-      }
-      else
-         throw std::string("Incorrect file format: header line doesn't match the "
-                           "rest of the data.");
-   }
-   catch (std::ios_base::failure& f)
-   {
-      throw std::string("Could not read data.(Last line empty?)");
-   }
-
-   in.exceptions(oldState); //reset excep state
-}
-
-//------------------------------------------------------------------------------------
-
 int Microarray_Set::filter(const std::vector<int>& ids, double minMean,
                            double minSigma, int ctlid)
 {
    int numIds         = ids.size();
-   int numMicroarrays = uarrays.size();
+   int numMicroarrays = numArrays;
    int numMarkers     = markerset.size();
 
    for (int i = 0; i < numMarkers; i++)
@@ -875,7 +1192,7 @@ int Microarray_Set::filter(const std::vector<int>& ids, double minMean,
 
          for (int j = 0; j < numIds; j++)
          {
-            double v = uarrays[ids[j]][i].value;
+            double v = Get_Value(ids[j], i);
             nx  += v;
             nxx += v * v;
          }
@@ -899,7 +1216,7 @@ int Microarray_Set::filter(const std::vector<int>& ids, double minMean,
 
 int Microarray_Set::filter(double minMean, double minSigma, int ctlid)
 {
-   int numMicroarrays = uarrays.size();
+   int numMicroarrays = numArrays;
 
    std::vector<int> v;
 
@@ -925,7 +1242,7 @@ void Microarray_Set::computeMarkerBandwidth(const std::vector<int> *arrays)
 {
    computeMarkerVariance(arrays);
 
-   int n = (arrays ? arrays->size() : uarrays.size());
+   int n = (arrays ? arrays->size() : numArrays);
 
    double *data = new double[n];
 
@@ -938,8 +1255,10 @@ void Microarray_Set::computeMarkerBandwidth(const std::vector<int> *arrays)
 
       double stdev = std::sqrt(markerset[i].var);
 
+      const ExprValue *v = Get_Marker_Values(i);
+
       for (int j = 0; j < n; j++)
-         data[j] = uarrays[arrays ? arrays->at(j) : j][i].value;
+         data[j] = v[arrays ? arrays->at(j) : j];
 
       std::sort(data, data + n);
 
@@ -963,13 +1282,15 @@ double Microarray_Set::variance(int m, const std::vector<int> *arrays)
 {
    // compute the variance of a gene expression vector
 
-   int n = (arrays ? arrays->size() : uarrays.size());
+   int n = (arrays ? arrays->size() : numArrays);
+
+   const ExprValue *x = Get_Marker_Values(m);
 
    double s = 0.0, ss = 0.0;
 
    for (int i = 0; i < n; i++)
    {
-      double v = uarrays[arrays ? arrays->at(i) : i][m].value;
+      double v = x[arrays ? arrays->at(i) : i];
       s  += v;
       ss += v * v;
    }
@@ -985,10 +1306,10 @@ void Microarray_Set::getHighLowPercent(double x, int mId, std::vector<int>& lowe
    std::vector<ArrayValuePair> sortArray;
    SortIncreasing_ArrayValuePair sorter;
 
-   int numMicroarrays = uarrays.size();
+   int numMicroarrays = numArrays;
 
    for (int id = 0; id < numMicroarrays; id++)
-      sortArray.push_back(ArrayValuePair(id, uarrays[id][mId].value));
+      sortArray.push_back(ArrayValuePair(id, Get_Value(id, mId)));
 
    std::sort(sortArray.begin(), sortArray.end(), sorter);
 
@@ -1007,7 +1328,7 @@ void Microarray_Set::bootStrap(std::vector<int>& boot, const std::vector<int> *a
 {
    boot.clear();
 
-   int numIds = (arrays ? arrays->size() : uarrays.size());
+   int numIds = (arrays ? arrays->size() : numArrays);
 
    for (int id = 0; id < numIds; id++)
    {
@@ -1020,57 +1341,223 @@ void Microarray_Set::bootStrap(std::vector<int>& boot, const std::vector<int> *a
 
 void Microarray_Set::addNoise()
 {
-   int numMicroarrays = uarrays.size();
+   int numMicroarrays = numArrays;
    int numMarkers     = markerset.size();
 
+   // the noise is drawn array by array, as it always has been, so that a given
+   // seed keeps producing the same networks
+
    for (int id = 0; id < numMicroarrays; id++)
       for (int mid = 0; mid < numMarkers; mid++)
       {
          double r = std::rand();
          double noise = (r / RAND_MAX) * 1e-10;
 
-         uarrays[id][mid].value += noise;
+         valueAt(id, mid) += noise;
       }
 }
 
 //------------------------------------------------------------------------------------
 
-static double Compute_Pairwise_MI(GenePairVector& pairs, int nparLimit)
+void MarkerRanks::computeOne(const Microarray_Set& data, int probeId,
+                             const std::vector<int> *arrays)
 {
-   const int M = nparLimit;
-   const int N = pairs.size();
+   if (ranks.size() <= probeId)
+      ranks.resize(probeId + 1);
 
-   for (int i = 0; i < N; i++)
+   std::vector<ArrayValuePair> sortArray;
+   sortArray.reserve(maNum);
+
+   const ExprValue *values = data.Get_Marker_Values(probeId);
+
+   for (int i = 0; i < maNum; i++)
+      sortArray.push_back(ArrayValuePair(i, values[arrays ? arrays->at(i) : i]));
+
+   SortRank_ArrayValuePair sorter;
+   std::sort(sortArray.begin(), sortArray.end(), sorter);
+
+   std::vector<int>& r = ranks[probeId];
+   r.resize(maNum);
+
+   for (int i = 0; i < maNum; i++)
+      r[sortArray[i].arrayId] = i + 1;
+}
+
+//------------------------------------------------------------------------------------
+
+// deriveOne() ranks the arrays listed in arrays for probeId from all.ranks[probeId],
+// the ranks of all the arrays of data: walking the arrays in increasing order of value,
+// it ranks the positions of arrays holding each array (head[a], next[i]: the first
+// position of array a and the position after i of the same array, -1 at the end), so
+// ties, repeated arrays included, are broken by position as computeOne() does; order
+// and group are working space
+
+void MarkerRanks::deriveOne(const Microarray_Set& data, int probeId,
+                            const MarkerRanks& all, const std::vector<int>& arrays,
+                            const std::vector<int>& head, const std::vector<int>& next,
+                            std::vector<int>& order, std::vector<int>& group)
+{
+   int n = all.maNum;
+
+   const std::vector<int>& a = all.ranks[probeId];
+
+   for (int i = 0; i < n; i++)
+      order[a[i] - 1] = i;
+
+   const ExprValue *values = data.Get_Marker_Values(probeId);
+
+   std::vector<int>& r = ranks[probeId];
+   r.resize(maNum);
+
+   int rank = 0;
+
+   for (int j = 0, e; j < n; j = e)
    {
-      pairs[i].xi = i;
-      pairs[i].yi = i;
+      e = j + 1;
+      while (e < n && values[order[e]] == values[order[j]])
+         e++;
+
+      group.clear();
+
+      for (int k = j; k < e; k++)
+         for (int pos = head[order[k]]; pos >= 0; pos = next[pos])
+            group.push_back(pos);
+
+      if (e > j + 1)
+         std::sort(group.begin(), group.end());
+
+      for (int k = 0; k < (int) group.size(); k++)
+         r[group[k]] = ++rank;
    }
+}
 
-   Sort_X X_Sorter;
-   std::sort(pairs.begin(), pairs.end(), X_Sorter);
+//------------------------------------------------------------------------------------
 
-   std::vector<int> xranks(N);
+void MarkerRanks::compute(const Microarray_Set& data, int inMaNum,
+                          const std::vector<int> *arrays,
+                          const std::vector<bool>& needed, const MarkerRanks *all,
+                          int numThreads)
+{
+   // ranks the first inMaNum arrays (or the arrays listed in *arrays) for every
+   // marker flagged in needed, deriving them from all if it ranks all the arrays of
+   // data; the markers are distributed over numThreads threads
 
-   for (int i = 0; i < N; i++)
-      xranks[pairs[i].xi] = i + 1;
+   maNum = inMaNum;
 
-   Sort_Y Y_Sorter;
-   std::sort(pairs.begin(), pairs.end(), Y_Sorter);
+   ranks.clear();
+   ranks.resize(data.markerset.size());
 
-   std::vector<int> yranks(N);
+   int numMarkers = needed.size();
+   int numArrays  = data.Get_Num_Microarrays();
 
-   for (int i = 0; i < N; i++)
-      yranks[pairs[i].yi] = i + 1;
+   bool derive = (all != NULL && arrays != NULL && all->maNum == numArrays);
+
+   std::vector<int> head, next;
+
+   if (derive)
+   {
+      head.assign(numArrays, -1);
+      next.assign(maNum, -1);
+
+      for (int i = maNum - 1; i >= 0; i--)
+      {
+         next[i] = head[arrays->at(i)];
+         head[arrays->at(i)] = i;
+      }
+   }
+
+   auto rankMarkers = [&](int first)
+   {
+      std::vector<int> order(derive ? numArrays : 0), group;
+
+      for (int i = first; i < numMarkers; i += numThreads)
+         if (needed[i])
+         {
+            if (derive && i < (int) all->ranks.size() && !all->ranks[i].empty())
+               deriveOne(data, i, *all, *arrays, head, next, order, group);
+            else
+               computeOne(data, i, arrays);
+         }
+   };
+
+   std::vector<std::thread> workers;
+
+   for (int t = 1; t < numThreads; t++)
+      workers.push_back(std::thread(rankMarkers, t));
+
+   rankMarkers(0);
+
+   for (int t = 0; t < (int) workers.size(); t++)
+      workers[t].join();
+}
+//------------------------------------------------------------------------------------
+// MIScratch holds the working arrays of Compute_Pairwise_MI(): the stack of pending
+// partitions (first and last position in order, and the four rank margins, of at most
+// nparLimit partitions), the order of the arrays, in which every partition is a
+// contiguous range, and the copy and quadrants of the range being split. Each thread
+// keeps its own, grown to the number of arrays and the npar limit on first use, so
+// that the kernel allocates no memory.
+
+class MIScratch
+{
+public:
+   std::vector<int> poc, kon, marg;     // partition stack, marg has 4 rows of M
+   std::vector<int> order;              // array indices (0-based), by partition
+   std::vector<int> copy;               // the partition being split
+   std::vector<unsigned char> quadrant; // quadrant of each array of copy
+
+   void reserve(int N, int M)
+   {
+      if ((int) order.size() < N)
+      {
+         order.resize(N);
+         copy.resize(N);
+         quadrant.resize(N);
+      }
+
+      if ((int) poc.size() < M)
+      {
+         poc.resize(M);
+         kon.resize(M);
+         marg.resize(4 * M);
+      }
+   }
+};
+
+static thread_local MIScratch threadScratch;
+
+//------------------------------------------------------------------------------------
+
+static double Compute_Pairwise_MI(const int *xranks, const int *yranks, int N,
+                                  int nparLimit)
+{
+   // xranks and yranks are the ranks of the N values of the two genes (see
+   // MarkerRanks); a partition is split into four quadrants at the middle of its
+   // rank margins, and a quadrant of more than two arrays is split again as long as
+   // its arrays are not spread evenly over its own quadrants
+
+   const int M = nparLimit;
 
-   int npar = 1; maxNpar = 1;
+   MIScratch& scratch = threadScratch;
+   scratch.reserve(N, M);
+
+   int *poc   = &scratch.poc[0];
+   int *kon   = &scratch.kon[0];
+   int *marg  = &scratch.marg[0];
+   int *order = &scratch.order[0];
+   int *copy  = &scratch.copy[0];
+   unsigned char *quadrant = &scratch.quadrant[0];
+
+   int npar = 1, localMaxNpar = 1;
    int run  = 0;
 
    double xcor = 0.0;
 
-   std::vector<int> poc(M, 1), kon(M, N), poradi(N), marg(4 * M, 0);
-
    for (int i = 0; i < N; i++)
-      poradi[i] = i + 1;
+      order[i] = i;
+
+   poc[0] = 1;
+   kon[0] = N;
 
    marg[0] = marg[M] = 1;
    marg[2 * M] = marg[3 * M] = N;
@@ -1084,26 +1571,28 @@ static double Compute_Pairwise_MI(GenePairVector& pairs, int nparLimit)
       int akon = kon[np];
       int Nex  = akon - apoc + 1;
 
-      std::vector<int> apor(Nex);
+      int ave1 = (marg[np] + marg[np + 2 * M]) / 2;
+      int ave2 = (marg[np + M] + marg[np + 3 * M]) / 2;
 
-      for (int i = 0; i < Nex; i++)
-         apor[i] = poradi[apoc + i - 1];
+      // quadrant of each array: 0 = low x low y, 1 = low x high y, 2 = high x low y,
+      // 3 = high x high y
 
-      int ave1 = std::floor((marg[np] + marg[np + 2 * M]) / 2);
-      int ave2 = std::floor((marg[np + M] + marg[np + 3 * M]) / 2);
+      const int *range = order + apoc - 1;
 
-      std::vector<bool> I(4 * Nex, false);
-      std::vector<int>  NN(4, 0);
+      int NN[4] = { 0, 0, 0, 0 };
 
       for (int i = 0; i < Nex; i++)
       {
-         int k = apor[i] - 1;
-
-         int j = (xranks[k] <= ave1 ? 0 : 2) + (yranks[k] <= ave2 ? 0 : 1);
+         int k = range[i];
+         int q = ((xranks[k] > ave1) << 1) | (yranks[k] > ave2);
 
-         I[4 * i + j] = true;
+         copy[i]     = k;
+         quadrant[i] = q;
 
-         NN[j]++;
+         NN[0] += (q == 0);
+         NN[1] += (q == 1);
+         NN[2] += (q == 2);
+         NN[3] += (q == 3);
       }
 
       double c   = Nex / 4.0;
@@ -1119,7 +1608,7 @@ static double Compute_Pairwise_MI(GenePairVector& pairs, int nparLimit)
 
       if (tst > 7.8 || run == 1)
       {
-         std::vector<int> amarg(16);
+         int amarg[16];
 
          amarg[ 0] = amarg[ 1] = marg[np];
          amarg[ 2] = amarg[ 3] = ave1 + 1;
@@ -1130,6 +1619,24 @@ static double Compute_Pairwise_MI(GenePairVector& pairs, int nparLimit)
          amarg[12] = amarg[14] = ave2;
          amarg[13] = amarg[15] = marg[np + 3 * M];
 
+         // the quadrants of more than two arrays become partitions, laid out one
+         // after the other from apoc, each keeping the order of its arrays
+
+         int next[4];
+         int pos = apoc - 1;
+
+         for (int i = 0; i < 4; i++)
+         {
+            next[i] = (NN[i] > 2 ? pos : -1);
+
+            if (NN[i] > 2)
+               pos += NN[i];
+         }
+
+         for (int i = 0; i < Nex; i++)
+            if (next[quadrant[i]] >= 0)
+               order[next[quadrant[i]]++] = copy[i];
+
          npar--;
 
          for (int i = 0; i < 4; i++)
@@ -1138,8 +1645,8 @@ static double Compute_Pairwise_MI(GenePairVector& pairs, int nparLimit)
                if (++npar > M)
                   throw std::string("Exceeded npar limit!");
 
-               if (npar > maxNpar)
-                  maxNpar = npar;
+               if (npar > localMaxNpar)
+                  localMaxNpar = npar;
 
                akon = apoc + NN[i] - 1;
 
@@ -1151,15 +1658,6 @@ static double Compute_Pairwise_MI(GenePairVector& pairs, int nparLimit)
                for (int j = 0; j < 4; j++)
                   marg[np + j * M] = amarg[i + 4 * j];
 
-               std::vector<int> t;
-
-               for (int j = 0; j < Nex; j++)
-                  if (I[i + 4 * j])
-                     t.push_back(apor[j]);
-
-               for (int j = apoc - 1; j < akon; j++)
-                  poradi[j] = t[j - apoc + 1];
-
                apoc = akon + 1;
             }
             else if (NN[i] > 0)
@@ -1181,6 +1679,9 @@ static double Compute_Pairwise_MI(GenePairVector& pairs, int nparLimit)
       }
    }
 
+   updateMaxNpar(localMaxNpar);
+   threadCounters.countPair(localMaxNpar);
+
    return (xcor / N + std::log(N));
 }
 
@@ -1188,7 +1689,8 @@ static double Compute_Pairwise_MI(GenePairVector& pairs, int nparLimit)
 
 double Microarray_Set::calculateMI(int maNum, int probeId1, int probeId2,
                                    double threshold, double noise2, int nparLimit,
-                                   const std::vector<int> *arrays) const
+                                   const std::vector<int> *arrays,
+                                   const MarkerRanks *ranks) const
 {
    // compute mutual information between two gene expression vectors;
    // zero is returned if there is no connection
@@ -1196,20 +1698,22 @@ double Microarray_Set::calculateMI(int maNum, int probeId1, int probeId2,
    if (isSameGene(probeId1, probeId2))
       return 0.0;
 
-   GenePairVector pairs;
+   double mi;
 
-   for (int i = 0; i < maNum; i++)
+   if (ranks)
+      mi = Compute_Pairwise_MI(ranks->get(probeId1), ranks->get(probeId2), maNum,
+                               nparLimit);
+   else
    {
-      int index = (arrays ? arrays->at(i) : i);
+      MarkerRanks pairRanks;
+      pairRanks.maNum = maNum;
+      pairRanks.computeOne(*this, probeId1, arrays);
+      pairRanks.computeOne(*this, probeId2, arrays);
 
-      double x = uarrays[index][probeId1].value;
-      double y = uarrays[index][probeId2].value;
-
-      pairs.push_back(GenePair(x, y, i));
+      mi = Compute_Pairwise_MI(pairRanks.get(probeId1), pairRanks.get(probeId2),
+                               maNum, nparLimit);
    }
 
-   double mi = Compute_Pairwise_MI(pairs, nparLimit);
-
    if (mi < threshold)
       return 0.0;
 
@@ -1231,78 +1735,295 @@ double Microarray_Set::calculateMI(int maNum, int probeId1, int probeId2,
 void Microarray_Set::computeOneRow(int maNum, Matrix& matrix, double threshold,
                                    int row_idx, int numMarkers, int controlId,
                                    const std::vector<int> *arrays, bool half_matrix,
-                                   bool symmetric, double noise2, int nparLimit) const
+                                   bool symmetric, double noise2, int nparLimit,
+                                   const MarkerRanks *ranks, const char *pass,
+                                   bool validate,
+                                   std::vector<std::pair<int, int> > *missed) const
 {
    // this function computes one row of the adjacency matrix; it is called by
    // createEdgeMatrix(); note that since the adjacency matrix is symmetric,
    // only the upper right triangle is computed; so here this function computes only
-   // the "upper right triangle" of the row
+   // the "upper right triangle" of the row; pass, if given, flags the markers that
+   // pass the Spearman prefilter (see RankScreen), the MI of the others being
+   // skipped, or with validate computed and their edges appended to missed
 
    for (int j = (half_matrix ? row_idx + 1 : 0); j < numMarkers; j++)
       if (j != controlId && markerset[j].isActive)
       {
+         bool skip = (pass != NULL && !pass[j]);
+
+         if (skip)
+         {
+            threadCounters.pairsSkipped++;
+
+            if (!validate)
+               continue;
+         }
+
          double edge = calculateMI(maNum, row_idx, j, threshold, noise2, nparLimit,
-                                   arrays);
+                                   arrays, ranks);
          if (edge != 0.0)
+         {
+            if (skip)
+            {
+               threadCounters.pairsMissed++;
+               missed->push_back(std::make_pair(row_idx, j));
+            }
+
+            threadCounters.pairsAboveThreshold++;
             matrix.addNode(row_idx, j, edge, symmetric);
+         }
       }
 }
 
+//------------------------------------------------------------------------------------
+// rankProduct() returns the sum of x[i] * y[i] over the n ranks (1 .. n) of two
+// markers; the products are added up in unsigned 32-bit integers, which the compiler
+// vectorizes, as many at a time as cannot overflow them
+
+static long long rankProduct(const int *x, const int *y, int n)
+{
+   if (n <= 0)
+      return 0;
+
+   unsigned long long maxProduct = (unsigned long long) n * n;
+
+   long long sum = 0;
+
+   if (maxProduct > 0xFFFFFFFFULL)
+   {
+      for (int i = 0; i < n; i++)
+         sum += (long long) x[i] * y[i];
+
+      return sum;
+   }
+
+   int chunk = (int) std::min<unsigned long long>(n, 0xFFFFFFFFULL / maxProduct);
+
+   for (int i = 0; i < n; i += chunk)
+   {
+      int end = std::min(n, i + chunk);
+
+      unsigned int part = 0;
+
+      for (int k = i; k < end; k++)
+         part += (unsigned int) x[k] * (unsigned int) y[k];
+
+      sum += part;
+   }
+
+   return sum;
+}
+
+//------------------------------------------------------------------------------------
+
+void RankScreen::screen(const Microarray_Set& data, const MarkerRanks& ranks,
+                        const int *rows, int count, int first, int controlId,
+                        std::vector<char>& pass) const
+{
+   // sets pass[k * numMarkers + j] to 1 if the pair of rows[k] (-1 if none) and marker
+   // j >= first passes the prefilter; the Spearman correlation of two rankings of n
+   // arrays whose products sum to s is (12 s - 3 n (n + 1)^2) / (n (n^2 - 1))
+
+   int numMarkers = data.markerset.size();
+
+   long long n      = ranks.maNum;
+   long long center = 3 * n * (n + 1) * (n + 1);
+   double    bound  = minRho * n * ((double) n * n - 1);
+
+   pass.assign((size_t) count * numMarkers, 0);
+
+   for (int j = first; j < numMarkers; j++)
+   {
+      if (j == controlId || !data.markerset[j].isActive)
+         continue;
+
+      const int *y = ranks.get(j);
+
+      for (int k = 0; k < count; k++)
+         if (rows[k] >= 0)
+         {
+            long long s = rankProduct(ranks.get(rows[k]), y, n);
+
+            pass[(size_t) k * numMarkers + j] = (std::fabs((double) (12 * s - center))
+                                                 >= bound);
+         }
+   }
+}
+
+//------------------------------------------------------------------------------------
+
+//------------------------------------------------------------------------------------
+// computeRows() is run by each worker thread of createEdgeMatrix(); rows[i] is the
+// row computed for the i-th task, or -1 if the task has nothing to compute; a worker
+// only writes into the NodeMap of the row it has claimed, so no locking is needed.
+// With a Spearman prefilter, a worker claims a block of RankScreen::blockRows tasks
+// and screens their rows together.
+
+static void computeRows(const Microarray_Set *data, int maNum, Matrix *matrix,
+                        double threshold, const std::vector<int> *rows,
+                        int controlId, const std::vector<int> *arrays,
+                        bool half_matrix, double noise2, int nparLimit,
+                        const MarkerRanks *ranks, RankScreen *screen,
+                        RowScheduler *scheduler)
+{
+   int numMarkers = data->markerset.size();
+   int numTasks   = rows->size();
+   int block      = (screen != NULL ? RankScreen::blockRows : 1);
+
+   std::vector<char> pass;
+   std::vector<std::pair<int, int> > missed;
+
+   threadCounters.clear();
+
+   try
+   {
+      for (int b = scheduler->claim(); b < scheduler->count; b = scheduler->claim())
+      {
+         int begin = b * block;
+         int end   = std::min(begin + block, numTasks);
+
+         if (screen != NULL)
+         {
+            // the upper right triangle of a row starts after the row
+
+            int first = numMarkers;
+
+            for (int i = begin; i < end; i++)
+               if ((*rows)[i] >= 0)
+                  first = std::min(first, half_matrix ? (*rows)[i] + 1 : 0);
+
+            screen->screen(*data, *ranks, &(*rows)[begin], end - begin, first,
+                           controlId, pass);
+         }
+
+         for (int i = begin; i < end; i++)
+            if ((*rows)[i] >= 0)
+               data->computeOneRow(maNum, *matrix, threshold, (*rows)[i], numMarkers,
+                                   controlId, arrays, half_matrix, false, noise2,
+                                   nparLimit, ranks,
+                                   screen != NULL ? &pass[(size_t) (i - begin) *
+                                                          numMarkers] : NULL,
+                                   screen != NULL && screen->validate, &missed);
+
+         scheduler->finishRow();
+      }
+   }
+   catch (const std::string& s)
+   {
+      scheduler->fail(s);
+   }
+
+   if (missed.size() > 0)
+   {
+      std::lock_guard<std::mutex> lock(screen->mutex);
+      screen->missed.insert(screen->missed.end(), missed.begin(), missed.end());
+   }
+
+   std::lock_guard<std::mutex> lock(countersMutex);
+   kernelCounters.add(threadCounters);
+}
+
 //------------------------------------------------------------------------------------
 
 void Microarray_Set::createEdgeMatrix(int maNum, Matrix& matrix, double threshold,
                                       int controlId, double noise2, int nparLimit,
                                       const std::vector<int>& ids,
-                                      const std::vector<int> *arrays) const
+                                      const std::vector<int> *arrays,
+                                      int numThreads,
+                                      const MarkerRanks *allRanks,
+                                      RankScreen *screen) const
 {
    // if controlId == -1, there is no constraint (use all arrays to compute the
    // mutual information; if ids.size == 0, all genes will be computed; otherwise,
    // only selected genes will be computed; arrays points to a vector of array ids
-   // used for mutual information computation
-
-   std::time_t t1, t2;
-   std::time(&t1); // get a timestamp to assess how much time this will take
+   // used for mutual information computation; the rows are distributed over
+   // numThreads threads, and the resulting matrix does not depend on numThreads;
+   // allRanks, if given, ranks all the arrays (see MarkerRanks::deriveOne());
+   // screen, if given, is the Spearman prefilter of the pairs
 
    int numMarkers = markerset.size();
    int count      = (ids.size() == 0 ? numMarkers : ids.size());
-   int step       = std::ceil(0.1 * count);
+   bool allGenes  = (ids.size() == 0);
+
+   // rows[i] is the row of the matrix computed by the i-th task; a gene listed
+   // more than once in ids is computed only once
+
+   std::vector<int> rows(count, -1);
+
+   matrix.thaw();
 
-   if (ids.size() == 0) // all genes will be computed
+   if (allGenes) // all genes will be computed
    {
       matrix.createEntries(count);
 
       for (int i = 0; i < count; i++)
-      {
          if (i != controlId && markerset[i].isActive)
-            computeOneRow(maNum, matrix, threshold, i, numMarkers, controlId,
-                          arrays, true, true, noise2, nparLimit);
-
-         if ((i + 1) % step == 0)
-         {
-            std::time(&t2);
-            std::cout << 10 * (i + 1) / step << "%, time: "
-                      << std::difftime(t2, t1) << std::endl;
-         }
-      }
+            rows[i] = i;
    }
    else // only selected genes will be computed
+   {
+      std::vector<bool> seen(numMarkers, false);
+
       for (int i = 0; i < count; i++)
-         if (ids[i] != controlId)
+         if (ids[i] != controlId && !seen[ids[i]])
          {
+            seen[ids[i]] = true;
+            rows[i] = ids[i];
+
             while (matrix.nmv.size() <= ids[i])
                matrix.nmv.push_back(NodeMap());
+         }
+   }
 
-            computeOneRow(maNum, matrix, threshold, ids[i], numMarkers, controlId,
-                          arrays, false, false, noise2, nparLimit);
+   int block = (screen != NULL ? RankScreen::blockRows : 1);
 
-            if ((i + 1) % step == 0)
-            {
-               std::time(&t2);
-               std::cout << 10 * (i + 1) / step << "%, time: "
-                         << std::difftime(t2, t1) << std::endl;
-            }
-         }
+   RowScheduler scheduler((count + block - 1) / block);
+
+   // rank every marker taking part in the computation once, up front
+
+   std::vector<bool> needed(numMarkers, false);
+
+   for (int i = 0; i < numMarkers; i++)
+      needed[i] = (i != controlId && markerset[i].isActive);
+
+   for (int i = 0; i < count; i++)
+      if (rows[i] >= 0)
+         needed[rows[i]] = true;
+
+   MarkerRanks ranks;
+   ranks.compute(*this, maNum, arrays, needed, allRanks, numThreads);
+
+   std::vector<std::thread> workers;
+
+   for (int t = 1; t < numThreads; t++)
+      workers.push_back(std::thread(computeRows, this, maNum, &matrix, threshold,
+                                    &rows, controlId, arrays, allGenes, noise2,
+                                    nparLimit, &ranks, screen, &scheduler));
+
+   computeRows(this, maNum, &matrix, threshold, &rows, controlId, arrays, allGenes,
+               noise2, nparLimit, &ranks, screen, &scheduler);
+
+   for (int t = 0; t < workers.size(); t++)
+      workers[t].join();
+
+   if (scheduler.failed)
+      throw scheduler.error;
+
+   // when all genes are computed, only the upper right triangle of the matrix has
+   // been filled in by the workers; mirror it into the lower left triangle
+
+   if (allGenes)
+      for (int i = 0; i < count; i++)
+         for (NodeMap::iterator npos = matrix.nmv[i].begin();
+              npos != matrix.nmv[i].end(); ++npos)
+            if (npos->first > i)
+               matrix.saveNode(npos->first, i, npos->second.mutinfo);
+
+   matrix.freeze();
 
+   std::time_t t2;
    std::time(&t2);
-   std::cout << "Gene: " << count << " Time: " << std::difftime(t2, t1) << std::endl;
+   std::cout << "Gene: " << count << " Time: " << std::difftime(t2, scheduler.start)
+             << std::endl;
 }
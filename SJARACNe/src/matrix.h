@@ -9,6 +9,8 @@
 
 #include <iostream>
 #include <map>
+#include <mutex>
+#include <unordered_map>
 #include "param.h"
 
 typedef std::map<int, int> Transfac;
@@ -38,24 +40,53 @@ public:
 typedef std::map<int, Node> NodeMap;
 typedef std::vector<NodeMap> NodeMapVector;
 
+//------------------------------------------------------------------------------------
+// While a network is being built (createEdgeMatrix(), read()), its rows are kept in
+// NodeMaps so that edges can be added in any order. Once complete, the network is
+// frozen into a compressed sparse row (CSR) layout: the edges of row i are the
+// entries rowStart[i] .. rowStart[i+1]-1 of the neighbor, mutinfo and intermediate
+// arrays, sorted by neighbor id. DPI and output work on the frozen layout, which takes
+// 16 bytes per edge and supports binary search lookups. Adding an edge to a frozen
+// matrix thaws it back into NodeMaps.
 //------------------------------------------------------------------------------------
 
 class Matrix
 {
 public:
    Matrix()
-      : nmv(), writeTriangular(false), writeReduced(false), writeEmptyGenes(false) { }
+      : nmv(), frozen(false), rowStart(1, 0), neighbor(), mutinfo(), intermediate(),
+        writeTriangular(false), writeReduced(false), writeEmptyGenes(false) { }
+
+   NodeMapVector nmv;                   // rows of a matrix being built
 
-   NodeMapVector nmv;
+   bool frozen;                         // true if the rows are in the CSR arrays
+   std::vector<long long> rowStart;     // CSR row offsets, one more than the rows
+   std::vector<int>       neighbor;     // CSR neighbor ids, sorted within a row
+   std::vector<double>    mutinfo;      // CSR mutual information values
+   std::vector<int>       intermediate; // CSR DPI intermediates, -1 if none
 
    bool writeTriangular; // if true, only triangular half of matrix will be written
    bool writeReduced;    // if true, intermediate nodes will be written
    bool writeEmptyGenes; // if true, empty lines will be written
 
+   int  numRows() const
+      { return (frozen ? rowStart.size() - 1 : nmv.size()); }
+   long long rowSize(int i) const
+      { return (frozen ? rowStart[i + 1] - rowStart[i] : nmv[i].size()); }
+   long long numEdges() const
+      { return (frozen ? neighbor.size() : 0); }
+
+   void freeze();
+   void thaw();
+   void filter(const Matrix& source, double threshold);
+   long long findEdge(int i, int j) const;
+
    void saveNode(int i, int j, double mi);
 
    void read(Microarray_Set& data, const Parameter& p);
    void read(std::istream& in, Microarray_Set& data, const Parameter& p);
+   void read(const char *begin, const char *end, Microarray_Set& data,
+             const Parameter& p);
 
    void writeGeneLine(std::ostream& out, const Microarray_Set& data, int geneId);
    void writeGeneList(const Microarray_Set& data, const std::string& name,
@@ -63,17 +94,61 @@ public:
 
    void write(std::ostream& out, const Microarray_Set& data,
               const std::vector<int>& ids);
-   void write(const Microarray_Set& data, const std::vector<int>& ids,
-              const Parameter& p, bool writeFull=true);
+   long long write(const Microarray_Set& data, const std::vector<int>& ids,
+                   const Parameter& p, bool writeFull=true);
+   void writeBinary(std::ostream& out, const Microarray_Set& data,
+                    const std::vector<int>& ids, const std::string& header,
+                    bool compress);
+   void getEdges(const std::vector<int>& ids, std::vector<int>& hubs,
+                 std::vector<int>& targets, std::vector<double>& mis);
+
+   void writeState(const std::string& filename, const std::string& signature,
+                   double epsilon, const std::vector<int>& rows,
+                   const Transfac& transfac) const;
+   bool readState(const std::string& filename, const std::string& signature,
+                  double& epsilon, std::vector<int>& rows, std::vector<int>& tfs);
 
    void createEntries(int numEntries);
    void addNode(int i, int j, double edgeValue, bool symmetric);
 
-   double getNodeMI(int geneId1, int geneId2);
-   void reduceOneNode(int row_idx, double epsilon, Transfac& transfac);
-   void reduce(double epsilon, const std::vector<int>& ids, Transfac& transfac);
+   double getNodeMI(int geneId1, int geneId2) const;
+   void reduceOneNode(int row_idx, double epsilon, const std::vector<bool>& isTF);
+   void reduce(double epsilon, const std::vector<int>& ids, Transfac& transfac,
+               int numThreads=1);
 };
 
+//------------------------------------------------------------------------------------
+// KernelCounters counts the work done by the MI kernel and by DPI, for the metrics
+// report of sjaracne.exe ('-M'): the gene pairs whose MI was computed, those whose MI
+// reached the threshold, the edges DPI marked as indirect, the pairs skipped by the
+// Spearman prefilter (see RankScreen), and the number of pairs for each maximum
+// partition depth npar reached by the adaptive partitioning. The
+// worker threads count into their own KernelCounters and add them to kernelCounters
+// when they finish.
+//------------------------------------------------------------------------------------
+
+class KernelCounters
+{
+public:
+   KernelCounters()
+      : pairsEvaluated(0), pairsAboveThreshold(0), edgesRemoved(0), pairsSkipped(0),
+        pairsMissed(0), edgesMissed(0), nparHistogram() { }
+
+   long long pairsEvaluated;
+   long long pairsAboveThreshold;
+   long long edgesRemoved;
+   long long pairsSkipped; // pairs the Spearman prefilter skipped (or would skip)
+   long long pairsMissed;  // of those, pairs above the MI threshold (validation)
+   long long edgesMissed;  // edges of the unfiltered network lost (validation)
+   std::vector<long long> nparHistogram; // nparHistogram[n]: pairs with max npar n
+
+   void countPair(int npar);
+   void add(const KernelCounters& c);
+   void clear() { *this = KernelCounters(); }
+};
+
+extern KernelCounters kernelCounters; // totals since the last clear()
+
 //------------------------------------------------------------------------------------
 // A Microarray dataset consists of multiple arrays, each of which measures the
 // expression of thousands of Markers. Here we represent each of these measurements
@@ -110,6 +185,17 @@ public:
 typedef std::vector<Marker> Marker_Set; // array of markers, indexed by the ID
                                         // numbers contained by the markers
 //------------------------------------------------------------------------------------
+// Expression values are stored as doubles, or as floats (half the memory) when the
+// program is built with -DSJARACNE_FLOAT_VALUES (make FLOAT_VALUES=1); note that
+// floats cannot hold the tiny noise added by addNoise(), so ties are then broken by
+// array position alone
+//------------------------------------------------------------------------------------
+
+#ifdef SJARACNE_FLOAT_VALUES
+typedef float ExprValue;
+#else
+typedef double ExprValue;
+#endif
 
 class Probe
 {
@@ -124,7 +210,65 @@ public:
 };
 
 typedef std::vector<Probe> Microarray;
-typedef std::vector<Microarray> Microarray_Vector;
+
+//------------------------------------------------------------------------------------
+// MarkerRanks holds, for each marker, the rank of its expression value in each of the
+// arrays used for mutual information computation (1 = lowest value, ties broken by
+// the position of the array); the ranks are all that the adaptive partitioning
+// algorithm needs, so they are computed once per set of arrays instead of once per
+// gene pair. The ranks of a subset of the arrays can be derived in linear time from
+// those of all arrays (see deriveOne()), which a batch of conditional networks ('-m')
+// computes once.
+//------------------------------------------------------------------------------------
+
+class MarkerRanks
+{
+public:
+   MarkerRanks()
+      : maNum(0), ranks() { }
+
+   int maNum;                            // number of arrays ranked
+   std::vector<std::vector<int> > ranks; // ranks[probeId][i], empty if not computed
+
+   void compute(const Microarray_Set& data, int inMaNum,
+                const std::vector<int> *arrays, const std::vector<bool>& needed,
+                const MarkerRanks *all=NULL, int numThreads=1);
+   void computeOne(const Microarray_Set& data, int probeId,
+                   const std::vector<int> *arrays);
+   void deriveOne(const Microarray_Set& data, int probeId, const MarkerRanks& all,
+                  const std::vector<int>& arrays, const std::vector<int>& head,
+                  const std::vector<int>& next, std::vector<int>& order,
+                  std::vector<int>& group);
+
+   const int *get(int probeId) const { return &ranks[probeId][0]; }
+};
+
+//------------------------------------------------------------------------------------
+// RankScreen is the Spearman prefilter of the MI kernel ('-R'): the MI of a pair of
+// markers is computed only if the absolute Spearman correlation of their ranks is at
+// least minRho. The correlations are the products of the rank vectors, computed in
+// integers (so exactly) for a block of blockRows rows against all the markers at a
+// time, each marker's ranks being read once per block. With validate, the MI of every
+// pair is computed all the same, and the pairs above the MI threshold the prefilter
+// would have skipped are listed in missed.
+//------------------------------------------------------------------------------------
+
+class RankScreen
+{
+public:
+   static const int blockRows = 16;
+
+   RankScreen(double inMinRho=0.0, bool inValidate=false)
+      : minRho(inMinRho), validate(inValidate), missed(), mutex() { }
+
+   double minRho;
+   bool   validate;
+   std::vector<std::pair<int, int> > missed; // (row, marker), in no particular order
+   std::mutex mutex;                         // serializes additions to missed
+
+   void screen(const Microarray_Set& data, const MarkerRanks& ranks, const int *rows,
+               int count, int first, int controlId, std::vector<char>& pass) const;
+};
 
 //------------------------------------------------------------------------------------
 
@@ -132,14 +276,37 @@ class Microarray_Set
 {
 public:
    Microarray_Set()
-      : markerset(), uarrays(), header() { }
+      : markerset(), numArrays(0), values(), pvalues(), header(), accnumIndex(),
+        numIndexed(-1) { }
 
    Marker_Set markerset;                 // Get_Num_Markers(), Get_Marker(),
                                          // Get_Marker_AffyId() gets marker's accnum,
                                          // getMarkerVariance() gets marker's variance
-   Microarray_Vector uarrays;            // Get_Num_Microarrays(), Get_Microarray(),
-                                         // Get_Probe(), Get_Value(), Get_PValue()
+   int numArrays;                        // Get_Num_Microarrays()
+   std::vector<ExprValue> values;        // expression values, one contiguous block
+                                         // per marker (gene-major): the value of
+                                         // marker m in array a is at m*numArrays+a
+   std::vector<double> pvalues;          // p-values, same layout as values; empty
+                                         // unless the input file has p-values
    std::vector<std::string> header;      // Get_Header(), Get_Array_Header()
+   std::unordered_map<std::string, int> accnumIndex; // accession number -> marker id
+   int numIndexed;                       // markers in accnumIndex, -1 if not built
+
+   int Get_Num_Microarrays() const { return numArrays; }
+
+   const ExprValue *Get_Marker_Values(int markerId) const
+      { return &values[(size_t) markerId * numArrays]; }
+
+   ExprValue& valueAt(int arrayId, int markerId)
+      { return values[(size_t) markerId * numArrays + arrayId]; }
+   ExprValue Get_Value(int arrayId, int markerId) const
+      { return values[(size_t) markerId * numArrays + arrayId]; }
+   double Get_PValue(int arrayId, int markerId) const
+      { return (pvalues.empty() ? 0.0 : pvalues[(size_t) markerId * numArrays + arrayId]); }
+
+   Probe Get_Probe(int arrayId, int markerId) const
+      { return Probe(Get_Value(arrayId, markerId), Get_PValue(arrayId, markerId)); }
+   Microarray Get_Microarray(int arrayId) const;
 
    friend std::ostream& operator<<(std::ostream& out, const Microarray_Set& ms);
 
@@ -147,18 +314,26 @@ public:
 
    bool isSameGene(int i, int j) const;
 
+   void indexMarkers();
    int  getAccessionId(const std::string& accnum) const; // formerly, get_Id()
    int  getProbeId(const std::string& label) const;
 
    void Set_ColHeader(int i, const std::string& hdr);
    void Set_Marker(int i, const Marker& m);
    void Set_Probe (int i, int j, Probe p);
+   void Set_Num_Microarrays(int n);
 
    int readMarkerWithPvalue(std::istream& in, const int arrno);
    int readMarkerNoPvalue  (std::istream& in, const int arrno);
    int readHeader(std::istream& in);
-   void read(const std::string& filename);
+   void read(const std::string& filename, const std::string& cachefile="");
    void read(std::istream& in);
+   void read(const char *begin, const char *end);
+
+   bool readCache(const std::string& cachefile, unsigned long long sourceSize,
+                  long long sourceMtime, unsigned long long sourceHash);
+   void writeCache(const std::string& cachefile, unsigned long long sourceSize,
+                   long long sourceMtime, unsigned long long sourceHash) const;
 
    int  filter(const std::vector<int>& ids, double minMean=50.0, double minSigma=20.0,
                int ctlid=-1);
@@ -176,15 +351,19 @@ public:
    void addNoise();
 
    double calculateMI(int maNum, int probeId1, int probeId2, double threshold,
-                      double noise2, int nparLimit,
-                      const std::vector<int> *arrays) const;
+                      double noise2, int nparLimit, const std::vector<int> *arrays,
+                      const MarkerRanks *ranks=NULL) const;
    void computeOneRow(int maNum, Matrix& matrix, double threshold, int row_idx,
                       int numMarkers, int controlId, const std::vector<int> *arrays,
                       bool half_matrix, bool symmetric, double noise2,
-                      int nparLimit) const;
+                      int nparLimit, const MarkerRanks *ranks=NULL,
+                      const char *pass=NULL, bool validate=false,
+                      std::vector<std::pair<int, int> > *missed=NULL) const;
    void createEdgeMatrix(int maNum, Matrix& matrix, double threshold, int controlId,
                          double noise2, int nparLimit, const std::vector<int>& ids,
-                         const std::vector<int> *arrays) const;
+                         const std::vector<int> *arrays, int numThreads=1,
+                         const MarkerRanks *allRanks=NULL,
+                         RankScreen *screen=NULL) const;
 };
 
 #endif
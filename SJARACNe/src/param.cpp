@@ -5,7 +5,9 @@
 //------------------------------------------------------------------------------------
 
 #include <cctype>
+#include <cmath>
 #include <cstdio>
+#include <cstdlib>
 #include <fstream>
 #include <iostream>
 #include <sstream>
@@ -24,6 +26,10 @@ const double Parameter::default_cv         =  0.00; // filter standard deviation
 const double Parameter::default_correction =  0.00; // array measurement noise level
 const int    Parameter::default_nparLimit  = 20;    // max allowed value of npar
 const int    Parameter::default_seed       = 1;     // Initial seed for random number generator
+const int    Parameter::default_numThreads = 1;     // number of worker threads
+const int    Parameter::default_numBootstraps = 0;  // number of bootstraps in one run
+const int    Parameter::default_numShards  = 1;     // number of shards of the hub genes
+const double Parameter::default_minRho     = 0.00;  // no Spearman prefilter
 //------------------------------------------------------------------------------------
 
 bool equalIgnoreCase(std::string a, std::string b)
@@ -39,6 +45,47 @@ bool equalIgnoreCase(std::string a, std::string b)
    return (i == len);
 }
 
+//------------------------------------------------------------------------------------
+// parseCondition() sets the condition, control probe and percentage of p from a line
+// of the conditions file ('-m'), which has the format of '-c': "+24 0.35"
+
+void parseCondition(const std::string& line, Parameter& p)
+{
+   std::istringstream sin(line);
+   std::string probe, percent, extra;
+
+   sin >> probe >> percent;
+
+   char *end;
+   double x = std::strtod(percent.c_str(), &end);
+
+   if (probe.length() < 2 || percent == "" || *end != '\0' || (sin >> extra))
+      throw "Condition must be \"+probeId %\" or \"-probeId %\": " + line;
+
+   p.condition = probe.substr(0, 1);
+   p.controlId = probe.substr(1);
+   p.percent   = x;
+}
+
+//------------------------------------------------------------------------------------
+// readConditions() reads the conditions file ('-m'), skipping empty lines
+
+static void readConditions(const std::string& infilename,
+                           std::vector<std::string>& conditions)
+{
+   std::ifstream in(infilename.c_str());
+   if (!in.is_open())
+      throw "Unable to open " + infilename;
+
+   std::string line;
+
+   while (std::getline(in, line))
+      if (line.find_first_not_of(" \t\r") != std::string::npos)
+         conditions.push_back(line);
+
+   in.close();
+}
+
 //------------------------------------------------------------------------------------
 
 void checkParameter(Parameter &p)
@@ -91,9 +138,136 @@ void checkParameter(Parameter &p)
    if (!equalIgnoreCase(p.verbose, "on") && !equalIgnoreCase(p.verbose, "off"))
       throw std::string("Verbose '-v' must be 'on' or 'off'!");
 
+   if (!equalIgnoreCase(p.format, "text") && !equalIgnoreCase(p.format, "binary") &&
+       !equalIgnoreCase(p.format, "zbinary"))
+      throw std::string("Output format '-F' must be 'text', 'binary' or 'zbinary'!");
+
+#ifndef SJARACNE_ZLIB
+   if (equalIgnoreCase(p.format, "zbinary"))
+      throw std::string("Output format 'zbinary' is not available: sjaracne.exe was "
+                        "built without zlib!");
+#endif
+
    if (p.nparLimit < 1)
       throw std::string("Maximum allowed value of npar must be positive!");
 
+   if (p.numThreads < 1)
+      throw std::string("Number of threads '-T' must be positive!");
+
+   if (p.numBootstraps < 0)
+      throw std::string("Number of bootstraps '-B' must be nonnegative!");
+
+   if (p.numBootstraps > 0 && p.adjfile != "")
+      throw std::string("Either read an existing network by '-j' or build bootstrap "
+                        "networks by '-B', but not both!");
+
+   for (int i = 0; i < (int) p.sweep.size(); i++)
+   {
+      char *end;
+      double pvalue = std::strtod(p.sweep[i].c_str(), &end);
+
+      if (p.sweep[i] == "" || *end != '\0' || pvalue <= 0.0 || pvalue > 1.0)
+         throw "P-values of a sweep '-w' must be in the range (0,1]: " + p.sweep[i];
+
+      for (int j = 0; j < i; j++)
+         if (p.sweep[j] == p.sweep[i])
+            throw "P-value " + p.sweep[i] + " is given twice in the sweep '-w'!";
+   }
+
+   if (p.sweep.size() > 0 && (p.threshold > 0.0 || p.pvalue != 1.0))
+      throw std::string("Either a threshold '-t' or '-p', or a sweep '-w', but not both!");
+
+   if (p.sweep.size() > 0 && p.correction != 0.0)
+      throw std::string("A sweep '-w' thresholds the MI before correction; it cannot be "
+                        "used with '-n'!");
+
+   if (p.sweep.size() > 0 && p.adjfile != "")
+      throw std::string("Either read an existing network by '-j' or sweep by '-w', but "
+                        "not both!");
+
+   if (p.sweep.size() > 0 && p.numShards > 1)
+      throw std::string("Either shard '-x' or sweep '-w' a network, but not both!");
+
+   if (p.conditionfile != "")
+   {
+      if (p.controlId != "")
+         throw std::string("Either one condition by '-c' or a batch of conditions by "
+                           "'-m', but not both!");
+
+      if (p.adjfile != "")
+         throw std::string("Either read an existing network by '-j' or build a batch "
+                           "of conditional networks by '-m', but not both!");
+
+      readConditions(p.conditionfile, p.conditions);
+
+      if (p.conditions.size() == 0)
+         throw "No conditions in \"" + p.conditionfile + "\"!";
+
+      std::vector<Parameter> seen;
+
+      for (int i = 0; i < (int) p.conditions.size(); i++)
+      {
+         Parameter q;
+         parseCondition(p.conditions[i], q);
+
+         if (q.condition != "+" && q.condition != "-")
+            throw "Condition must be '+' or '-': " + p.conditions[i];
+
+         if (q.percent <= 0.0 || q.percent >= 1.0)
+            throw "Percentage microarray must be within (0,1): " + p.conditions[i];
+
+         for (int j = 0; j < (int) seen.size(); j++)
+            if (seen[j].condition == q.condition && seen[j].controlId == q.controlId &&
+                seen[j].percent == q.percent)
+               throw "Condition \"" + p.conditions[i] + "\" is given twice in \"" +
+                     p.conditionfile + "\"!";
+
+         seen.push_back(q);
+      }
+   }
+
+   if (p.numShards < 1 || p.shard < 1 || p.shard > p.numShards)
+      throw std::string("Shard '-x' must be i/n with 1 <= i <= n!");
+
+   if (p.numShards > 1 && p.subnetfile == "")
+      throw std::string("Sharding '-x' requires a list of hub genes '-s'!");
+
+   if (p.numShards > 1 && p.adjfile != "")
+      throw std::string("Either read an existing network by '-j' or compute a shard "
+                        "by '-x', but not both!");
+
+   if (p.numShards > 1 && !equalIgnoreCase(p.format, "text"))
+      throw std::string("Shards '-x' are written in the text format only!");
+
+   if (p.minRho < 0.0 || p.minRho >= 1.0)
+      throw std::string("Spearman prefilter '-R' must be within [0,1)!");
+
+   if (p.validate != "on" && p.validate != "off")
+      throw std::string("Prefilter validation '-V' must be on or off!");
+
+   if (p.validate == "on")
+   {
+      if (p.minRho == 0.0)
+         throw std::string("Prefilter validation '-V' requires a Spearman prefilter "
+                           "'-R'!");
+
+      if (p.adjfile != "" || p.sweep.size() > 0 || p.statefile != "")
+         throw std::string("Prefilter validation '-V' cannot be used with '-j', '-w' "
+                           "or '-I'!");
+   }
+
+   if (p.statefile != "")
+   {
+      if (p.subnetfile == "")
+         throw std::string("Incremental hub extension '-I' requires a list of hub genes "
+                           "'-s'!");
+
+      if (p.adjfile != "" || p.sweep.size() > 0 || p.numShards > 1 ||
+          p.numBootstraps > 0 || p.conditionfile != "")
+         throw std::string("Incremental hub extension '-I' cannot be used with '-j', "
+                           "'-w', '-x', '-B' or '-m'!");
+   }
+
    if (p.home_dir != "./")
    {
       int len = p.home_dir.length();
@@ -142,13 +316,38 @@ void displayParameter(Parameter &p)
    std::cout << "[PARA] Input file:    " << p.infile  << std::endl;
    std::cout << "[PARA] Output file:   " << p.outfile << std::endl;
 
-   if (p.threshold > 0.0)
+   if (p.cachefile != "")
+      std::cout << "[PARA] Dataset cache: " << p.cachefile << std::endl;
+
+   if (!equalIgnoreCase(p.format, "text"))
+      std::cout << "[PARA] Output format: " << p.format << std::endl;
+
+   if (p.metricsfile != "")
+      std::cout << "[PARA] Metrics file:  " << p.metricsfile << std::endl;
+
+   if (p.statefile != "")
+      std::cout << "[PARA] Network state: " << p.statefile << std::endl;
+
+   if (p.sweep.size() > 0)
+   {
+      std::cout << "[PARA] MI P-values:   ";
+
+      for (int i = 0; i < (int) p.sweep.size(); i++)
+         std::cout << (i > 0 ? "," : "") << p.sweep[i];
+
+      std::cout << " (sweep)" << std::endl;
+   }
+   else if (p.threshold > 0.0)
       std::cout << "[PARA] MI threshold:  " << p.threshold << std::endl;
    else
       std::cout << "[PARA] MI P-value:    " << p.pvalue    << std::endl;
 
    std::cout << "[PARA] DPI tolerance: " << p.eps << std::endl;
 
+   if (p.minRho > 0.0)
+      std::cout << "[PARA] Spearman prefilter: |rho| >= " << p.minRho
+                << (p.validate == "on" ? " (validated)" : "") << std::endl;
+
    if (p.correction > 0.0)
       std::cout << "[PARA] Correction for MI estimation (array noise level: "
                 << p.correction << ")" << std::endl;
@@ -167,6 +366,10 @@ void displayParameter(Parameter &p)
       std::cout << "[PARA] Percentage:    " << p.percent   << std::endl;
    }
 
+   if (p.conditionfile != "")
+      std::cout << "[PARA] Conditions:    " << p.conditionfile << " ("
+                << p.conditions.size() << ")" << std::endl;
+
    if (p.annotfile != "")
       std::cout << "[PARA] TF annotation list: " << p.annotfile
                 << " (" << readProbeList(p.annotfile, p.tf_list) << ")" << std::endl;
@@ -178,6 +381,47 @@ void displayParameter(Parameter &p)
    }
 
    std::cout << "[PARA] Npar limit:    " << p.nparLimit << std::endl;
+
+   if (p.numThreads > 1)
+      std::cout << "[PARA] Threads:       " << p.numThreads << std::endl;
+
+   if (p.numShards > 1)
+      std::cout << "[PARA] Shard:         " << p.shard << " of " << p.numShards
+                << std::endl;
+
+   if (p.numBootstraps > 0)
+      std::cout << "[PARA] Bootstraps:    " << p.numBootstraps << " (seeds " << p.seed
+                << " to " << p.seed + p.numBootstraps - 1 << ")" << std::endl;
+}
+
+//------------------------------------------------------------------------------------
+// findThreshold() sets p.threshold to the MI threshold for p.pvalue and n arrays, using
+// the coefficients in config_threshold.txt of p.home_dir
+
+void findThreshold(int n, Parameter& p)
+{
+   std::string filename = p.home_dir + "config_threshold.txt";
+
+   std::ifstream infile(filename.c_str());
+   if (!infile.is_open())
+      throw "Unable to open " + filename;
+
+   std::string line;
+
+   std::getline(infile, line);
+   while (line.length() > 0 && line[0] == '>')
+      std::getline(infile, line);
+
+   std::istringstream sin(line);
+
+   if (!sin.good() || sin.peek() == EOF)
+      throw "Configuration file format error: " + filename;
+
+   double alpha, beta, gamma;
+   sin >> alpha >> beta >> gamma;
+   p.threshold = (alpha - std::log(p.pvalue)) / (-beta - gamma * n);
+
+   infile.close();
 }
 
 //------------------------------------------------------------------------------------
@@ -19,6 +19,10 @@ struct Parameter
    static const double default_percent, default_mean, default_cv, default_correction;
    static const int    default_nparLimit;
    static const int    default_seed;
+   static const int    default_numThreads;
+   static const int    default_numBootstraps;
+   static const int    default_numShards;
+   static const double default_minRho;
 
    double threshold;  // mi threshold
    double pvalue;     // p-value for mi threshold
@@ -31,19 +35,34 @@ struct Parameter
    double correction; // coorection for noise
    int    nparLimit;  // maximum allowed value of npar
    int    seed;       // seed
+   int    numThreads; // number of worker threads for MI computation
+   int    numBootstraps; // number of bootstrap networks built in one run
+   int    shard;      // shard of the hub genes computed by this run, 1 .. numShards
+   int    numShards;  // number of shards the hub genes are split into
+   double minRho;     // Spearman prefilter: least |rho| of a pair whose MI is computed
 
-   std::string verbose, infile, outfile, adjfile, hub;
-   std::string subnetfile, annotfile, controlId, condition, home_dir;
+   std::string verbose, validate, infile, outfile, adjfile, hub, cachefile, format, metricsfile;
+   std::string subnetfile, annotfile, controlId, condition, home_dir, conditionfile;
+   std::string statefile; // network state of an incremental hub extension ('-I')
 
    std::vector<std::string> subnet, tf_list;
 
+   std::vector<std::string> sweep;           // p-values of a sweep ('-w'), as given
+   std::vector<double>      sweepThresholds; // MI threshold of each p-value of sweep
+
+   std::vector<std::string> conditions; // lines of conditionfile ('-m'), see '-c'
+
    Parameter()
       : threshold(default_threshold), pvalue(default_pvalue), eps(default_eps),
         sigma(default_sigma), sample(default_sample), percent(default_percent),
         mean(default_mean), cv(default_cv), correction(default_correction),
-        nparLimit(default_nparLimit), seed(default_seed), verbose("off"), infile(""), outfile(""),
-        adjfile(""), hub(""), subnetfile(""), annotfile(""), controlId(""),
-        condition(""), home_dir("./"), subnet(), tf_list() { }
+        nparLimit(default_nparLimit), seed(default_seed),
+        numThreads(default_numThreads), numBootstraps(default_numBootstraps),
+        shard(1), numShards(default_numShards), minRho(default_minRho),
+        verbose("off"), validate("off"), infile(""), outfile(""), adjfile(""), hub(""), cachefile(""),
+        format("text"), metricsfile(""), subnetfile(""), annotfile(""), controlId(""), condition(""),
+        home_dir("./"), conditionfile(""), statefile(""), subnet(), tf_list(), sweep(), sweepThresholds(),
+        conditions() { }
 };
 
 //------------------------------------------------------------------------------------
@@ -52,5 +71,7 @@ bool equalIgnoreCase(std::string a, std::string b);
 void checkParameter(Parameter &p);
 void displayParameter(Parameter &p);
 void createOutfileName(Parameter &p );
+void findThreshold(int n, Parameter& p);
+void parseCondition(const std::string& line, Parameter& p);
 
 #endif
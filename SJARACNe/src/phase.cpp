@@ -0,0 +1,110 @@
+//------------------------------------------------------------------------------------
+// PhaseTimer -- wall time, CPU time and peak memory of the phases of a run
+//------------------------------------------------------------------------------------
+
+#include <sys/resource.h>
+#include <cstdio>
+#include "phase.h"
+
+//------------------------------------------------------------------------------------
+
+void PhaseTimer::start()
+{
+   wallStart = std::chrono::steady_clock::now();
+   cpuStart  = processCpuSeconds();
+}
+
+//------------------------------------------------------------------------------------
+
+PhaseStats PhaseTimer::stop() const
+{
+   std::chrono::duration<double> d = std::chrono::steady_clock::now() - wallStart;
+
+   PhaseStats s;
+
+   s.wall    = d.count();
+   s.cpu     = processCpuSeconds() - cpuStart;
+   s.peakRss = peakResidentBytes();
+
+   return s;
+}
+
+//------------------------------------------------------------------------------------
+
+void PhaseLog::writeJson(std::ostream& out, const std::string& indent) const
+{
+   for (size_t i = 0; i < phases.size(); i++)
+   {
+      out << indent << jsonString(phases[i].first) << ": ";
+      ::writeJson(out, phases[i].second);
+      out << (i + 1 < phases.size() ? ",\n" : "\n");
+   }
+}
+
+//------------------------------------------------------------------------------------
+
+void writeJson(std::ostream& out, const PhaseStats& s)
+{
+   char buffer[128];
+   std::snprintf(buffer, sizeof(buffer), "{\"wall_seconds\": %.6f, \"cpu_seconds\": %.6f, "
+                 "\"peak_rss_bytes\": %lld}", s.wall, s.cpu, s.peakRss);
+
+   out << buffer;
+}
+
+//------------------------------------------------------------------------------------
+// jsonString() quotes s as a JSON string
+
+std::string jsonString(const std::string& s)
+{
+   std::string quoted("\"");
+
+   for (size_t i = 0; i < s.length(); i++)
+   {
+      unsigned char c = s[i];
+
+      if (c == '"' || c == '\\')
+         quoted += std::string("\\") + s[i];
+      else if (c < 0x20)
+      {
+         char buffer[8];
+         std::snprintf(buffer, sizeof(buffer), "\\u%04x", c);
+         quoted += buffer;
+      }
+      else
+         quoted += s[i];
+   }
+
+   return quoted + "\"";
+}
+
+//------------------------------------------------------------------------------------
+
+double processCpuSeconds()
+{
+   struct rusage ru;
+
+   if (getrusage(RUSAGE_SELF, &ru) != 0)
+      return 0.0;
+
+   return ru.ru_utime.tv_sec + ru.ru_stime.tv_sec +
+          1e-6 * (ru.ru_utime.tv_usec + ru.ru_stime.tv_usec);
+}
+
+//------------------------------------------------------------------------------------
+// peakResidentBytes() returns the largest resident set size the process has had so
+// far; getrusage() reports it in kilobytes on Linux and in bytes on macOS
+
+long long peakResidentBytes()
+{
+   struct rusage ru;
+
+   if (getrusage(RUSAGE_SELF, &ru) != 0)
+      return 0;
+
+#ifdef __APPLE__
+   return ru.ru_maxrss;
+#else
+   return 1024LL * ru.ru_maxrss;
+#endif
+}
@@ -0,0 +1,68 @@
+//------------------------------------------------------------------------------------
+// PhaseTimer -- wall time, CPU time and peak memory of the phases of a run
+//------------------------------------------------------------------------------------
+
+#ifndef PHASE_H__
+#define PHASE_H__
+
+#include <chrono>
+#include <iostream>
+#include <string>
+#include <utility>
+#include <vector>
+
+//------------------------------------------------------------------------------------
+// A PhaseStats holds what a PhaseTimer measured: the wall time and the CPU time (all
+// threads of the process) elapsed since the timer was started, and the peak resident
+// memory of the process at the end of the phase.
+//------------------------------------------------------------------------------------
+
+class PhaseStats
+{
+public:
+   PhaseStats()
+      : wall(0.0), cpu(0.0), peakRss(0) { }
+
+   double    wall;    // seconds
+   double    cpu;     // seconds
+   long long peakRss; // bytes
+};
+
+class PhaseTimer
+{
+public:
+   PhaseTimer() { start(); }
+
+   void start();
+   PhaseStats stop() const;
+
+private:
+   std::chrono::steady_clock::time_point wallStart;
+   double cpuStart;
+};
+
+//------------------------------------------------------------------------------------
+// A PhaseLog lists the measured phases of a run in the order they ran; writeJson()
+// writes them as the members of a JSON object, one line per phase.
+//------------------------------------------------------------------------------------
+
+class PhaseLog
+{
+public:
+   std::vector<std::pair<std::string, PhaseStats> > phases;
+
+   void add(const std::string& name, const PhaseStats& s)
+      { phases.push_back(std::make_pair(name, s)); }
+
+   void writeJson(std::ostream& out, const std::string& indent) const;
+};
+
+//------------------------------------------------------------------------------------
+
+void writeJson(std::ostream& out, const PhaseStats& s);
+std::string jsonString(const std::string& s);
+
+double processCpuSeconds();
+long long peakResidentBytes();
+
+#endif
@@ -0,0 +1,945 @@
+//------------------------------------------------------------------------------------
+// Fast readers for gene expression datasets and adjacency files, and the binary cache
+// of a parsed dataset
+//------------------------------------------------------------------------------------
+
+#include <algorithm>
+#include <cerrno>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <fstream>
+#include <iterator>
+#include <limits>
+#include <sstream>
+#include <unistd.h>
+#include "mapfile.h"
+#include "matrix.h"
+
+//------------------------------------------------------------------------------------
+// A TextScanner reads a block of text in place. Its methods behave like the istream
+// operations used by the original reader (std::getline, operator>>, get, peek),
+// including when the eof and fail states get set, so that a file is accepted or
+// rejected exactly as before and errors are reported at the same line.
+//------------------------------------------------------------------------------------
+
+class TextScanner
+{
+public:
+   TextScanner(const char *inBegin, const char *inEnd)
+      : pos(inBegin), end(inEnd), eof(false), fail(false) { }
+
+   const char *pos; // next character to be read
+   const char *end; // end of the text
+   bool eof;        // end of the text has been hit
+   bool fail;       // last operation failed
+
+   bool good() const { return !eof && !fail; }
+
+   int peek()
+   {
+      if (fail)
+         return EOF;
+
+      if (pos == end)
+      {
+         eof = true;
+         return EOF;
+      }
+
+      return static_cast<unsigned char>(*pos);
+   }
+
+   int get()
+   {
+      if (!good() || pos == end)
+      {
+         eof  = (pos == end);
+         fail = true;
+         return EOF;
+      }
+
+      return static_cast<unsigned char>(*pos++);
+   }
+
+   bool getline(const char *&b, const char *&e, char delim);
+   bool getline(std::string& s, char delim);
+   bool readDouble(double& v);
+   bool readWord(std::string& s);
+
+private:
+   static bool isSpace(char c)
+   {
+      return (c == ' ' || c == '\t' || c == '\n' || c == '\v' || c == '\f' ||
+              c == '\r');
+   }
+
+   bool skipSpace();
+};
+
+//------------------------------------------------------------------------------------
+
+bool TextScanner::getline(const char *&b, const char *&e, char delim)
+{
+   b = e = pos;
+
+   if (!good() || pos == end)
+   {
+      eof  = eof || (pos == end);
+      fail = true;
+      return false;
+   }
+
+   const char *d = static_cast<const char *>(std::memchr(pos, delim, end - pos));
+
+   if (d)
+   {
+      e   = d;
+      pos = d + 1;
+   }
+   else
+   {
+      e   = end;
+      pos = end;
+      eof = true;
+   }
+
+   return true;
+}
+
+bool TextScanner::getline(std::string& s, char delim)
+{
+   const char *b, *e;
+
+   bool ok = getline(b, e, delim);
+   s.assign(b, e);
+
+   return ok;
+}
+
+//------------------------------------------------------------------------------------
+
+bool TextScanner::skipSpace()
+{
+   if (!good())
+   {
+      fail = true;
+      return false;
+   }
+
+   while (pos != end && isSpace(*pos))
+      pos++;
+
+   if (pos == end)
+   {
+      eof  = true;
+      fail = true;
+      return false;
+   }
+
+   return true;
+}
+
+//------------------------------------------------------------------------------------
+// readDouble() accepts what operator>>(double&) accepts: an optional sign, digits
+// with at most one decimal point, and an exponent that follows at least one digit;
+// the characters collected this way must form a valid, finite number
+
+bool TextScanner::readDouble(double& v)
+{
+   if (!skipSpace())
+      return false;
+
+   const char *start = pos;
+
+   if (*pos == '+' || *pos == '-')
+      pos++;
+
+   bool foundMantissa = false, foundDec = false, foundSci = false;
+
+   while (pos != end)
+   {
+      char c = *pos;
+
+      if (c >= '0' && c <= '9')
+      {
+         foundMantissa = true;
+         pos++;
+      }
+      else if (c == '.' && !foundDec && !foundSci)
+      {
+         foundDec = true;
+         pos++;
+      }
+      else if ((c == 'e' || c == 'E') && !foundSci && foundMantissa)
+      {
+         foundSci = true;
+
+         if (++pos != end && (*pos == '+' || *pos == '-'))
+            pos++;
+      }
+      else
+         break;
+   }
+
+   if (pos == end)
+      eof = true;
+
+   // strtod needs a terminated string; numbers are short, so use a local buffer
+
+   char buffer[64];
+   std::string longToken;
+
+   const char *token = buffer;
+   int len = pos - start;
+
+   if (len < (int) sizeof(buffer))
+   {
+      std::memcpy(buffer, start, len);
+      buffer[len] = '\0';
+   }
+   else
+   {
+      longToken.assign(start, pos);
+      token = longToken.c_str();
+   }
+
+   char *sanity;
+   v = std::strtod(token, &sanity);
+
+   if (sanity == token || *sanity != '\0' ||
+       v ==  std::numeric_limits<double>::infinity() ||
+       v == -std::numeric_limits<double>::infinity())
+   {
+      fail = true;
+      return false;
+   }
+
+   return true;
+}
+
+//------------------------------------------------------------------------------------
+
+bool TextScanner::readWord(std::string& s)
+{
+   s.clear();
+
+   if (!skipSpace())
+      return false;
+
+   const char *start = pos;
+
+   while (pos != end && !isSpace(*pos))
+      pos++;
+
+   if (pos == end)
+      eof = true;
+
+   s.assign(start, pos);
+
+   return true;
+}
+
+//------------------------------------------------------------------------------------
+
+static void dataError(int lineno)
+{
+   std::ostringstream s;
+   s << "Could not read data at line no: " << lineno;
+   std::cout << s.str() << std::endl;
+   throw s.str();
+}
+
+//------------------------------------------------------------------------------------
+// readValues() reads the expression values (and p-values) of marker proben from the
+// rest of a line; see readMarkerNoPvalue() and readMarkerWithPvalue()
+
+static int readValues(Microarray_Set& data, TextScanner& in, int proben,
+                      bool withPvalue)
+{
+   int markern = 0; // number of expression values of each probe
+
+   do
+   {
+      double val, pval = 0.0;
+
+      bool ok = in.readDouble(val);
+
+      if (ok && withPvalue)
+      {
+         std::string sPVal;
+         ok = in.readWord(sPVal);
+
+         if (ok)
+            switch (sPVal[0])
+            {
+               case 'A': pval = 0.7; break;
+               case 'M': pval = 0.5; break;
+               case 'P': pval = 0.1; break;
+               default : pval = std::atof(sPVal.c_str());
+            }
+      }
+
+      if (!ok)
+         dataError(withPvalue ? proben + 2 : proben);
+
+      data.Set_Probe(markern++, proben, Probe(val, pval));
+
+      if (!in.good())
+         break;
+
+      int c = in.get();
+
+      if (c == EOF)
+         dataError(withPvalue ? proben + 2 : proben);
+
+      if (c == '\015')
+         break;
+   }
+   while (in.peek() != EOF && in.peek() != '\015');
+
+   return markern;
+}
+
+//------------------------------------------------------------------------------------
+
+void Microarray_Set::read(const std::string& filename, const std::string& cachefile)
+{
+   MappedFile in;
+   if (!in.open(filename))
+      throw "Unable to open " + filename;
+
+   unsigned long long hash = 0;
+
+   if (cachefile != "")
+   {
+      hash = hashBytes(in.begin(), in.size);
+
+      if (readCache(cachefile, in.size, in.mtime, hash))
+      {
+         std::cout << "\n[READ] Dataset loaded from cache " << cachefile << std::endl;
+         indexMarkers();
+         return;
+      }
+   }
+
+   read(in.begin(), in.end());
+
+   if (cachefile != "")
+   {
+      writeCache(cachefile, in.size, in.mtime, hash);
+      std::cout << "[READ] Dataset cached in " << cachefile << std::endl;
+   }
+}
+
+//------------------------------------------------------------------------------------
+
+void Microarray_Set::read(std::istream& in)
+{
+   std::string text((std::istreambuf_iterator<char>(in)),
+                    std::istreambuf_iterator<char>());
+
+   read(text.data(), text.data() + text.size());
+}
+
+//------------------------------------------------------------------------------------
+// read() parses a whole dataset held in memory; the format is described above
+// readMarkerWithPvalue() in matrix.cpp
+
+void Microarray_Set::read(const char *begin, const char *end)
+{
+   const std::string readError("Could not read data.(Last line empty?)");
+
+   TextScanner in(begin, end);
+
+   const char *lb, *le;
+
+   if (!in.getline(lb, le, '\n'))
+      throw readError;
+
+   // header
+
+   TextScanner hin(lb, le);
+
+   do
+   {
+      std::string hdr;
+
+      if (!hin.getline(hdr, '\t'))
+         throw std::string("Error while reading file headers"
+                           "(win/*nux/mac end of line?).");
+
+      Set_ColHeader(header.size(), hdr);
+   }
+   while (hin.good() && hin.peek() != '\015' && hin.peek() != EOF);
+
+   int arrno = header.size() - 2;
+
+   // size the storage from the header and the number of lines
+
+   int numLines = std::count(begin, end, '\n') + 1;
+
+   Set_Num_Microarrays(std::max(arrno, 0));
+   markerset.reserve(numLines);
+   values.reserve((size_t) numLines * std::max(arrno, 0));
+
+   int bypass_line_cnt = 0;
+
+   if (!in.getline(lb, le, '\n'))
+      throw readError;
+
+   while (le - lb >= 11 && std::string(lb, 11) == "Description")
+   {
+      bypass_line_cnt++;
+
+      if (!in.getline(lb, le, '\n'))
+         throw readError;
+   }
+
+   std::cout << "\n[READ] " << bypass_line_cnt
+             << " Description lines bypassed." << std::endl;
+
+   // we need to decide whether the input file contain only expression
+   // or (value, pvalue) pairs
+
+   int numTokens = 0;
+
+   TextScanner pin(lb, le);
+
+   do
+   {
+      const char *tb, *te;
+      pin.getline(tb, te, '\t');
+      numTokens++;
+   }
+   while (pin.good() && pin.peek() != '\015' && pin.peek() != EOF);
+
+   int valueNo = numTokens - 2;
+
+   bool withPvalue;
+
+   if (arrno == valueNo)
+   {
+      std::cout << "[READ] P-value columns not found." << std::endl;
+      withPvalue = false;
+   }
+   else if (2 * arrno == valueNo)
+   {
+      std::cout << "[READ] (value, p-value) pairs found." << std::endl;
+      withPvalue = true;
+   }
+   else
+      throw std::string("Incorrect file format: header line doesn't match the "
+                        "rest of the data.");
+
+   int proben = 0; // probe number
+
+   while (true)
+   {
+      TextScanner sin(lb, le);
+      std::string accnum, label;
+
+      bool ok = sin.getline(accnum, '\t');
+      ok = sin.getline(label, '\t') && ok;
+
+      if (!ok)
+         throw readError;
+
+      accnum = "_" + accnum;
+
+      Marker m(proben, accnum, label);
+      Set_Marker(proben, m);
+
+      int n = readValues(*this, sin, proben, withPvalue);
+
+      if (proben > 0 && n != arrno)
+      {
+         std::ostringstream s;
+         s << "Incorrect data format at line no: " << proben + 2;
+         throw s.str();
+      }
+
+      proben++;
+
+      if (!in.good() || in.peek() == EOF)
+         break;
+
+      in.getline(lb, le, '\n');
+   }
+
+   indexMarkers();
+}
+
+//------------------------------------------------------------------------------------
+// Binary cache of a parsed dataset. Layout (native byte order):
+//
+//    CacheHeader
+//    string table: the column headers, then accnum and label of each marker, each
+//                  string as a 32-bit length followed by its characters
+//    padding to a multiple of 8 bytes
+//    values:  numMarkers * numArrays ExprValue, same layout as Microarray_Set::values
+//    pvalues: numMarkers * numArrays double, only if hasPvalues
+//
+// A cache is used only if it was written for the same source file (size,
+// modification time and hash) by a build storing values of the same size.
+//------------------------------------------------------------------------------------
+
+static const char CACHE_MAGIC[8] = { 'S', 'J', 'A', 'R', 'C', 'A', 'C', 'H' };
+static const unsigned int CACHE_VERSION = 1;
+
+struct CacheHeader
+{
+   char               magic[8];
+   unsigned int       version;
+   unsigned int       valueSize;   // sizeof(ExprValue)
+   unsigned long long sourceSize;
+   long long          sourceMtime;
+   unsigned long long sourceHash;
+   unsigned long long numMarkers;
+   unsigned long long numArrays;
+   unsigned long long numHeaders;
+   unsigned long long hasPvalues;
+   unsigned long long stringBytes; // size of the string table
+};
+
+//------------------------------------------------------------------------------------
+
+static bool readCacheString(const char *&pos, const char *end, std::string& s)
+{
+   unsigned int len;
+
+   if (end - pos < (long) sizeof(len))
+      return false;
+
+   std::memcpy(&len, pos, sizeof(len));
+   pos += sizeof(len);
+
+   if ((unsigned long) (end - pos) < len)
+      return false;
+
+   s.assign(pos, len);
+   pos += len;
+
+   return true;
+}
+
+static void writeCacheString(std::ostream& out, const std::string& s)
+{
+   unsigned int len = s.length();
+
+   out.write(reinterpret_cast<const char *>(&len), sizeof(len));
+   out.write(s.data(), len);
+}
+
+//------------------------------------------------------------------------------------
+
+bool Microarray_Set::readCache(const std::string& cachefile,
+                               unsigned long long sourceSize, long long sourceMtime,
+                               unsigned long long sourceHash)
+{
+   MappedFile cache;
+   if (!cache.open(cachefile) || cache.size < sizeof(CacheHeader))
+      return false;
+
+   CacheHeader h;
+   std::memcpy(&h, cache.begin(), sizeof(h));
+
+   if (std::memcmp(h.magic, CACHE_MAGIC, sizeof(CACHE_MAGIC)) != 0 ||
+       h.version != CACHE_VERSION || h.valueSize != sizeof(ExprValue) ||
+       h.sourceSize != sourceSize || h.sourceMtime != sourceMtime ||
+       h.sourceHash != sourceHash)
+      return false;
+
+   unsigned long long stringsEnd = sizeof(h) + h.stringBytes;
+   unsigned long long valuesPos  = (stringsEnd + 7) / 8 * 8;
+   unsigned long long numValues  = h.numMarkers * h.numArrays;
+   unsigned long long needed     = valuesPos + numValues * sizeof(ExprValue) +
+                                   (h.hasPvalues ? numValues * sizeof(double) : 0);
+
+   if (cache.size != needed)
+      return false;
+
+   const char *pos = cache.begin() + sizeof(h);
+   const char *end = cache.begin() + stringsEnd;
+
+   std::vector<std::string> newHeader(h.numHeaders);
+
+   for (unsigned long long i = 0; i < h.numHeaders; i++)
+      if (!readCacheString(pos, end, newHeader[i]))
+         return false;
+
+   Marker_Set newMarkerset;
+   newMarkerset.reserve(h.numMarkers);
+
+   for (unsigned long long i = 0; i < h.numMarkers; i++)
+   {
+      std::string accnum, label;
+
+      if (!readCacheString(pos, end, accnum) || !readCacheString(pos, end, label))
+         return false;
+
+      newMarkerset.push_back(Marker(i, accnum, label));
+   }
+
+   const ExprValue *v = reinterpret_cast<const ExprValue *>(cache.begin() + valuesPos);
+
+   header.swap(newHeader);
+   markerset.swap(newMarkerset);
+   numArrays = h.numArrays;
+   values.assign(v, v + numValues);
+
+   if (h.hasPvalues)
+   {
+      const double *pv = reinterpret_cast<const double *>(v + numValues);
+      pvalues.assign(pv, pv + numValues);
+   }
+   else
+      pvalues.clear();
+
+   return true;
+}
+
+//------------------------------------------------------------------------------------
+
+void Microarray_Set::writeCache(const std::string& cachefile,
+                                unsigned long long sourceSize, long long sourceMtime,
+                                unsigned long long sourceHash) const
+{
+   // the cache is written under a temporary name and then renamed, so that
+   // concurrent runs never see a partially written cache
+
+   std::ostringstream tmpname;
+   tmpname << cachefile << ".tmp" << ::getpid();
+
+   std::ofstream out(tmpname.str().c_str(), std::ios::binary);
+   if (!out.is_open())
+      throw "Unable to open " + tmpname.str();
+
+   std::ostringstream strings;
+
+   for (int i = 0; i < (int) header.size(); i++)
+      writeCacheString(strings, header[i]);
+
+   for (int i = 0; i < (int) markerset.size(); i++)
+   {
+      writeCacheString(strings, markerset[i].accnum);
+      writeCacheString(strings, markerset[i].label);
+   }
+
+   std::string table = strings.str();
+
+   CacheHeader h;
+   std::memcpy(h.magic, CACHE_MAGIC, sizeof(CACHE_MAGIC));
+   h.version     = CACHE_VERSION;
+   h.valueSize   = sizeof(ExprValue);
+   h.sourceSize  = sourceSize;
+   h.sourceMtime = sourceMtime;
+   h.sourceHash  = sourceHash;
+   h.numMarkers  = markerset.size();
+   h.numArrays   = numArrays;
+   h.numHeaders  = header.size();
+   h.hasPvalues  = !pvalues.empty();
+   h.stringBytes = table.size();
+
+   out.write(reinterpret_cast<const char *>(&h), sizeof(h));
+   out.write(table.data(), table.size());
+
+   const char padding[8] = { 0 };
+   out.write(padding, (8 - (sizeof(h) + table.size()) % 8) % 8);
+
+   // markers without values (e.g. a truncated last line) are stored as zeros
+
+   std::vector<ExprValue> v(values);
+   v.resize((size_t) markerset.size() * numArrays, 0.0);
+
+   if (!v.empty())
+      out.write(reinterpret_cast<const char *>(&v[0]), v.size() * sizeof(ExprValue));
+
+   if (!pvalues.empty())
+   {
+      std::vector<double> pv(pvalues);
+      pv.resize(v.size(), 0.0);
+
+      if (!pv.empty())
+         out.write(reinterpret_cast<const char *>(&pv[0]),
+                   pv.size() * sizeof(double));
+   }
+
+   out.close();
+
+   if (!out || std::rename(tmpname.str().c_str(), cachefile.c_str()) != 0)
+   {
+      std::remove(tmpname.str().c_str());
+      throw "Unable to write cache " + cachefile;
+   }
+}
+
+//------------------------------------------------------------------------------------
+// Network state of an incremental hub extension ('-I'): the rows of the hub genes
+// before DPI, with exact MI values and the DPI intermediates of each edge, which the
+// .adj file lacks. Layout (native byte order):
+//
+//    char[8]  magic "SJASTAT1"
+//    uint64   length of the signature, signature text
+//    double   DPI tolerance of the intermediates
+//    uint64   number of transcription factors T, int32 gene ids [T]
+//    uint64   number of rows R, then for each row:
+//       int32   gene id
+//       uint64  number of edges E
+//       int32   neighbor ids [E], double MI values [E], int32 intermediates [E]
+//
+// The signature describes the inputs and options the rows were computed with (see
+// stateSignature() in main.cpp); a state of another signature is not read.
+//------------------------------------------------------------------------------------
+
+static const char STATE_MAGIC[8] = { 'S', 'J', 'A', 'S', 'T', 'A', 'T', '1' };
+
+template <class T>
+static void writeStateArray(std::ostream& out, const T *p, unsigned long long n)
+{
+   if (n > 0)
+      out.write(reinterpret_cast<const char *>(p), n * sizeof(T));
+}
+
+template <class T>
+static void readStateArray(std::istream& in, T *p, unsigned long long n,
+                           const std::string& filename)
+{
+   if (n > 0)
+      in.read(reinterpret_cast<char *>(p), n * sizeof(T));
+
+   if (!in)
+      throw "Invalid network state file " + filename;
+}
+
+//------------------------------------------------------------------------------------
+
+void Matrix::writeState(const std::string& filename, const std::string& signature,
+                        double epsilon, const std::vector<int>& rows,
+                        const Transfac& transfac) const
+{
+   // the matrix must be frozen; the state is written under a temporary name and then
+   // renamed, so that a run never reads a partially written state
+
+   std::ostringstream tmpname;
+   tmpname << filename << ".tmp" << ::getpid();
+
+   std::ofstream out(tmpname.str().c_str(), std::ios::binary);
+   if (!out.is_open())
+      throw "Unable to open " + tmpname.str();
+
+   unsigned long long length = signature.length();
+
+   out.write(STATE_MAGIC, sizeof(STATE_MAGIC));
+   writeStateArray(out, &length, 1);
+   out.write(signature.data(), length);
+   writeStateArray(out, &epsilon, 1);
+
+   std::vector<int> tfs;
+
+   for (Transfac::const_iterator tpos = transfac.begin(); tpos != transfac.end(); ++tpos)
+      tfs.push_back(tpos->first);
+
+   unsigned long long numTFs = tfs.size(), numStored = rows.size();
+
+   writeStateArray(out, &numTFs, 1);
+   writeStateArray(out, tfs.data(), numTFs);
+   writeStateArray(out, &numStored, 1);
+
+   for (int i = 0; i < (int) rows.size(); i++)
+   {
+      int row = rows[i];
+      long long first = (row < numRows() ? rowStart[row] : 0);
+      unsigned long long n = (row < numRows() ? rowSize(row) : 0);
+
+      writeStateArray(out, &row, 1);
+      writeStateArray(out, &n, 1);
+      writeStateArray(out, neighbor.data() + first, n);
+      writeStateArray(out, mutinfo.data() + first, n);
+      writeStateArray(out, intermediate.data() + first, n);
+   }
+
+   out.close();
+
+   if (!out || std::rename(tmpname.str().c_str(), filename.c_str()) != 0)
+   {
+      std::remove(tmpname.str().c_str());
+      throw "Unable to write network state " + filename;
+   }
+}
+
+//------------------------------------------------------------------------------------
+
+bool Matrix::readState(const std::string& filename, const std::string& signature,
+                       double& epsilon, std::vector<int>& rows, std::vector<int>& tfs)
+{
+   // returns false, leaving the matrix empty, if there is no state file or if it was
+   // written under another signature; otherwise the matrix holds the rows of the
+   // state, frozen, with their intermediates
+
+   std::ifstream in(filename.c_str(), std::ios::binary);
+   if (!in.is_open())
+      return false;
+
+   char magic[sizeof(STATE_MAGIC)];
+   unsigned long long length = 0;
+
+   in.read(magic, sizeof(magic));
+   readStateArray(in, &length, 1, filename);
+
+   if (std::memcmp(magic, STATE_MAGIC, sizeof(STATE_MAGIC)) != 0)
+      throw "Invalid network state file " + filename;
+
+   if (length != signature.length())
+      return false;
+
+   std::string stored(length, '\0');
+   readStateArray(in, &stored[0], length, filename);
+
+   if (stored != signature)
+      return false;
+
+   unsigned long long numTFs, numStored;
+
+   readStateArray(in, &epsilon, 1, filename);
+   readStateArray(in, &numTFs, 1, filename);
+   tfs.resize(numTFs);
+   readStateArray(in, tfs.data(), numTFs, filename);
+   readStateArray(in, &numStored, 1, filename);
+
+   rows.clear();
+   thaw();
+   NodeMapVector().swap(nmv);
+
+   std::vector<int> ids;
+   std::vector<double> mis;
+   std::vector<int> intermediates;
+
+   for (unsigned long long i = 0; i < numStored; i++)
+   {
+      int row;
+      unsigned long long n;
+
+      readStateArray(in, &row, 1, filename);
+      readStateArray(in, &n, 1, filename);
+
+      if (row < 0)
+         throw "Invalid network state file " + filename;
+
+      ids.resize(n);
+      mis.resize(n);
+      intermediates.resize(n);
+
+      readStateArray(in, ids.data(), n, filename);
+      readStateArray(in, mis.data(), n, filename);
+      readStateArray(in, intermediates.data(), n, filename);
+
+      if (row >= (int) nmv.size())
+         nmv.resize(row + 1);
+
+      for (unsigned long long e = 0; e < n; e++)
+      {
+         Node node(mis[e]);
+         node.intermediate = intermediates[e];
+
+         nmv[row].insert(nmv[row].end(), std::make_pair(ids[e], node));
+      }
+
+      rows.push_back(row);
+   }
+
+   freeze();
+
+   return true;
+}
+
+//------------------------------------------------------------------------------------
+// Matrix::read() loads an adjacency (.adj) file written by Matrix::write(), keeping
+// the edges whose mutual information is at least p.threshold. Every line is a hub
+// followed by (target, MI) pairs, all tab-separated; leading lines starting with '>'
+// are comments. As with the original istream reader, a last line that is not ended
+// by a newline is ignored.
+//------------------------------------------------------------------------------------
+
+void Matrix::read(Microarray_Set& data, const Parameter& p)
+{
+   MappedFile in;
+   if (!in.open(p.adjfile))
+      throw "Unable to open " + p.adjfile;
+
+   read(in.begin(), in.end(), data, p);
+}
+
+//------------------------------------------------------------------------------------
+
+void Matrix::read(std::istream& in, Microarray_Set& data, const Parameter& p)
+{
+   std::string text((std::istreambuf_iterator<char>(in)),
+                    std::istreambuf_iterator<char>());
+
+   read(text.data(), text.data() + text.size(), data, p);
+}
+
+//------------------------------------------------------------------------------------
+
+void Matrix::read(const char *begin, const char *end, Microarray_Set& data,
+                  const Parameter& p)
+{
+   thaw();
+
+   TextScanner in(begin, end);
+
+   const char *lb, *le;
+
+   in.getline(lb, le, '\n');
+   while (le > lb && *lb == '>')
+      in.getline(lb, le, '\n');
+
+   std::string label, value;
+
+   while (in.good())
+   {
+      TextScanner sin(lb, le);
+
+      sin.getline(value, '\t');
+      label = "_" + value;
+
+      int geneId1 = data.getProbeId(label);
+      if (geneId1 == -1)
+         throw "Cannot find marker: " + label + " in the ADJ file!";
+
+      data.markerset[geneId1].isActive = true;
+
+      while (nmv.size() <= geneId1)
+         nmv.push_back(NodeMap());
+
+      sin.getline(value, '\t');
+      label = "_" + value;
+
+      while (sin.good())
+      {
+         sin.getline(value, '\t');
+
+         double mi = std::atof(value.c_str());
+
+         if (mi >= p.threshold)
+         {
+            int geneId2 = data.getProbeId(label);
+            if (geneId2 == -1)
+               throw "Cannot find marker: " + label + " in the ADJ file!";
+
+            while (nmv.size() <= geneId2)
+               nmv.push_back(NodeMap());
+
+            saveNode(geneId1, geneId2, mi);
+         }
+
+         sin.getline(value, '\t');
+         label = "_" + value;
+      }
+
+      in.getline(lb, le, '\n');
+   }
+
+   freeze();
+}
@@ -0,0 +1,80 @@
+//------------------------------------------------------------------------------------
+// C interface of the SJARACNe engine, exported by libsjaracne.so (make lib) and used
+// by SJARACNe/engine.py through ctypes
+//------------------------------------------------------------------------------------
+
+#ifndef SJARACNE_H__
+#define SJARACNE_H__
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+typedef struct SJARACNeNetwork SJARACNeNetwork; // edges of a network built in memory
+
+// size in bytes of an expression value: 8 (double), or 4 (float) if the library was
+// built with make FLOAT_VALUES=1
+int sjaracne_value_size(void);
+
+// MI threshold for a p-value and a number of arrays, from config_threshold.txt of
+// homeDir (see '-p'); returns -1 and sets error if the file cannot be read
+double sjaracne_find_threshold(const char *homeDir, double pvalue, int numArrays,
+                               char *error, int errorSize);
+
+// builds one network, as sjaracne.exe does for the same parameters. values holds
+// numMarkers rows of numArrays expression values (row-major, one row per marker) and
+// is only read; accnums and labels are the ids and symbols of the markers; hubIds
+// and tfIds are marker indices (see '-s' and '-l'), numHubs = 0 computes all genes;
+// bootstrap != 0 resamples the arrays (see '-r'). Returns NULL and sets error on
+// failure; the network must be released with sjaracne_free_network().
+SJARACNeNetwork *sjaracne_build_network(const void *values, int numMarkers,
+                                        int numArrays, const char **accnums,
+                                        const char **labels, const int *hubIds,
+                                        int numHubs, const int *tfIds, int numTFs,
+                                        double threshold, double eps, int bootstrap,
+                                        int seed, double correction, int nparLimit,
+                                        int numThreads, char *error, int errorSize);
+
+// number of edges, and a copy of them into arrays of that size: hub and target
+// marker indices, and the MI of each edge, in the order of the .adj output
+long long sjaracne_num_edges(const SJARACNeNetwork *network);
+void sjaracne_get_edges(const SJARACNeNetwork *network, int *hubs, int *targets,
+                        double *mis);
+
+// wall time and CPU time in seconds, and peak resident memory in bytes at its end,
+// of a phase: computing MI (0, createEdgeMatrix()), applying DPI (1,
+// Matrix::reduce()) or writing the network (2, sjaracne_write_network()); zeros if
+// the phase has not run
+void sjaracne_phase_stats(const SJARACNeNetwork *network, int phase, double *wall,
+                          double *cpu, long long *peakRss);
+
+// writes the network to a text .adj file, after the header lines ('>' lines);
+// returns -1 and sets error on failure
+int sjaracne_write_network(SJARACNeNetwork *network, const char *header,
+                           const char *filename, char *error, int errorSize);
+
+void sjaracne_free_network(SJARACNeNetwork *network);
+
+// MI of the marker pairs (x[k], y[k]), k = 0 .. numPairs-1, as computed by the
+// adaptive partitioning kernel with no threshold; values is laid out as in
+// sjaracne_build_network(); returns -1 and sets error on failure
+int sjaracne_pairwise_mi(const void *values, int numMarkers, int numArrays,
+                         const int *x, const int *y, long long numPairs, int nparLimit,
+                         double *mis, char *error, int errorSize);
+
+// null MI of the marker pairs (x[k], y[k]), as used to calibrate config_threshold.txt
+// (see SJARACNe/calibration.py): each pair is computed on numSamples arrays drawn at
+// random, resampled with replacement if bootstrap != 0 (see '-r'), with the values of
+// y[k] permuted among them and the noise of sjaracne.exe added to both; the draws are
+// determined by seed and k. Runs on numThreads threads; returns -1 and sets error on
+// failure
+int sjaracne_null_mi(const void *values, int numMarkers, int numArrays, const int *x,
+                     const int *y, long long numPairs, int numSamples, int bootstrap,
+                     int seed, int nparLimit, int numThreads, double *mis, char *error,
+                     int errorSize);
+
+#ifdef __cplusplus
+}
+#endif
+
+#endif
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import time
+import argparse
+import logging
+import numpy as np
+from benchmarks.synthetic import generate_expression
+
+
+def main():
+    """ Handles arguments and invokes the driver function. """
+    head_description = '''Measure the pairs per second of the adaptive partitioning MI kernel (SJARACNe.engine.pairwise_mi)
+on synthetic data, for each number of samples. Use --save and --check to confirm that a change of the kernel leaves
+every MI value bit-identical.'''
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     description=head_description)
+    parser.add_argument('-g', '--genes', metavar='INT', type=int, default=500, help='number of genes')
+    parser.add_argument('-s', '--samples', metavar='LIST', default='100,200,500,1000',
+                        help='comma separated numbers of samples')
+    parser.add_argument('--pairs', metavar='INT', type=int, default=200000, help='number of gene pairs')
+    parser.add_argument('-N', '--npar-limit', metavar='INT', type=int, default=40,
+                        help='maximum allowed value of npar')
+    parser.add_argument('-r', '--repeat', metavar='INT', type=int, default=3, help='runs; the fastest is reported')
+    parser.add_argument('--seed', metavar='INT', type=int, default=1, help='seed of the synthetic data')
+    parser.add_argument('--save', metavar='FILE', help='save the MI values to this .npz file')
+    parser.add_argument('--check', metavar='FILE', help='compare the MI values with a file written by --save')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    mis = {}
+    for samples in [int(x) for x in args.samples.split(',')]:
+        rate, mis['s{}'.format(samples)] = kernel_rate(args.genes, samples, args.pairs, args.npar_limit,
+                                                        args.repeat, args.seed)
+        logging.info('{:6d} samples: {:12,.0f} pairs/s'.format(samples, rate))
+    if args.save:
+        np.savez(args.save, **mis)
+    if args.check:
+        expected = np.load(args.check)
+        for name, values in mis.items():
+            if not np.array_equal(expected[name].view(np.uint64), values.view(np.uint64)):
+                raise SystemExit('MI values differ from {} ({})'.format(args.check, name))
+        logging.info('MI values are identical to {}'.format(args.check))
+
+
+def kernel_rate(genes, samples, pairs, npar_limit=40, repeat=3, seed=1):
+    """ Time the MI kernel on random pairs of genes of a synthetic dataset
+    Args:
+        genes (int): number of genes
+        samples (int): number of samples
+        pairs (int): number of gene pairs
+        npar_limit (int): maximum allowed value of npar
+        repeat (int): number of runs
+        seed (int): seed of the data and of the pairs
+    Returns:
+        float: pairs per second of the fastest run
+        numpy.ndarray: MI of each pair
+    """
+    from SJARACNe import engine
+    values = generate_expression(genes, samples, genes // 10, seed=seed)[0]
+    rng = np.random.default_rng(seed)
+    x = rng.integers(genes, size=pairs)
+    y = rng.integers(genes, size=pairs)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        mis = engine.pairwise_mi(values, x, y, npar_limit)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return pairs / best, mis
+
+
+if __name__ == '__main__':
+    main()
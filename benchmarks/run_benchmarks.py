@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import argparse
+import logging
+import subprocess
+import tempfile
+import multiprocessing
+import numpy as np
+import pandas as pd
+from benchmarks.synthetic import generate_expression, write_dataset
+
+# Stages timed for every point of a sweep, in the order of the workflow
+STAGES = ['mi_kernel', 'create_edge_matrix', 'reduce', 'write_adj', 'create_consensus_network',
+          'create_enhanced_consensus_network']
+
+# Engine phases reported by build_network(stats=...), see SJARACNe.engine.PHASES
+ENGINE_STAGES = {'mi': 'create_edge_matrix', 'dpi': 'reduce', 'write': 'write_adj'}
+
+
+def main():
+    """ Handles arguments and invokes the driver function. """
+    head_description = '''Time each stage of SJARACNe on synthetic data over sweeps of genes, samples and threads.
+
+The first value of each list is the base point; each other value is run with the base values of the other
+dimensions. Every stage runs in a fresh process, so that its peak memory is its own (the MI,
+DPI and writing phases of the engine share one). Build the engine first
+(make in SJARACNe/).
+
+Example:
+    python -m benchmarks.run_benchmarks --genes 1000,2000,4000 --samples 100,200 --threads 1,2,4 -o results.json
+    python -m benchmarks.run_benchmarks -o new.json --compare results.json'''
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     description=head_description)
+    parser.add_argument('-g', '--genes', metavar='LIST', default='1000', help='comma separated numbers of genes')
+    parser.add_argument('-s', '--samples', metavar='LIST', default='100', help='comma separated numbers of samples')
+    parser.add_argument('-T', '--threads', metavar='LIST', default='1', help='comma separated numbers of threads')
+    parser.add_argument('--hubs', metavar='INT', type=int, default=50, help='number of hub genes')
+    parser.add_argument('-b', '--bootstraps', metavar='INT', type=int, default=4,
+                        help='number of bootstrap networks given to create_consensus_network')
+    parser.add_argument('--pairs', metavar='INT', type=int, default=100000,
+                        help='number of gene pairs given to the MI kernel')
+    parser.add_argument('-p', '--p-value', metavar='FLOAT', type=float, default=1e-7,
+                        help='p-value of the MI threshold of the networks')
+    parser.add_argument('-r', '--repeat', metavar='INT', type=int, default=3,
+                        help='runs of each stage; the median is reported')
+    parser.add_argument('--seed', metavar='INT', type=int, default=1, help='seed of the synthetic data')
+    parser.add_argument('-o', '--output', metavar='FILE', required=True, help='JSON file receiving the results')
+    parser.add_argument('--compare', metavar='FILE', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', metavar='FLOAT', type=float, default=0.2,
+                        help='relative increase of the wall time counted as a regression')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    config = {'genes': parse_list(args.genes), 'samples': parse_list(args.samples),
+              'threads': parse_list(args.threads), 'hubs': args.hubs, 'bootstraps': args.bootstraps,
+              'pairs': args.pairs, 'p_value': args.p_value, 'repeat': args.repeat, 'seed': args.seed}
+    results = {'environment': environment(), 'config': config, 'results': run_sweep(config)}
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    logging.info('Results written to {}'.format(args.output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_results(json.load(f), results, args.tolerance)
+        for r in regressions:
+            logging.warning('{stage} at genes={genes} samples={samples} threads={threads}: '
+                            '{baseline:.3f}s -> {wall_seconds:.3f}s'.format(**r))
+        if regressions:
+            sys.exit(1)
+        logging.info('No regression over {:.0%}'.format(args.tolerance))
+
+
+def parse_list(text):
+    """ Args:
+        text (str): comma separated integers
+    Returns:
+        list: the integers
+    """
+    return [int(x) for x in text.split(',') if x.strip()]
+
+
+def sweep_points(genes, samples, threads):
+    """ Points of a one-at-a-time sweep: the base point (first value of each list), then each other value of
+    one dimension with the base values of the others.
+    Args:
+        genes (list): numbers of genes
+        samples (list): numbers of samples
+        threads (list): numbers of threads
+    Returns:
+        list: dicts of genes, samples and threads
+    """
+    base = {'genes': genes[0], 'samples': samples[0], 'threads': threads[0]}
+    points = [base]
+    for name, values in (('genes', genes), ('samples', samples), ('threads', threads)):
+        for value in values[1:]:
+            point = dict(base, **{name: value})
+            if point not in points:
+                points.append(point)
+    return points
+
+
+def run_sweep(config):
+    """ Run every stage at every point of the sweep.
+    Args:
+        config (dict): sweep configuration, see main()
+    Returns:
+        list: one dict per point and stage, with the point, the stage, its median wall_seconds, cpu_seconds
+        and peak_rss_bytes, the wall time of every run, and its counters
+    """
+    context = multiprocessing.get_context('spawn')
+    results = []
+    with tempfile.TemporaryDirectory(prefix='sjaracne_bench_') as work_dir:
+        datasets = {}
+        for point in sweep_points(config['genes'], config['samples'], config['threads']):
+            shape = (point['genes'], point['samples'])
+            if shape not in datasets:
+                data_dir = os.path.join(work_dir, 'g{}_s{}'.format(*shape))
+                data = generate_expression(shape[0], shape[1], min(config['hubs'], shape[0]), seed=config['seed'])
+                datasets[shape] = write_dataset(data_dir, *data) + (data_dir,)
+                run_in_child(context, prepare_bootstraps, datasets[shape], config)
+            task = dict(config, **point)
+            task['exp_file'], task['hub_file'], task['data_dir'] = datasets[shape]
+            logging.info('genes={genes} samples={samples} threads={threads}'.format(**point))
+
+            runs = []
+            for _ in range(config['repeat']):
+                task['out_dir'] = tempfile.mkdtemp(dir=task['data_dir'])
+                runs.append({})
+                for runner in STAGE_RUNNERS:
+                    runs[-1].update(run_in_child(context, runner, task))
+            for stage in STAGES:
+                stats = [r[stage] for r in runs]
+                result = dict(point, stage=stage, runs=[s['wall_seconds'] for s in stats],
+                              counters=stats[0]['counters'])
+                for key in ('wall_seconds', 'cpu_seconds', 'peak_rss_bytes'):
+                    result[key] = float(np.median([s[key] for s in stats]))
+                results.append(result)
+                logging.info('  {:34s} {:8.3f}s wall {:8.3f}s cpu {:8.1f} MB'.format(
+                    stage, result['wall_seconds'], result['cpu_seconds'], result['peak_rss_bytes'] / 2 ** 20))
+    return results
+
+
+def run_in_child(context, function, *args):
+    """ Call a function in a fresh process and return its result. The process is not a daemon, since
+    create_consensus_network starts its own worker processes.
+    """
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=child_main, args=(sender, function, args))
+    process.start()
+    sender.close()
+    try:
+        error, result = receiver.recv()
+    except EOFError:
+        error, result = 'no result', None
+    process.join()
+    if process.exitcode:
+        error = error or 'exited with code {}'.format(process.exitcode)
+    if error:
+        raise RuntimeError('{} failed: {}'.format(function.__name__, error))
+    return result
+
+
+def child_main(sender, function, args):
+    """ Entry point of the processes of run_in_child(). """
+    try:
+        sender.send((None, function(*args)))
+    except Exception as e:
+        sender.send(('{}: {}'.format(type(e).__name__, e), None))
+
+
+def measure(function, *args, **kwargs):
+    """ Call a function and measure it.
+    Returns:
+        result: what the function returned
+        dict: wall_seconds, cpu_seconds of the process (all threads) and peak_rss_bytes of the process
+    """
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = function(*args, **kwargs)
+    return result, {'wall_seconds': time.perf_counter() - wall, 'cpu_seconds': time.process_time() - cpu,
+                    'peak_rss_bytes': peak_rss_bytes()}
+
+
+def peak_rss_bytes():
+    """ Returns:
+        int: peak resident memory of the process in bytes
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def read_expression(exp_file):
+    """ Returns:
+        numpy.ndarray: expression values of an expression file
+        list: gene ids
+        list: gene symbols
+    """
+    frame = pd.read_csv(exp_file, sep='\t')
+    return frame.iloc[:, 2:].values, list(frame.iloc[:, 0]), list(frame.iloc[:, 1])
+
+
+def prepare_bootstraps(dataset, config):
+    """ Write the bootstrap networks of a dataset, the input of create_consensus_network; runs in a child process.
+    Args:
+        dataset (tuple): exp_file, hub_file and data_dir of the dataset
+        config (dict): sweep configuration
+    """
+    from SJARACNe import engine
+    exp_file, hub_file, data_dir = dataset
+    values, gene_ids, gene_symbols = read_expression(exp_file)
+    with open(hub_file) as f:
+        hubs = f.read().split()
+    adj_dir = os.path.join(data_dir, 'bootstrap')
+    os.makedirs(adj_dir, exist_ok=True)
+    for seed in range(1, config['bootstraps'] + 1):
+        engine.build_network(values, gene_ids, gene_symbols, hubs=hubs, tfs=hubs, p_value=config['p_value'],
+                             eps=0.0, bootstrap=True, seed=seed,
+                             out_file=os.path.join(adj_dir, 'TF_run_{:03d}.adj'.format(seed)))
+
+
+def run_mi_kernel(task):
+    """ Time the MI kernel on random gene pairs; runs in a child process.
+    Args:
+        task (dict): sweep configuration and point, with the files of its dataset
+    Returns:
+        dict: for each stage, its wall_seconds, cpu_seconds, peak_rss_bytes and counters
+    """
+    from SJARACNe import engine
+    values, gene_ids, _ = read_expression(task['exp_file'])
+    rng = np.random.default_rng(task['seed'])
+    x = rng.integers(len(gene_ids), size=task['pairs'])
+    y = rng.integers(len(gene_ids), size=task['pairs'])
+    _, stats = measure(engine.pairwise_mi, values, x, y)
+    return {'mi_kernel': dict(stats, counters={'pairs': task['pairs']})}
+
+
+def run_engine(task):
+    """ Build the network of a dataset and report the phases of the engine; runs in a child process. """
+    from SJARACNe import engine
+    values, gene_ids, gene_symbols = read_expression(task['exp_file'])
+    with open(task['hub_file']) as f:
+        hubs = f.read().split()
+    phases = {}
+    network = engine.build_network(values, gene_ids, gene_symbols, hubs=hubs, tfs=hubs, p_value=task['p_value'],
+                                   eps=0.0, threads=task['threads'],
+                                   out_file=os.path.join(task['out_dir'], 'network.adj'), stats=phases)
+    counters = {'hubs': len(hubs), 'edges': len(network[2])}
+    return {stage: dict(phases[phase], counters=counters) for phase, stage in ENGINE_STAGES.items()}
+
+
+def run_consensus(task):
+    """ Time create_consensus_network on the bootstrap networks of a dataset; runs in a child process. """
+    from SJARACNe.bin.create_consensus_network import create_consensus_network
+    consensus, stats = measure(create_consensus_network, os.path.join(task['data_dir'], 'bootstrap'), 0.05,
+                               task['out_dir'], task['threads'])
+    return {'create_consensus_network': dict(stats, counters={'networks': task['bootstraps'],
+                                                              'edges': count_edges(consensus)})}
+
+
+def run_enhanced_consensus(task):
+    """ Time create_enhanced_consensus_network on the output of run_consensus(); runs in a child process. """
+    from SJARACNe.bin.create_consensus_network import create_enhanced_consensus_network
+    consensus = os.path.join(task['out_dir'], 'consensus_network_3col_.txt')
+    _, stats = measure(create_enhanced_consensus_network, task['exp_file'], consensus, task['out_dir'])
+    return {'create_enhanced_consensus_network': dict(stats, counters={'edges': count_edges(consensus)})}
+
+
+def count_edges(network):
+    """ Returns:
+        int: number of edges of a consensus network file
+    """
+    with open(network) as f:
+        return sum(1 for _ in f) - 1
+
+
+# Child processes of one run of the stages, in order; run_enhanced_consensus reads the output of run_consensus
+STAGE_RUNNERS = [run_mi_kernel, run_engine, run_consensus, run_enhanced_consensus]
+
+
+def environment():
+    """ Returns:
+        dict: description of the machine and the software the benchmarks ran on
+    """
+    from SJARACNe import engine
+    root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=root, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+            'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'git_commit': commit, 'value_size': engine.value_dtype().itemsize,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def compare_results(baseline, results, tolerance):
+    """ Find the stages that got slower than in an earlier run.
+    Args:
+        baseline (dict): results of the earlier run
+        results (dict): results of this run
+        tolerance (float): relative increase of the wall time counted as a regression
+    Returns:
+        list: the results of this run slower than baseline, each with the wall time of the baseline
+    """
+    def key(r):
+        return r['stage'], r['genes'], r['samples'], r['threads']
+
+    earlier = {key(r): r['wall_seconds'] for r in baseline['results']}
+    return [dict(r, baseline=earlier[key(r)]) for r in results['results']
+            if key(r) in earlier and r['wall_seconds'] > earlier[key(r)] * (1 + tolerance)]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+import os
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+
+# Functions relating a target gene to its regulator in the planted network; the nonlinear ones are found by mutual
+# information but not by correlation
+LINKS = {
+    'linear': lambda x: x,
+    'tanh': lambda x: np.tanh(2 * x),
+    'square': lambda x: x * x - 1,
+}
+
+
+def main():
+    """ Handles arguments and invokes the driver function. """
+    head_description = '''Generate a synthetic expression matrix with a planted regulatory network.'''
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     description=head_description)
+    parser.add_argument('-g', '--genes', metavar='INT', type=int, default=2000, help='number of genes')
+    parser.add_argument('-s', '--samples', metavar='INT', type=int, default=200, help='number of samples')
+    parser.add_argument('--hubs', metavar='INT', type=int, default=100, help='number of hub genes')
+    parser.add_argument('-t', '--targets-per-hub', metavar='INT', type=int, default=10,
+                        help='number of genes regulated by each hub gene')
+    parser.add_argument('-c', '--cascade', metavar='FLOAT', type=float, default=0.2,
+                        help='fraction of targets regulated by another target of the same hub rather than by the '
+                             'hub itself; these give the indirect edges removed by DPI')
+    parser.add_argument('-n', '--noise', metavar='FLOAT', type=float, default=0.5,
+                        help='standard deviation of the noise added to each regulated gene')
+    parser.add_argument('--seed', metavar='INT', type=int, default=1, help='seed of the random number generator')
+    parser.add_argument('-o', '--out-dir', metavar='DIR', required=True,
+                        help='output directory, receives synthetic.exp, hubs.txt and truth.txt')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    data = generate_expression(args.genes, args.samples, args.hubs, args.targets_per_hub, args.cascade, args.noise,
+                               args.seed)
+    write_dataset(args.out_dir, *data)
+    logging.info('{} genes, {} samples, {} hubs, {} planted edges written to {}'.format(
+        args.genes, args.samples, args.hubs, len(data[4]), args.out_dir))
+
+
+def generate_expression(genes, samples, hubs, targets_per_hub=10, cascade=0.2, noise=0.5, seed=1):
+    """ Generate expression values in which each of the first hubs genes regulates targets_per_hub other genes,
+    directly or through a chain of targets (see cascade); the remaining genes are independent noise. The same
+    arguments always give the same data.
+    Args:
+        genes (int): number of genes
+        samples (int): number of samples
+        hubs (int): number of hub genes
+        targets_per_hub (int): number of genes regulated by each hub gene, as long as there are genes left
+        cascade (float): probability that a target is regulated by an earlier target of its hub
+        noise (float): standard deviation of the noise added to each regulated gene
+        seed (int): seed of the random number generator
+    Returns:
+        values (numpy.ndarray): expression values, genes x samples
+        gene_ids (list): gene ids, G00001 ...
+        gene_symbols (list): gene symbols, SYM1 ...
+        hub_ids (list): ids of the hub genes
+        edges (list): planted edges (regulator id, target id, link function name)
+    """
+    if hubs > genes:
+        raise ValueError('more hubs ({}) than genes ({})'.format(hubs, genes))
+    rng = np.random.default_rng(seed)
+    values = rng.standard_normal((genes, samples))
+    width = len(str(genes))
+    gene_ids = ['G{:0{}d}'.format(i + 1, width) for i in range(genes)]
+    gene_symbols = ['SYM{}'.format(i + 1) for i in range(genes)]
+
+    links = sorted(LINKS)
+    edges = []
+    free = list(rng.permutation(np.arange(hubs, genes)))
+    for hub in range(hubs):
+        regulators = [hub]
+        for _ in range(min(targets_per_hub, len(free))):
+            target = int(free.pop())
+            regulator = regulators[rng.integers(1, len(regulators))] \
+                if len(regulators) > 1 and rng.random() < cascade else hub
+            link = links[rng.integers(len(links))]
+            signal = LINKS[link](values[regulator])
+            values[target] = (signal - signal.mean()) / (signal.std() or 1) + noise * rng.standard_normal(samples)
+            regulators.append(target)
+            edges.append((gene_ids[regulator], gene_ids[target], link))
+
+    # shift to the range of log2 expression values
+    return values + 8, gene_ids, gene_symbols, gene_ids[:hubs], edges
+
+
+def write_dataset(out_dir, values, gene_ids, gene_symbols, hub_ids, edges):
+    """ Write a generated dataset in the input formats of sjaracne
+    Args:
+        out_dir (str): output directory; receives synthetic.exp (expression matrix), hubs.txt (hub gene ids) and
+            truth.txt (planted edges)
+        values, gene_ids, gene_symbols, hub_ids, edges: see generate_expression()
+    Returns:
+        exp_file (str): path to the expression matrix
+        hub_file (str): path to the hub gene list
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    exp_file = os.path.join(out_dir, 'synthetic.exp')
+    hub_file = os.path.join(out_dir, 'hubs.txt')
+
+    frame = pd.DataFrame(values, columns=['S{}'.format(i + 1) for i in range(values.shape[1])])
+    frame.insert(0, 'geneSymbol', gene_symbols)
+    frame.insert(0, 'isoformId', gene_ids)
+    frame.to_csv(exp_file, sep='\t', index=False, float_format='%.5f')
+    with open(hub_file, 'w') as f:
+        f.writelines('{}\n'.format(g) for g in hub_ids)
+    with open(os.path.join(out_dir, 'truth.txt'), 'w') as f:
+        f.write('regulator\ttarget\tlink\n')
+        f.writelines('{}\t{}\t{}\n'.format(*edge) for edge in edges)
+    return exp_file, hub_file
+
+
+if __name__ == '__main__':
+    main()
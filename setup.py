@@ -30,7 +30,7 @@ setup(
         "cwltool >= 3.0.20201117141248",
     ],
     python_requires=">=3.7.6",
-    packages=find_packages(exclude=["contrib", "docs", "tests"]),
+    packages=find_packages(exclude=["contrib", "docs", "tests", "benchmarks"]),
     include_package_data=True,
     # test_suite="tests",
     entry_points={"console_scripts": ["sjaracne=SJARACNe.sjaracne:main"]},
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import unittest
+import os
+import tempfile
+from SJARACNe.bin import QC_input
+from SJARACNe.bin.QC_input import check_exp, prepare_exp, prepare_probe
+
+HEADER = b'isoformId\tgeneSymbol\tS1\tS2\n'
+LINES = [b'G%d\tSYM%d\t1.5\t%d.25\n' % (i, i, i) for i in range(200)]
+
+
+class TestPrepareInput(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.chunk_size = QC_input.CHUNK_SIZE
+        QC_input.CHUNK_SIZE = 64  # many chunks, so that line numbers are carried across them
+
+    def tearDown(self):
+        QC_input.CHUNK_SIZE = self.chunk_size
+        self.folder.cleanup()
+
+    def write(self, name, lines, ending=b'\n'):
+        path = os.path.join(self.folder.name, name)
+        with open(path, 'wb') as f:
+            f.write(b''.join(line.replace(b'\n', ending) for line in lines))
+        return path
+
+    def assertExits(self, message, function, *args):
+        with self.assertRaises(SystemExit) as err:
+            function(*args)
+        self.assertEqual(err.exception.code, message)
+
+    def test_errors_and_line_numbers(self):
+        for workers in (1, 2):
+            lines = [HEADER] + LINES
+            lines[150] = b'G\tSYM\t1.5\n'
+            self.assertExits('Error - number of entries per line is not consistent across file. See line 151',
+                             check_exp, self.write('entries.exp', lines, b'\r\n'), workers)
+            lines[120] = b'G\tSYM\t1 5\t2.0\n'
+            self.assertExits('Error - spaces are not allowed, only tabs can delimit input file. Space found in line '
+                             '121', check_exp, self.write('space.exp', lines, b'\r'), workers)
+            # accepted, as check_exp() always did
+            lines[80] = b'G\tSYM\t1.52.3\t2.0\n'
+            self.assertExits('Error - spaces are not allowed, only tabs can delimit input file. Space found in line '
+                             '121', check_exp, self.write('numeric.exp', lines), workers)
+        self.assertExits('Error - Improper header in input file: first two column names must be isoformId and '
+                         'geneSymbol respectively.', check_exp, self.write('header.exp', [b'id\tgeneSymbol\n']))
+
+    def test_line_endings(self):
+        unix = self.write('unix.exp', [HEADER] + LINES)
+        with open(unix, 'rb') as f:
+            expected = f.read()
+        self.assertEqual(prepare_exp(unix, os.path.join(self.folder.name, 'out.exp'), 2), unix)
+        for ending in (b'\r\n', b'\r'):
+            out = prepare_exp(self.write('in.exp', [HEADER] + LINES, ending), os.path.join(self.folder.name, 'out.exp'),
+                              2)
+            with open(out, 'rb') as f:
+                self.assertEqual(f.read(), expected)
+        in_place = self.write('in_place.exp', [HEADER] + LINES, b'\r\n')
+        self.assertEqual(prepare_exp(in_place), in_place)
+        with open(in_place, 'rb') as f:
+            self.assertEqual(f.read(), expected)
+        self.assertFalse(os.path.exists(in_place + '.tmp'))
+
+    def test_failed_conversion_leaves_no_output(self):
+        out = os.path.join(self.folder.name, 'out.exp')
+        with self.assertRaises(SystemExit):
+            prepare_exp(self.write('bad.exp', [HEADER] + LINES + [b'G\n'], b'\r\n'), out)
+        self.assertFalse(os.path.exists(out))
+
+    def test_prepare_probe(self):
+        probe = self.write('probe.txt', [b'G1\n', b'G2\n'], b'\r\n')
+        out = prepare_probe(probe, os.path.join(self.folder.name, 'out.txt'))
+        with open(out, 'rb') as f:
+            self.assertEqual(f.read(), b'G1\nG2\n')
+        self.assertExits('Error - There are more than one word per line in this probe file',
+                         prepare_probe, self.write('bad.txt', [b'G1 G2\n']))
+
+
+if __name__ == '__main__':
+    unittest.main()
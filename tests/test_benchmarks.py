@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+import unittest
+import os
+import tempfile
+import numpy as np
+from SJARACNe.bin.QC_input import check_exp, check_probe
+from benchmarks.synthetic import generate_expression, write_dataset
+from benchmarks.run_benchmarks import compare_results, sweep_points
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_generate_expression(self):
+        values, gene_ids, gene_symbols, hub_ids, edges = generate_expression(50, 20, 3, targets_per_hub=4)
+        self.assertEqual(values.shape, (50, 20))
+        self.assertEqual(hub_ids, ['G01', 'G02', 'G03'])
+        self.assertEqual(len(edges), 12)
+        self.assertTrue(np.array_equal(values, generate_expression(50, 20, 3, targets_per_hub=4)[0]))
+
+        with tempfile.TemporaryDirectory() as folder:
+            exp_file, hub_file = write_dataset(folder, values, gene_ids, gene_symbols, hub_ids, edges)
+            check_exp(exp_file)
+            check_probe(hub_file)
+            self.assertTrue(os.path.exists(os.path.join(folder, 'truth.txt')))
+
+    def test_sweep_points(self):
+        points = sweep_points([1000, 2000], [100], [1, 4])
+        self.assertEqual(points, [{'genes': 1000, 'samples': 100, 'threads': 1},
+                                  {'genes': 2000, 'samples': 100, 'threads': 1},
+                                  {'genes': 1000, 'samples': 100, 'threads': 4}])
+
+    def test_compare_results(self):
+        def results(*walls):
+            return {'results': [{'stage': stage, 'genes': 1000, 'samples': 100, 'threads': 1, 'wall_seconds': w}
+                                for stage, w in zip(('mi_kernel', 'reduce'), walls)]}
+        regressions = compare_results(results(1.0, 2.0), results(1.1, 3.0), 0.2)
+        self.assertEqual([(r['stage'], r['baseline']) for r in regressions], [('reduce', 2.0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import unittest
+import os
+import tempfile
+from unittest import mock
+import numpy as np
+import pandas as pd
+from SJARACNe import engine
+from SJARACNe.calibration import calibrate_threshold, fit_threshold_model, read_threshold_model, sample_sizes
+
+
+class TestCalibration(unittest.TestCase):
+    def test_fit_threshold_model(self):
+        # null MI whose tail follows the model exactly: P(MI >= t) = exp(alpha + (beta + gamma * n) * t)
+        alpha, beta, gamma = -1.0, -20.0, -0.5
+        rng = np.random.default_rng(1)
+        nulls = {}
+        for size in (50, 100):
+            mis = rng.exponential(-1.0 / (beta + gamma * size), 200000)
+            mis[rng.random(len(mis)) > np.exp(alpha)] = 0.0
+            nulls[size] = mis
+        fitted = fit_threshold_model(nulls)
+        self.assertTrue(np.allclose(fitted, (alpha, beta, gamma), rtol=0.1, atol=0.1), fitted)
+
+    def test_sample_sizes(self):
+        self.assertEqual(sample_sizes(100, 500), [50, 75, 100])
+        with self.assertRaisesRegex(ValueError, 'the dataset has 500'):
+            sample_sizes(600, 500)
+        with self.assertRaisesRegex(ValueError, 'too few samples'):
+            sample_sizes(2, 500)
+
+    @unittest.skipUnless(os.path.exists(engine.LIBRARY_PATH), 'libsjaracne.so is not built (make -C SJARACNe)')
+    def test_null_mi(self):
+        values = pd.read_csv('./tests/inputs/Tcell1170.exp', sep='\t').iloc[:, 2:].to_numpy(
+            dtype=engine.value_dtype())
+        x, y = np.arange(0, 600, 2), np.arange(1, 600, 2)
+        for bootstrap in (False, True):
+            mis = engine.null_mi(values, x, y, 200, bootstrap)
+            self.assertTrue(np.array_equal(mis, engine.null_mi(values, x, y, 200, bootstrap, threads=3)))
+            self.assertTrue(np.array_equal(mis[:100], engine.null_mi(values, x[:100], y[:100], 200, bootstrap)))
+            self.assertTrue(np.all(mis >= 0))
+        with self.assertRaisesRegex(RuntimeError, 'number of samples'):
+            engine.null_mi(values, x, y, 501)
+
+    @unittest.skipUnless(os.path.exists(engine.LIBRARY_PATH), 'libsjaracne.so is not built (make -C SJARACNe)')
+    def test_calibrate_and_cache(self):
+        with tempfile.TemporaryDirectory() as folder:
+            out_dir, cache_dir = os.path.join(folder, 'config'), os.path.join(folder, 'cache')
+            config_file, model = calibrate_threshold('./tests/inputs/Tcell1170.exp', out_dir, 200, pairs=500,
+                                                     permutations=4, threads=2, cache_dir=cache_dir)
+            self.assertEqual(read_threshold_model(config_file), model)
+            self.assertTrue(os.path.exists(os.path.join(out_dir, 'config_kernel.txt')))
+            # a stricter P-value, or fewer samples, takes a higher MI threshold
+            self.assertGreater(engine.mi_threshold(1e-7, 200, out_dir), engine.mi_threshold(1e-5, 200, out_dir))
+            self.assertGreater(engine.mi_threshold(1e-7, 100, out_dir), engine.mi_threshold(1e-7, 200, out_dir))
+
+            other_dir = os.path.join(folder, 'other')
+            with mock.patch.object(engine, 'null_mi', side_effect=AssertionError('not cached')):
+                self.assertEqual(calibrate_threshold('./tests/inputs/Tcell1170.exp', other_dir, 200, pairs=500,
+                                                     permutations=4, cache_dir=cache_dir)[1], model)
+            with open(config_file) as f, open(os.path.join(other_dir, 'config_threshold.txt')) as g:
+                self.assertEqual(f.read(), g.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
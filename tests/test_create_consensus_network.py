@@ -2,11 +2,19 @@
 
 import unittest
 import filecmp
+import os
+import struct
 import tempfile
 import sys
+import zlib
+import numpy as np
+from scipy import stats
 from SJARACNe.bin.create_consensus_network import create_consensus_network as cn
 from SJARACNe.bin.create_consensus_network import create_enhanced_consensus_network as ecn
 from SJARACNe.bin.create_consensus_network import uprob
+from SJARACNe.bin.create_consensus_network import read_binary_adjacency, restore_text_mi
+from SJARACNe.bin.create_consensus_network import fold_run, sorted_edge_order, ConsensusAccumulator
+from SJARACNe.bin.create_consensus_network import create_consensus_networks, create_enhanced_consensus_networks
 
 
 class TestConsensusNetwork(unittest.TestCase):
@@ -51,5 +59,221 @@ class TestConsensusNetwork(unittest.TestCase):
     def test_uprob_neg1(self):
         self.assertAlmostEqual(0.841344680778, uprob(-1))
 
+class TestEdgeAggregation(unittest.TestCase):
+    def test_uprob_array(self):
+        z = np.array([[100, 2, 0.5], [-1, 2, 1.9]])
+        p = uprob(z)
+        self.assertEqual(z.shape, p.shape)
+        self.assertEqual([uprob(float(v)) for v in z.ravel()], list(p.ravel()))
+
+    def test_sorted_edge_order(self):
+        genes = np.array(['CD3E', 'CD3', 'CD3,', 'CD3-', 'A'], dtype=object)
+        keys = np.array([(h << 32) | t for h in range(5) for t in range(5)], dtype=np.int64)
+        names = [genes[k >> 32] + '----' + genes[k & 0xffffffff] for k in keys]
+        self.assertEqual(sorted(names), [names[i] for i in sorted_edge_order(genes, keys)])
+
+    def test_fold_run(self):
+        keys, counts, mis = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+        keys, counts, mis = fold_run(keys, counts, mis, np.array([5, 3, 5]), np.array([0.1, 0.2, 0.3]))
+        keys, counts, mis = fold_run(keys, counts, mis, np.array([3, 7]), np.array([0.4, 0.5]))
+        self.assertEqual([3, 5, 7], list(keys))
+        self.assertEqual([2, 2, 1], list(counts))
+        self.assertEqual([0.2 + 0.4, 0.1 + 0.3, 0.5], list(mis))
+
+
+HEADER = '>  Input file      test.exp\n>  MI threshold    0.05\n'
+GENES = ['G1', 'G2', 'G3', 'G4']
+RUNS = [
+    [(0, 1, 0.512345), (0, 2, 0.0623411), (1, 0, 0.512345), (2, 0, 0.0623411)],
+    [(0, 1, 0.498765), (1, 0, 0.498765), (1, 3, 0.1), (3, 1, 0.1)],
+    [(0, 1, 0.501112), (0, 3, 0.0700001), (1, 0, 0.501112), (3, 0, 0.0700001)],
+]
+
+
+def write_text_adj(path, edges):
+    rows = {}
+    for hub, target, mi in edges:
+        rows.setdefault(hub, []).append('{}\t{:g}'.format(GENES[target], mi))
+    with open(path, 'w') as f:
+        f.write(HEADER)
+        for hub in sorted(rows):
+            f.write(GENES[hub] + '\t' + '\t'.join(rows[hub]) + '\n')
+
+
+def write_binary_adj(path, edges, compress=False):
+    edges = sorted(edges)
+    body = struct.pack('<I', len(HEADER)) + HEADER.encode()
+    body += struct.pack('<I', len(GENES))
+    for gene in GENES:
+        body += struct.pack('<I', len(gene)) + gene.encode()
+    body += struct.pack('<Q', len(edges))
+    body += np.array([e[0] for e in edges], dtype='<i4').tobytes()
+    body += np.array([e[1] for e in edges], dtype='<i4').tobytes()
+    body += np.array([float('{:g}'.format(e[2])) for e in edges], dtype='<f4').tobytes()
+    stored = zlib.compress(body) if compress else body
+    with open(path, 'wb') as f:
+        f.write(b'SJARADJ1' + struct.pack('<IQQ', int(compress), len(body), len(stored)) + stored)
+
+
+class TestBinaryAdjacency(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def build(self, kind, workers=1):
+        adj_dir = os.path.join(self.folder.name, kind)
+        if not os.path.isdir(adj_dir):
+            os.mkdir(adj_dir)
+        for i, edges in enumerate(RUNS):
+            path = os.path.join(adj_dir, 'run_{:03d}.adj'.format(i + 1))
+            if kind == 'text':
+                write_text_adj(path, edges)
+            else:
+                write_binary_adj(path, edges, compress=(kind == 'zbinary'))
+        out_dir = os.path.join(self.folder.name, 'out_{}_{}'.format(kind, workers))
+        cn(adj_dir, 0.5, out_dir, workers)
+        return out_dir
+
+    def test_read_binary_adjacency(self):
+        path = os.path.join(self.folder.name, 'run.adj')
+        write_binary_adj(path, RUNS[0], compress=True)
+        header, genes, hubs, targets, mis = read_binary_adjacency(path)
+        self.assertEqual(HEADER, header)
+        self.assertEqual(['G1', 'G1', 'G2', 'G3'], list(genes[hubs]))
+        self.assertEqual(['G2', 'G3', 'G1', 'G1'], list(genes[targets]))
+        self.assertEqual([0.512345, 0.0623411, 0.512345, 0.0623411], list(mis))
+
+    def test_restore_text_mi(self):
+        values = [0.1, 0.0343859, 1.23457e-05, 0.999999, 2.5]
+        self.assertEqual(values, list(restore_text_mi(np.array(values, dtype=np.float32))))
+
+    def test_workers(self):
+        serial_dir = self.build('text')
+        parallel_dir = self.build('text', workers=2)
+        for name in ('consensus_network_3col_.txt', 'bootstrap_info_.txt', 'parameter_info_.txt'):
+            with open(os.path.join(serial_dir, name)) as serial, open(os.path.join(parallel_dir, name)) as parallel:
+                self.assertEqual(serial.read().replace(serial_dir, ''), parallel.read().replace(parallel_dir, ''))
+
+    def test_same_consensus_as_text(self):
+        text_dir = self.build('text')
+        for kind in ('binary', 'zbinary'):
+            out_dir = self.build(kind)
+            for name in ('consensus_network_3col_.txt', 'bootstrap_info_.txt'):
+                self.assertTrue(filecmp.cmp(os.path.join(text_dir, name),
+                                            os.path.join(out_dir, name), shallow=False))
+
+
+class TestConsensusAccumulator(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def read_outputs(self, out_dir):
+        outputs = []
+        for name in ('consensus_network_3col_.txt', 'bootstrap_info_.txt'):
+            with open(os.path.join(out_dir, name)) as f:
+                outputs.append(f.read())
+        return outputs
+
+    def test_incremental(self):
+        adj_dir = os.path.join(self.folder.name, 'adj')
+        os.mkdir(adj_dir)
+        accumulator = os.path.join(self.folder.name, 'consensus.npz')
+        for i, edges in enumerate(RUNS):
+            write_text_adj(os.path.join(adj_dir, 'run_{:03d}.adj'.format(i + 1)), edges)
+            cn(adj_dir, 0.5, os.path.join(self.folder.name, 'out'), accumulator=accumulator)
+        self.assertEqual(['run_001.adj', 'run_002.adj', 'run_003.adj'], ConsensusAccumulator(accumulator).runs)
+
+        cn(None, 0.5, os.path.join(self.folder.name, 'out_acc'), accumulator=accumulator)
+        cn(adj_dir, 0.5, os.path.join(self.folder.name, 'out_all'))
+        expected = self.read_outputs(os.path.join(self.folder.name, 'out_all'))
+        self.assertEqual(expected, self.read_outputs(os.path.join(self.folder.name, 'out')))
+        self.assertEqual(expected, self.read_outputs(os.path.join(self.folder.name, 'out_acc')))
+
+    def test_sweep(self):
+        adj_dir = os.path.join(self.folder.name, 'adj')
+        os.mkdir(adj_dir)
+        for i, edges in enumerate(RUNS):
+            write_text_adj(os.path.join(adj_dir, 'run_{:03d}.adj'.format(i + 1)), edges)
+        p_values = ['0.3', '0.5', '1']
+        out_dirs = [os.path.join(self.folder.name, 'pc_' + p_value) for p_value in p_values]
+        networks = create_consensus_networks(adj_dir, p_values, out_dirs)
+        for p_value, out_dir, network in zip(p_values, out_dirs, networks):
+            self.assertEqual(os.path.join(out_dir, 'consensus_network_3col_.txt'), str(network))
+            cn(adj_dir, p_value, os.path.join(self.folder.name, 'out'))
+            self.assertEqual(self.read_outputs(os.path.join(self.folder.name, 'out')), self.read_outputs(out_dir))
+
+
+class TestEnhancedConsensusNetwork(unittest.TestCase):
+    def test_edge_statistics(self):
+        rng = np.random.default_rng(7)
+        genes = ['g{}'.format(i) for i in range(6)]
+        values = rng.integers(0, 5, size=(6, 12)).astype(float)
+        values[5, :] = 3.0  # a constant target gene
+        edges = [('g0', 'g1'), ('g1', 'g0'), ('g2', 'g3'), ('g4', 'g2'), ('g3', 'g5')]
+        with tempfile.TemporaryDirectory() as folder:
+            exp_mat = os.path.join(folder, 'data.exp')
+            with open(exp_mat, 'w') as f:
+                f.write('isoformId\tgeneSymbol\t' + '\t'.join('s{}'.format(i) for i in range(12)) + '\n')
+                for gene, row in zip(genes, values):
+                    f.write('{}\tS{}\t'.format(gene, gene) + '\t'.join(str(v) for v in row) + '\n')
+            network = os.path.join(folder, 'consensus_network_3col_.txt')
+            with open(network, 'w') as f:
+                f.write('source\ttarget\tMI\n')
+                for gene1, gene2 in edges:
+                    f.write('{}\t{}\t0.1234\n'.format(gene1, gene2))
+            subnet = os.path.join(folder, 'subnet.txt')
+            with open(subnet, 'w') as f:
+                f.write('Sg4\n')
+            ecn(exp_mat, network, folder, subnet)
+
+            with open(os.path.join(folder, 'consensus_network_ncol_.txt')) as f:
+                lines = f.read().splitlines()
+            with open(os.path.join(folder, 'sub_consensus_network_ncol_.txt')) as f:
+                self.assertEqual([lines[4]], f.read().splitlines())
+
+        with np.errstate(all='ignore'):
+            for line, (gene1, gene2) in zip(lines[1:], edges):
+                x = values[genes.index(gene1)]
+                y = values[genes.index(gene2)]
+                slope, intercept, r, p, stderr = stats.linregress(x, y)
+                scc, sp = stats.spearmanr(x, y)
+                pcc, pp = stats.pearsonr(x, y)
+                row = [gene1, gene2, 'S' + gene1, 'S' + gene2, '0.1234'] + ['{0:.4f}'.format(v) for v in (pcc, scc, slope, p)]
+                self.assertEqual('\t'.join(row), line)
+
+    def test_nested_networks(self):
+        rng = np.random.default_rng(3)
+        edges = [('g0', 'g1'), ('g1', 'g0'), ('g2', 'g3'), ('g3', 'g1')]
+        with tempfile.TemporaryDirectory() as folder:
+            exp_mat = os.path.join(folder, 'data.exp')
+            with open(exp_mat, 'w') as f:
+                f.write('isoformId\tgeneSymbol\ts0\ts1\ts2\ts3\ts4\n')
+                for i in range(4):
+                    f.write('g{}\tSg{}\t'.format(i, i) + '\t'.join(str(v) for v in rng.random(5)) + '\n')
+            subnet = os.path.join(folder, 'subnet.txt')
+            with open(subnet, 'w') as f:
+                f.write('Sg1\n')
+            networks, out_dirs = [], []
+            for size in (2, 4, 0):
+                out_dirs.append(os.path.join(folder, 'edges_{}'.format(size)))
+                os.mkdir(out_dirs[-1])
+                networks.append(os.path.join(out_dirs[-1], 'consensus_network_3col_.txt'))
+                with open(networks[-1], 'w') as f:
+                    f.write('source\ttarget\tMI\n')
+                    f.writelines('{}\t{}\t0.5\n'.format(gene1, gene2) for gene1, gene2 in edges[:size])
+            create_enhanced_consensus_networks(exp_mat, networks, out_dirs, subnet)
+            for network, out_dir in zip(networks, out_dirs):
+                expected = os.path.join(folder, 'expected')
+                ecn(exp_mat, network, expected, subnet)
+                for name in ('consensus_network_ncol_.txt', 'sub_consensus_network_ncol_.txt'):
+                    self.assertTrue(filecmp.cmp(os.path.join(expected, name), os.path.join(out_dir, name),
+                                                shallow=False))
+
+
 if __name__ == '__main__':
     unittest.main()
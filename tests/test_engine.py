@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+import unittest
+import filecmp
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from SJARACNe import engine
+from SJARACNe.bin.create_consensus_network import read_adjacency, ConsensusAccumulator
+
+EXECUTABLE = os.path.join(os.path.dirname(engine.LIBRARY_PATH), 'sjaracne.exe')
+
+
+@unittest.skipUnless(os.path.exists(engine.LIBRARY_PATH), 'libsjaracne.so is not built (make -C SJARACNe)')
+class TestEngine(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        exp = pd.read_csv('./tests/inputs/Tcell1170.exp', sep='\t')
+        self.gene_ids = exp.iloc[:, 0].astype(str).tolist()
+        self.gene_symbols = exp.iloc[:, 1].astype(str).tolist()
+        self.values = exp.iloc[:, 2:].to_numpy(dtype=engine.value_dtype())
+        with open('./tests/inputs/TcellTF.txt') as f:
+            self.tfs = [line.strip() for line in f if line.strip()]
+
+    def build(self, **kwargs):
+        return engine.build_network(self.values, self.gene_ids, self.gene_symbols, hubs=self.tfs, tfs=self.tfs,
+                                    p_value=1e-7, eps=0.0, bootstrap=True, npar_limit=40, **kwargs)
+
+    def assertSameNetwork(self, a, b):
+        for x, y in zip(a[1:], b[1:]):
+            self.assertTrue(np.array_equal(x, y))
+
+    def test_deterministic(self):
+        values = self.values.copy()
+        network = self.build(seed=2)
+        self.assertTrue(np.array_equal(values, self.values))
+        self.assertGreater(len(network[2]), 0)
+        self.assertSameNetwork(network, self.build(seed=2, threads=3))
+
+    def test_threads(self):
+        networks = {}
+
+        def build(seed):
+            networks[seed] = self.build(seed=seed)
+
+        threads = [threading.Thread(target=build, args=(seed,)) for seed in (1, 2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertSameNetwork(networks[1], self.build(seed=1))
+        self.assertSameNetwork(networks[2], self.build(seed=2))
+
+    @unittest.skipUnless(os.path.exists(EXECUTABLE), 'sjaracne.exe is not built')
+    def test_same_as_executable(self):
+        with tempfile.TemporaryDirectory() as folder:
+            out = os.path.join(folder, 'run.adj')
+            subprocess.check_call([EXECUTABLE, '-i', './tests/inputs/Tcell1170.exp', '-l', './tests/inputs/TcellTF.txt',
+                                   '-s', './tests/inputs/TcellTF.txt', '-p', '1e-7', '-e', '0', '-r', '1',
+                                   '-H', engine.DEFAULT_CONFIG_DIR, '-N', '40', '-S', '3', '-o', out],
+                                  stdout=subprocess.DEVNULL)
+            text = read_adjacency(out)
+            with open(out) as f:
+                lines = [line for line in f if not line.startswith('>')]
+            written = os.path.join(folder, 'written.adj')
+            stats = {}
+            network = self.build(seed=3, out_file=written, stats=stats)
+            with open(written) as f:
+                self.assertEqual(lines, [line for line in f if not line.startswith('>')])
+        self.assertEqual(self.edges(text), self.edges(network))
+        self.assertEqual(sorted(stats), ['dpi', 'mi', 'write'])
+        self.assertGreater(stats['mi']['cpu_seconds'], 0)
+
+    @staticmethod
+    def edges(network):
+        header, genes, hubs, targets, mis = network
+        return list(zip(genes[hubs], genes[targets], ['%.6g' % m for m in mis]))
+
+    def test_pairwise_mi(self):
+        network = engine.build_network(self.values, self.gene_ids, self.gene_symbols, hubs=self.tfs[:5],
+                                       threshold=0.05, npar_limit=40)
+        mis = engine.pairwise_mi(self.values, network[2], network[3], npar_limit=40)
+        self.assertTrue(np.allclose(mis, network[4], atol=1e-3))
+        self.assertEqual(engine.pairwise_mi(self.values, [0], [0])[0], 0.0)
+
+    def test_consensus(self):
+        networks = [self.build(seed=seed) for seed in (1, 2)]
+        accumulator = ConsensusAccumulator()
+        for seed, network in zip((1, 2), networks):
+            accumulator.add('run_{}'.format(seed), network)
+        self.assertEqual(accumulator.runs, ['run_1', 'run_2'])
+        self.assertEqual(accumulator.total_edge_in_runs, [len(network[2]) for network in networks])
+
+
+@unittest.skipUnless(os.path.exists(EXECUTABLE), 'sjaracne.exe is not built')
+class TestConditions(unittest.TestCase):
+    def test_same_as_separate_runs(self):
+        command = [EXECUTABLE, '-i', './tests/inputs/Tcell1170.exp', '-l', './tests/inputs/TcellTF.txt',
+                   '-s', './tests/inputs/TcellTF.txt', '-p', '1e-5', '-e', '0', '-r', '1', '-H',
+                   engine.DEFAULT_CONFIG_DIR, '-N', '40', '-S', '2', '-T', '2']
+        # JUN (57) and FOS (833), both tails of JUN
+        conditions = [('+57', '0.35', 'c57H_0.35'), ('-57', '0.35', 'c57L_0.35'), ('+833', '0.4', 'c833H_0.4')]
+        with tempfile.TemporaryDirectory() as folder:
+            condition_file = os.path.join(folder, 'conditions.txt')
+            with open(condition_file, 'w') as f:
+                f.write(''.join('{} {}\n'.format(probe, percent) for probe, percent, _ in conditions))
+            subprocess.check_call(command + ['-m', condition_file, '-o', os.path.join(folder, 'batch.adj')],
+                                  stdout=subprocess.DEVNULL)
+            for probe, percent, suffix in conditions:
+                out = os.path.join(folder, 'run.adj')
+                subprocess.check_call(command + ['-c', probe, percent, '-o', out], stdout=subprocess.DEVNULL)
+                self.assertTrue(filecmp.cmp(out, os.path.join(folder, 'batch_{}.adj'.format(suffix)),
+                                            shallow=False))
+
+
+@unittest.skipUnless(os.path.exists(EXECUTABLE), 'sjaracne.exe is not built')
+class TestThreads(unittest.TestCase):
+    def test_same_as_serial_run(self):
+        command = [EXECUTABLE, '-i', './tests/inputs/Tcell1170.exp', '-l', './tests/inputs/TcellTF.txt',
+                   '-s', './tests/inputs/TcellTF.txt', '-p', '1e-5', '-e', '0', '-r', '1', '-H', './SJARACNe/config/',
+                   '-N', '40', '-S', '2']
+        with tempfile.TemporaryDirectory() as folder:
+            out_files = [os.path.join(folder, 'T{}.adj'.format(threads)) for threads in (1, 4)]
+            for threads, out_file in zip((1, 4), out_files):
+                subprocess.check_call(command + ['-T', str(threads), '-o', out_file], stdout=subprocess.DEVNULL)
+            self.assertTrue(filecmp.cmp(out_files[0], out_files[1], shallow=False))
+
+
+@unittest.skipUnless(os.path.exists(EXECUTABLE), 'sjaracne.exe is not built')
+class TestBootstraps(unittest.TestCase):
+    def test_same_as_separate_runs(self):
+        command = [EXECUTABLE, '-i', './tests/inputs/Tcell1170.exp', '-l', './tests/inputs/TcellTF.txt',
+                   '-s', './tests/inputs/TcellTF.txt', '-p', '1e-5', '-e', '0', '-r', '1', '-H', './SJARACNe/config/',
+                   '-N', '40']
+        with tempfile.TemporaryDirectory() as folder:
+            subprocess.check_call(command + ['-B', '3', '-S', '2', '-o', os.path.join(folder, 'batch.adj')],
+                                  stdout=subprocess.DEVNULL)
+            # network k of the batch is the one of seed 2 + k - 1
+            for k in (1, 2, 3):
+                out_file = os.path.join(folder, 'run.adj')
+                subprocess.check_call(command + ['-S', str(1 + k), '-o', out_file], stdout=subprocess.DEVNULL)
+                self.assertTrue(filecmp.cmp(out_file, os.path.join(folder, 'batch_{:03d}.adj'.format(k)),
+                                            shallow=False))
+
+
+@unittest.skipUnless(os.path.exists(EXECUTABLE), 'sjaracne.exe is not built')
+class TestBinaryFormat(unittest.TestCase):
+    def test_same_consensus(self):
+        command = [EXECUTABLE, '-i', './tests/inputs/Tcell1170.exp', '-l', './tests/inputs/TcellTF.txt',
+                   '-s', './tests/inputs/TcellTF.txt', '-p', '1e-5', '-e', '0', '-r', '1', '-H', './SJARACNe/config/',
+                   '-N', '40']
+        with tempfile.TemporaryDirectory() as folder:
+            # the networks written by sjaracne.exe in each format, read by create_consensus_network.py
+            out_dirs = []
+            for out_format in ('text', 'binary', 'zbinary'):
+                adj_dir = os.path.join(folder, out_format)
+                os.mkdir(adj_dir)
+                for seed in (1, 2):
+                    subprocess.check_call(command + ['-S', str(seed), '-F', out_format,
+                                                     '-o', os.path.join(adj_dir, 'run_{}.adj'.format(seed))],
+                                          stdout=subprocess.DEVNULL)
+                # the same output directory for all the formats, whose path is written in parameter_info_.txt
+                out_dir = os.path.join(folder, 'consensus')
+                subprocess.check_call([sys.executable, '-m', 'SJARACNe.bin.create_consensus_network', '-a', adj_dir,
+                                       '-p', '1.0', '-e', './tests/inputs/Tcell1170.exp', '-o', out_dir],
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                out_dirs.append(os.path.join(folder, out_format + '_consensus'))
+                os.rename(out_dir, out_dirs[-1])
+            names = sorted(os.listdir(out_dirs[0]))
+            self.assertTrue(names)
+            for out_dir in out_dirs[1:]:
+                self.assertEqual(sorted(os.listdir(out_dir)), names)
+                for name in names:
+                    self.assertTrue(filecmp.cmp(os.path.join(out_dirs[0], name), os.path.join(out_dir, name),
+                                                shallow=False), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+import unittest
+import os
+import json
+import filecmp
+import subprocess
+import sys
+import tempfile
+from SJARACNe.executor import BootstrapCache, bootstrap_command, parse_memory_size, parse_p_values, rollup_metrics
+from SJARACNe.executor import sweep_file
+
+EXECUTABLE = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'SJARACNe', 'bin',
+                          'sjaracne.exe')
+
+
+class TestBootstrapCache(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.cache = BootstrapCache(os.path.join(self.folder.name, 'cache'), max_size=250)
+        self.exp_file = self.write('Tcell.exp', 'isoformId\tgeneSymbol\ta\tb\n')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def write(self, name, text):
+        path = os.path.join(self.folder.name, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def command(self, exp_file=None, out_file='run.adj', seed=1, p_value=1e-7):
+        command = bootstrap_command(exp_file or self.exp_file, './tests/inputs/TcellTF.txt', p_value, 40,
+                                    './SJARACNe/config', out_file, seed)
+        return [sys.executable] + command[1:]
+
+    def test_key(self):
+        key = self.cache.key(self.command())
+        self.assertEqual(key, self.cache.key(self.command(out_file='elsewhere/TF_run_001.adj')))
+        self.assertEqual(key, BootstrapCache(self.cache.path).key(
+            self.command(exp_file=self.write('copy.exp', 'isoformId\tgeneSymbol\ta\tb\n'))))
+        self.assertEqual(key, self.cache.key(self.command() + ['-M', 'run.metrics.json']))
+        self.assertNotEqual(key, self.cache.key(self.command(seed=2)))
+        self.assertNotEqual(key, self.cache.key(self.command(p_value=1e-5)))
+        self.assertNotEqual(key, BootstrapCache(self.cache.path).key(
+            self.command(exp_file=self.write('other.exp', 'isoformId\tgeneSymbol\ta\tc\n'))))
+
+    def test_state_key(self):
+        # the state of a network is shared by all hub gene files, but not by other seeds
+        command = self.command()
+        key = self.cache.state_key(command)
+        hubs = self.write('hubs.txt', 'CD3E\n')
+        for option in ('-l', '-s'):
+            command[command.index(option) + 1] = hubs
+        self.assertNotEqual(self.cache.key(command), self.cache.key(self.command()))
+        self.assertEqual(key, self.cache.state_key(command + ['-I', 'run.state']))
+        self.assertNotEqual(key, self.cache.state_key(self.command(seed=2)))
+
+    def test_fetch_store_evict(self):
+        keys = [self.cache.key(self.command(seed=seed)) for seed in (1, 2, 3)]
+        for i, key in enumerate(keys):
+            self.cache.store(key, self.write('net{}.adj'.format(i), str(i) * 100))
+            os.utime(self.cache.entry(key), (i, i))
+        dst = os.path.join(self.folder.name, 'TF_run_001.adj')
+        self.assertTrue(self.cache.fetch(keys[0], dst))
+        with open(dst) as f:
+            self.assertEqual(f.read(), '0' * 100)
+
+        # keys[0] was just used, so keys[1] is the least recently used network
+        self.cache.evict()
+        self.assertTrue(os.path.exists(self.cache.entry(keys[0])))
+        self.assertFalse(os.path.exists(self.cache.entry(keys[1])))
+        self.assertTrue(os.path.exists(self.cache.entry(keys[2])))
+        self.assertFalse(self.cache.fetch(keys[1], dst))
+
+    def test_parse_memory_size(self):
+        self.assertEqual(parse_memory_size('512'), 512 << 20)
+        self.assertEqual(parse_memory_size('16G'), 16 << 30)
+        self.assertEqual(parse_memory_size('1.5k'), 1536)
+        self.assertRaises(ValueError, parse_memory_size, '16 apples')
+
+    def test_parse_p_values(self):
+        self.assertEqual(parse_p_values(1e-05), ['1e-05'])
+        self.assertEqual(parse_p_values('1e-5, 1e-7'), ['1e-5', '1e-7'])
+        self.assertRaises(ValueError, parse_p_values, '1e-5,0')
+        self.assertRaises(ValueError, parse_p_values, '1e-5,0.00001')
+        self.assertRaises(ValueError, parse_p_values, '1e-5,x')
+
+
+class TestSweep(unittest.TestCase):
+    @unittest.skipUnless(os.path.exists(EXECUTABLE), 'sjaracne.exe is not built')
+    def test_same_as_separate_runs(self):
+        with tempfile.TemporaryDirectory() as folder:
+            def run(p_value, out_file):
+                command = bootstrap_command('./tests/inputs/Tcell1170.exp', './tests/inputs/TcellTF.txt', p_value,
+                                            40, './SJARACNe/config/', os.path.join(folder, out_file), 3)
+                subprocess.check_call([EXECUTABLE] + command[1:], stdout=subprocess.DEVNULL)
+                return command[command.index('-o') + 1]
+
+            out_file = run(['1e-3', '1e-7', '1e-5'], 'sweep.adj')
+            for p_value in ('1e-3', '1e-7', '1e-5'):
+                self.assertTrue(filecmp.cmp(sweep_file(out_file, p_value), run(p_value, p_value + '.adj'),
+                                            shallow=False))
+
+
+class TestIncremental(unittest.TestCase):
+    @unittest.skipUnless(os.path.exists(EXECUTABLE), 'sjaracne.exe is not built')
+    def test_same_as_fresh_run(self):
+        with tempfile.TemporaryDirectory() as folder:
+            probe_file, state_file = os.path.join(folder, 'hubs.txt'), os.path.join(folder, 'run.state')
+            with open('./tests/inputs/TcellTF.txt') as f:
+                hubs = f.read().splitlines()
+
+            def run(out_file, *options):
+                command = bootstrap_command('./tests/inputs/Tcell1170.exp', probe_file, '1e-5', 40,
+                                            './SJARACNe/config/', os.path.join(folder, out_file), 3)
+                return subprocess.check_output([EXECUTABLE] + command[1:] + list(options), universal_newlines=True)
+
+            # hub genes added, then some removed; the network extended from the state is the one built from scratch
+            for step, genes in enumerate([hubs[:100], hubs, hubs[:40] + hubs[70:]]):
+                with open(probe_file, 'w') as f:
+                    f.write('\n'.join(genes) + '\n')
+                log = run('incremental.adj', '-I', state_file)
+                run('fresh.adj')
+                self.assertTrue(filecmp.cmp(os.path.join(folder, 'incremental.adj'), os.path.join(folder, 'fresh.adj'),
+                                            shallow=False))
+                self.assertIn('computed: 27' if step == 1 else 'computed: 0' if step == 2 else 'computing all', log)
+
+
+class TestPrefilter(unittest.TestCase):
+    @unittest.skipUnless(os.path.exists(EXECUTABLE), 'sjaracne.exe is not built')
+    def test_prefilter(self):
+        with tempfile.TemporaryDirectory() as folder:
+            def run(out_file, *options):
+                command = bootstrap_command('./tests/inputs/Tcell1170.exp', './tests/inputs/TcellTF.txt', '1e-5', 40,
+                                            './SJARACNe/config/', os.path.join(folder, out_file), 2)
+                subprocess.check_call([EXECUTABLE] + command[1:] + list(options), stdout=subprocess.DEVNULL)
+                with open(os.path.join(folder, out_file)) as f:
+                    return f.read()
+
+            self.assertEqual(run('rho0.adj', '-R', '0'), run('full.adj'))
+            # validating computes the skipped pairs too, but writes the prefiltered network
+            prefiltered = run('rho.adj', '-R', '0.05', '-M', os.path.join(folder, 'rho.json'))
+            self.assertEqual(run('validated.adj', '-R', '0.05', '-V', 'on', '-M', os.path.join(folder, 'v.json')),
+                             prefiltered)
+            with open(os.path.join(folder, 'rho.json')) as f, open(os.path.join(folder, 'v.json')) as g:
+                counters, validated = json.load(f)['networks'][0]['counters'], json.load(g)['networks'][0]['counters']
+            self.assertGreater(counters['pairs_skipped'], 0)
+            self.assertEqual(counters['pairs_evaluated'] + counters['pairs_skipped'], validated['pairs_evaluated'])
+            self.assertEqual(validated['pairs_above_threshold'] - validated['pairs_missed'],
+                             counters['pairs_above_threshold'])
+
+
+class TestRollupMetrics(unittest.TestCase):
+    def test_rollup_metrics(self):
+        def stats(wall, rss):
+            return {'wall_seconds': wall, 'cpu_seconds': wall / 2, 'peak_rss_bytes': rss}
+
+        def network(seed, pairs, histogram):
+            return {'seed': seed, 'phases': {'mi': stats(2.0, 300), 'write': stats(0.5, 300)},
+                    'counters': {'pairs_evaluated': pairs, 'pairs_above_threshold': 1, 'edges_removed_by_dpi': 0,
+                                 'bytes_written': 10, 'npar_histogram': histogram}}
+
+        with tempfile.TemporaryDirectory() as folder:
+            paths = [os.path.join(folder, name) for name in ('a.json', 'b.json')]
+            reports = [{'total': stats(5.0, 400), 'phases': {'parse': stats(1.0, 100)},
+                        'networks': [network(1, 3, [0, 1, 2]), network(2, 4, [0, 0, 3, 1])]},
+                       {'total': stats(3.0, 350), 'phases': {'parse': stats(1.0, 120)},
+                        'networks': [network(3, 5, [0, 5])]}]
+            for path, report in zip(paths, reports):
+                with open(path, 'w') as f:
+                    json.dump(report, f)
+            rollup = rollup_metrics(paths)
+        self.assertEqual(rollup['networks'], 3)
+        self.assertEqual(rollup['peak_rss_bytes'], 400)
+        self.assertEqual(rollup['phases']['parse'], {'wall_seconds': 2.0, 'cpu_seconds': 1.0, 'peak_rss_bytes': 120})
+        self.assertEqual(rollup['phases']['mi']['wall_seconds'], 6.0)
+        self.assertEqual(rollup['counters']['pairs_evaluated'], 12)
+        self.assertEqual(rollup['counters']['bytes_written'], 30)
+        self.assertEqual(rollup['counters']['npar_histogram'], [0, 6, 5, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
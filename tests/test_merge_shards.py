@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+import unittest
+import filecmp
+import os
+import subprocess
+import tempfile
+from SJARACNe.bin.merge_shards import merge_shards
+from SJARACNe.executor import shard_task
+
+EXECUTABLE = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'SJARACNe', 'bin',
+                          'sjaracne.exe')
+CONFIG_DIR = os.path.join(os.path.dirname(EXECUTABLE), os.pardir, 'config')
+
+
+class TestMergeShards(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def write_shard(self, name, shard, body, input_file='/a/data.exp'):
+        path = os.path.join(self.folder.name, name)
+        with open(path, 'w') as f:
+            f.write('>  Input file      {}\n>  DPI tolerance   0\n>  Shard           {}\n'.format(input_file, shard))
+            f.write(body)
+        return path
+
+    def test_merge_in_shard_order(self):
+        shards = [self.write_shard('b.adj', '2/3', 'B\tX\t0.5\n'), self.write_shard('c.adj', '3/3', ''),
+                  self.write_shard('a.adj', '1/3', 'A\tX\t0.1\nA2\tY\t0.2\n', '/b/data.exp')]
+        out = merge_shards(shards, os.path.join(self.folder.name, 'merged.adj'))
+        with open(out) as f:
+            self.assertEqual(f.read(), '>  Input file      /a/data.exp\n>  DPI tolerance   0\n'
+                                       'A\tX\t0.1\nA2\tY\t0.2\nB\tX\t0.5\n')
+
+    def test_incomplete_or_mixed_shards(self):
+        out = os.path.join(self.folder.name, 'merged.adj')
+        first = self.write_shard('a.adj', '1/2', '')
+        with self.assertRaisesRegex(ValueError, 'missing shards 2 of 2'):
+            merge_shards([first], out)
+        with self.assertRaisesRegex(ValueError, 'given twice'):
+            merge_shards([first, first], out)
+        with self.assertRaisesRegex(ValueError, 'not a shard of the same network'):
+            merge_shards([first, self.write_shard('b.adj', '2/2', '', '/a/other.exp')], out)
+
+    @unittest.skipUnless(os.path.exists(EXECUTABLE), 'sjaracne.exe is not built')
+    def test_same_as_unsharded(self):
+        command = [EXECUTABLE, '-i', './tests/inputs/Tcell1170.exp', '-l', './tests/inputs/TcellTF.txt',
+                   '-s', './tests/inputs/TcellTF.txt', '-p', '1e-5', '-e', '0', '-r', '1', '-H', CONFIG_DIR,
+                   '-N', '40', '-S', '2', '-o', os.path.join(self.folder.name, 'run.adj')]
+        subprocess.check_call(command, stdout=subprocess.DEVNULL)
+        shards = []
+        for shard in range(1, 5):
+            shard_command, _ = shard_task((command, 'run.adj.log'), shard, 4, self.folder.name)
+            subprocess.check_call(shard_command, stdout=subprocess.DEVNULL)
+            shards.append(shard_command[shard_command.index('-o') + 1])
+        merged = merge_shards(shards[::-1], os.path.join(self.folder.name, 'merged.adj'))
+        self.assertTrue(filecmp.cmp(os.path.join(self.folder.name, 'run.adj'), merged, shallow=False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 
 import unittest
+import json
 import tempfile
 import filecmp
 import shlex
 import subprocess
+import sys
 
 
 class TestSJARACNe(unittest.TestCase):
@@ -18,6 +20,20 @@ class TestSJARACNe(unittest.TestCase):
             subprocess.check_call(exe2)
             self.assertTrue(filecmp.cmp('./tests/answerkey/acceptance/cnn_5.txt', '{}/consensus_network_ncol_.txt'.format(tmpdir)))
 
+    def test_acceptance_native(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cmd = '{} -m SJARACNe.sjaracne native -e ./tests/inputs/Tcell1170.exp -g ./tests/inputs/TcellTF.txt -n 5 ' \
+                  '-pc 0.01 -o {}/out -tmp {}/tmp --cores 2 --metrics'.format(sys.executable, tmpdir, tmpdir)
+            exe = shlex.split(cmd)
+            subprocess.check_call(exe)
+            self.assertTrue(filecmp.cmp('./tests/answerkey/acceptance/cnn_5.txt', '{}/out/consensus_network_ncol_.txt'.format(tmpdir)))
+            with open('{}/out/run_report.json'.format(tmpdir)) as f:
+                report = json.load(f)
+            self.assertEqual(report['bootstrap']['networks'], 5)
+            self.assertEqual(sum(report['bootstrap']['counters']['npar_histogram']),
+                             report['bootstrap']['counters']['pairs_evaluated'])
+            self.assertEqual(set(report['bootstrap']['phases']), {'parse', 'bandwidth', 'bootstrap', 'mi', 'dpi', 'write'})
+
 
 if __name__ == '__main__':
     unittest.main()